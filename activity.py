@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Журнал действий игроков: события пишутся в базу фоновым потоком пачками.
+
+Маршрут вызывает activity_log.record(kind, username, **payload) - это только
+постановка в очередь процесса, без обращения к базе. Поток activity-writer
+забирает из очереди пачку до ACTIVITY_BATCH_SIZE событий (или то, что
+накопилось за ACTIVITY_FLUSH_INTERVAL секунд) и пишет ее одним INSERT в
+таблицу activity_events. Строки этой таблицы только добавляются.
+
+Очередь ограничена ACTIVITY_QUEUE_SIZE. Если база не успевает и очередь
+заполнена, поведение задает ACTIVITY_OVERFLOW:
+    drop   - новое событие отбрасывается сразу (по умолчанию: клик не ждет журнала)
+    block  - запрос ждет место в очереди до ACTIVITY_BLOCK_TIMEOUT секунд, затем отбрасывает
+Отброшенные события видны в метрике rgg_activity_events_total{result="dropped"}.
+
+При остановке процесса (atexit и worker_exit в gunicorn.conf.py) flush
+дописывает очередь до конца.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import metrics
+from database import db
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_QUEUE_SIZE = int(os.environ.get('ACTIVITY_QUEUE_SIZE', '10000'))
+ACTIVITY_BATCH_SIZE = int(os.environ.get('ACTIVITY_BATCH_SIZE', '500'))
+ACTIVITY_FLUSH_INTERVAL = float(os.environ.get('ACTIVITY_FLUSH_INTERVAL', '1'))
+ACTIVITY_OVERFLOW = os.environ.get('ACTIVITY_OVERFLOW', 'drop').strip().lower()
+ACTIVITY_BLOCK_TIMEOUT = float(os.environ.get('ACTIVITY_BLOCK_TIMEOUT', '0.05'))
+# Сколько секунд ждать записи очереди при остановке процесса
+ACTIVITY_SHUTDOWN_TIMEOUT = float(os.environ.get('ACTIVITY_SHUTDOWN_TIMEOUT', '10'))
+
+OVERFLOW_POLICIES = ('drop', 'block')
+# Попыток записать пачку, прежде чем она будет потеряна
+WRITE_ATTEMPTS = 3
+
+EVENTS = metrics.Counter('rgg_activity_events_total', 'События журнала действий: queued, written, dropped, failed',
+                         ('result',))
+
+
+class ActivityLog:
+    def __init__(self, max_size=ACTIVITY_QUEUE_SIZE, batch_size=ACTIVITY_BATCH_SIZE,
+                 flush_interval=ACTIVITY_FLUSH_INTERVAL, overflow=ACTIVITY_OVERFLOW,
+                 block_timeout=ACTIVITY_BLOCK_TIMEOUT):
+        if overflow not in OVERFLOW_POLICIES:
+            logger.warning(f"⚠️ Неизвестный ACTIVITY_OVERFLOW={overflow}, используем drop")
+            overflow = 'drop'
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(max_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._exit_registered = False
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def record(self, kind, username=None, **payload):
+        """Ставит событие в очередь; False, если очередь полна и событие отброшено"""
+        event = {'kind': kind, 'username': username, 'payload': payload,
+                 'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+        try:
+            if self.overflow == 'block':
+                self._queue.put(event, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(event)
+        except queue.Full:
+            EVENTS.inc('dropped')
+            return False
+        EVENTS.inc('queued')
+        return True
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='activity-writer', daemon=True)
+        self._thread.start()
+        if not self._exit_registered:
+            atexit.register(self.flush)
+            self._exit_registered = True
+        return self._thread
+
+    def flush(self, timeout=ACTIVITY_SHUTDOWN_TIMEOUT):
+        """Дописывает очередь до конца и останавливает поток записи"""
+        if self._thread is not None and self._thread.is_alive():
+            self._stop.set()
+            self._thread.join(timeout)
+        else:
+            # Поток не запускался (скрипт, тесты) - пишем в текущем потоке
+            while True:
+                batch = self._take(self.batch_size)
+                if not batch:
+                    break
+                self._write(batch)
+        if self.pending:
+            logger.warning(f"⚠️ Журнал действий: при остановке не записано событий: {self.pending}")
+
+    def _take(self, limit, first_timeout=0, window=0):
+        """До limit событий: первое ждем first_timeout секунд, остальные добираем еще window секунд"""
+        try:
+            batch = [self._queue.get(timeout=first_timeout)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + window
+        while len(batch) < limit:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            if self._stop.is_set():
+                # Остановка: дописываем то, что есть, без ожидания
+                batch = self._take(self.batch_size)
+            else:
+                batch = self._take(self.batch_size, first_timeout=0.5, window=self.flush_interval)
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                if db.record_activity_events(batch) is not None:
+                    EVENTS.inc('written', amount=len(batch))
+                    return True
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи журнала действий: {e}")
+            finally:
+                db.release()
+            if attempt < WRITE_ATTEMPTS and not self._stop.is_set():
+                time.sleep(attempt)
+        EVENTS.inc('failed', amount=len(batch))
+        logger.error(f"❌ Журнал действий: потеряно событий: {len(batch)}")
+        return False
+
+
+# Глобальный журнал действий
+activity_log = ActivityLog()
+
+metrics.Gauge('rgg_activity_queue_size', 'События журнала действий, ожидающие записи', lambda: activity_log.pending)
@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
-from flask import Flask, render_template, jsonify, request, redirect, url_for, session, make_response
+from flask import Flask, render_template, jsonify, request, redirect, url_for, session, make_response, g, \
+    has_request_context, Response, send_from_directory, abort
+import collections
 import json
 import os
 import random
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import functools
+import heapq
+import itertools
+import math
+import threading
 import time
 
 # Создаем приложение Flask ПЕРВЫМ
@@ -13,32 +19,36 @@ app.secret_key = os.environ.get('SECRET_KEY', 'taskflow_secret_key_2024')
 
 # Импортируем базу данных ПОСЛЕ создания app
 from database import db
+from activity import activity_log
+from map_points import COLUMNAR_FORMAT, PointColumns, decode_map_config, map_config_payload
+import metrics
+import profiler
+import ratelimit
+from scheduler import scheduler
+from storage import REPLICA_STICKY_SECONDS, OutageWriteRejected
+import tracing
+
+# Заголовок X-Query-Summary со сводкой SQL по запросу (всегда включен в debug)
+QUERY_TRACE_HEADER = os.environ.get('QUERY_TRACE_HEADER') == '1'
 
 
 # Ждем пока база данных подключится
 def wait_for_db():
-    max_retries = 10
-    retry_delay = 3
-
-    for attempt in range(max_retries):
-        try:
-            # Проверяем подключение к БД
-            db.connect()
-            if db.conn and not db.conn.closed:
-                print("✅ База данных готова")
-                return True
-        except Exception as e:
-            print(f"❌ Попытка {attempt + 1}/{max_retries}: База данных не готова: {e}")
-            if attempt < max_retries - 1:
-                print(f"⏳ Ожидание {retry_delay} секунд...")
-                time.sleep(retry_delay)
+    # Повторные попытки подключения выполняет сам бэкенд, при неудаче включается хранилище в памяти
+    db.connect()
+    if db.in_memory:
+        print("⚠️ Работаем с временным хранилищем в памяти")
+        return False
+    print(f"✅ База данных готова ({db.backend.name})")
+    return True
 
-    print("❌ Не удалось подключиться к базе данных")
-    return False
 
+# Под gunicorn --preload база подключается в каждом воркере после fork (см. init_worker)
+DEFER_STARTUP = os.environ.get('RGG_DEFER_STARTUP') == '1'
 
 # Ждем подключения к БД при запуске
-wait_for_db()
+if not DEFER_STARTUP:
+    wait_for_db()
 
 # Кэширование
 _data_cache = {}
@@ -49,14 +59,30 @@ def cached_data(key, timeout=60):
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
+            # key и timeout могут быть функциями - для ключей, зависящих от даты
+            cache_key = key() if callable(key) else key
             now = datetime.now().timestamp()
-            if (key in _data_cache and key in _cache_timeout and now < _cache_timeout[key]):
-                return _data_cache[key]
-            result = func(*args, **kwargs)
-            _data_cache[key] = result
-            _cache_timeout[key] = now + timeout
+            if (cache_key in _data_cache and cache_key in _cache_timeout and now < _cache_timeout[cache_key]):
+                metrics.CACHE_REQUESTS.inc(func.__name__, 'hit')
+                return _data_cache[cache_key]
+            metrics.CACHE_REQUESTS.inc(func.__name__, 'miss')
+            return store(cache_key, func(*args, **kwargs))
+
+        def store(cache_key, result):
+            _data_cache[cache_key] = result
+            _cache_timeout[cache_key] = datetime.now().timestamp() + (timeout() if callable(timeout) else timeout)
             return result
 
+        def refresh(ahead=None):
+            """Перезагружает значение заранее; ahead - только если оно истекает в ближайшие ahead секунд"""
+            cache_key = key() if callable(key) else key
+            expires = _cache_timeout.get(cache_key, 0) if cache_key in _data_cache else 0
+            if ahead is not None and expires > datetime.now().timestamp() + ahead:
+                return False
+            store(cache_key, func())
+            return True
+
+        wrapper.refresh = refresh
         return wrapper
 
     return decorator
@@ -68,14 +94,31 @@ def load_tasks():
     return db.get_tasks_config()
 
 
-@cached_data('daily_tasks', 3600)
+# Ежедневные задачи
+DAILY_TASKS_COUNT = 3
+DAILY_TASKS_SEED = os.environ.get('DAILY_TASKS_SEED', 'rgg-quest')
+DAILY_TASKS_DAYS_AHEAD = int(os.environ.get('DAILY_TASKS_DAYS_AHEAD', 7))
+
+
+def daily_tasks_cache_key():
+    return f"daily_tasks_{date.today().strftime('%Y-%m-%d')}"
+
+
+def seconds_until_midnight():
+    now = datetime.now()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return (midnight - now).total_seconds()
+
+
+@cached_data(daily_tasks_cache_key, seconds_until_midnight)
 def load_daily_tasks():
     today = date.today().strftime('%Y-%m-%d')
     daily_tasks = db.get_daily_tasks(today)
 
     if not daily_tasks:
+        # Обычно набор уже рассчитан фоновым потоком, это запасной путь
         print("🔄 Генерация новых ежедневных задач...")
-        generate_daily_tasks()
+        ensure_daily_tasks(today)
         daily_tasks = db.get_daily_tasks(today)
 
     return daily_tasks or []
@@ -84,15 +127,47 @@ def load_daily_tasks():
 def save_daily_tasks(tasks):
     today = date.today().strftime('%Y-%m-%d')
     db.save_daily_tasks(today, tasks)
-    _data_cache.pop('daily_tasks', None)
+    _data_cache.pop(daily_tasks_cache_key(), None)
 
 
-def generate_daily_tasks():
+def all_task_texts():
     tasks = load_tasks()
     all_tasks = []
-    for key in tasks:
+    for key in sorted(tasks):
         all_tasks.extend(tasks[key])
-    daily = random.sample(all_tasks, min(3, len(all_tasks)))
+    return all_tasks
+
+
+def select_daily_tasks(day):
+    """Детерминированный выбор задач на день: одинаков во всех воркерах"""
+    all_tasks = all_task_texts()
+    rng = random.Random(f"{DAILY_TASKS_SEED}:{day}")
+    return rng.sample(all_tasks, min(DAILY_TASKS_COUNT, len(all_tasks)))
+
+
+def ensure_daily_tasks(day):
+    """Создаем набор задач на день, если его еще нет (ровно один набор на дату)"""
+    if db.get_daily_tasks(day):
+        return False
+    return db.create_daily_tasks(day, select_daily_tasks(day))
+
+
+def precompute_daily_tasks(days_ahead=DAILY_TASKS_DAYS_AHEAD):
+    """Заранее рассчитываем задачи на сегодня и следующие days_ahead дней"""
+    created = 0
+    for offset in range(days_ahead + 1):
+        day = (date.today() + timedelta(days=offset)).strftime('%Y-%m-%d')
+        if ensure_daily_tasks(day):
+            created += 1
+    if created:
+        print(f"📅 Рассчитаны ежедневные задачи на {created} дн.")
+    return created
+
+
+def generate_daily_tasks():
+    """Ручная перегенерация из админки: случайный набор заменяет текущий"""
+    all_tasks = all_task_texts()
+    daily = random.sample(all_tasks, min(DAILY_TASKS_COUNT, len(all_tasks)))
     save_daily_tasks(daily)
 
 
@@ -121,7 +196,47 @@ def add_to_board(task_text, difficulty="Средняя"):
     save_board(board)
 
 
+# Выполненные задачи через ARCHIVE_AFTER_HOURS уходят с доски в архив
+ARCHIVE_AFTER_HOURS = float(os.environ.get('ARCHIVE_AFTER_HOURS', '24'))
+ARCHIVE_INTERVAL = int(os.environ.get('ARCHIVE_INTERVAL', '600'))
+ARCHIVE_BATCH = int(os.environ.get('ARCHIVE_BATCH', '500'))
+
+
+def archive_done_tasks():
+    """Переносим выполненные задачи в архив пачками по ARCHIVE_BATCH"""
+    older_than = (datetime.now() - timedelta(hours=ARCHIVE_AFTER_HOURS)).strftime('%Y-%m-%d %H:%M:%S')
+    total = 0
+    while True:
+        moved = db.archive_done_tasks(older_than, ARCHIVE_BATCH)
+        total += moved
+        if moved < ARCHIVE_BATCH:
+            break
+    if total:
+        _data_cache.pop('board_data', None)
+        print(f"📦 В архив перенесено задач доски: {total}")
+    return total
+
+
+def get_user_context(username):
+    """Контекст текущего пользователя: загружается одним запросом один раз за запрос"""
+    if not has_request_context() or not username or username != session.get('username'):
+        return None
+    if 'user_context' not in g:
+        today = date.today().strftime('%Y-%m-%d')
+        g.user_context = db.get_user_context(username, today)
+    return g.user_context
+
+
+def reset_user_context():
+    """Сбрасываем контекст после изменения данных пользователя"""
+    if has_request_context():
+        g.pop('user_context', None)
+
+
 def get_user_daily_done(username):
+    context = get_user_context(username)
+    if context:
+        return list(context['today_done'])
     today = date.today().strftime('%Y-%m-%d')
     return db.get_user_progress(username, today)
 
@@ -133,6 +248,8 @@ def mark_daily_done(username, task_text):
     if task_text not in tasks_done:
         tasks_done.append(task_text)
         db.save_user_progress(username, today, tasks_done)
+        reset_user_context()
+        activity_log.record('daily_done', username, task=task_text)
 
 
 def unmark_daily_done(username, task_text):
@@ -142,6 +259,8 @@ def unmark_daily_done(username, task_text):
     if task_text in tasks_done:
         tasks_done.remove(task_text)
         db.save_user_progress(username, today, tasks_done)
+        reset_user_context()
+        activity_log.record('daily_undone', username, task=task_text)
         return True
     return False
 
@@ -151,10 +270,12 @@ def add_coins(username, amount):
     if user:
         new_coins = user['coins'] + amount
         db.update_user_coins(username, new_coins)
+        reset_user_context()
+        activity_log.record('coins', username, amount=amount, coins=new_coins)
 
 
 def get_user_coins(username):
-    user = db.get_user(username)
+    user = get_user_context(username) or db.get_user(username)
     return user['coins'] if user else 0
 
 
@@ -179,7 +300,8 @@ def load_map_config():
             'updated_by': 'system'
         }
         db.save_map_config(config, 'system')
-    return config
+    # Активные точки держим в кэше массивами (map_points.PointColumns), а не списком словарей
+    return decode_map_config(config)
 
 
 def save_map_config(config):
@@ -197,8 +319,11 @@ def save_user_position(username, x, y):
 
 def calculate_user_position(username):
     """Рассчитываем прогресс пользователя"""
-    tasks_done = db.get_user_all_progress(username)
-    total_completed = len(tasks_done)
+    context = get_user_context(username)
+    if context:
+        total_completed = context['total_completed']
+    else:
+        total_completed = len(db.get_user_all_progress(username))
 
     # Определяем уровень
     if total_completed < 5:
@@ -222,190 +347,413 @@ def calculate_user_position(username):
 
 
 # Функции для работы с инвентарем
-def init_inventory_table():
-    """Инициализация таблицы инвентаря если она не существует"""
-    if not db.is_connected:
-        return
-
-    try:
-        cur = db.conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS user_inventory (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(50) NOT NULL,
-                name VARCHAR(100) NOT NULL,
-                description TEXT,
-                quantity INTEGER NOT NULL DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        db.conn.commit()
-        cur.close()
-        print("✅ Таблица инвентаря инициализирована")
-    except Exception as e:
-        print(f"❌ Ошибка инициализации таблицы инвентаря: {e}")
-        db.conn.rollback()
-
-
 def get_user_inventory(username):
     """Получаем инвентарь пользователя"""
-    if not db.is_connected:
-        return db.in_memory_storage.get('user_inventory', {}).get(username, [])
-
-    try:
-        cur = db.conn.cursor()
-        cur.execute("""
-            SELECT id, name, description, quantity, created_at, updated_at 
-            FROM user_inventory 
-            WHERE username = %s 
-            ORDER BY created_at DESC
-        """, (username,))
-        inventory = cur.fetchall()
-        cur.close()
-        return [dict(item) for item in inventory]
-    except Exception as e:
-        print(f"Ошибка получения инвентаря: {e}")
-        return []
+    return db.get_user_inventory(username)
 
 
 def add_item_to_inventory(username, name, description, quantity=1):
-    """Добавляем предмет в инвентарь"""
-    if not db.is_connected:
-        if 'user_inventory' not in db.in_memory_storage:
-            db.in_memory_storage['user_inventory'] = {}
-        if username not in db.in_memory_storage['user_inventory']:
-            db.in_memory_storage['user_inventory'][username] = []
-
-        new_id = max([item.get('id', 0) for item in db.in_memory_storage['user_inventory'][username]], default=0) + 1
-        db.in_memory_storage['user_inventory'][username].append({
-            'id': new_id,
-            'name': name,
-            'description': description,
-            'quantity': quantity,
-            'created_at': datetime.now()
-        })
-        return True
-
-    try:
-        cur = db.conn.cursor()
-        cur.execute("""
-            INSERT INTO user_inventory (username, name, description, quantity) 
-            VALUES (%s, %s, %s, %s)
-        """, (username, name, description, quantity))
-        db.conn.commit()
-        cur.close()
-        return True
-    except Exception as e:
-        print(f"Ошибка добавления предмета: {e}")
-        db.conn.rollback()
-        return False
+    """Добавляем предмет в инвентарь, возвращаем id нового предмета (None при ошибке)"""
+    _data_cache.pop('inventories_summary', None)
+    item_id = db.add_item_to_inventory(username, name, description, quantity)
+    if item_id is not None:
+        activity_log.record('item_add', username, id=item_id, name=name, quantity=quantity)
+    return item_id
 
 
 def update_inventory_item_db(username, item_id, updates):
     """Обновляем предмет в инвентаре"""
-    if not db.is_connected:
-        if 'user_inventory' in db.in_memory_storage and username in db.in_memory_storage['user_inventory']:
-            for item in db.in_memory_storage['user_inventory'][username]:
-                if item['id'] == item_id:
-                    item.update(updates)
-                    item['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    return True
-        return False
-
-    try:
-        cur = db.conn.cursor()
-        set_clause = ", ".join([f"{key} = %s" for key in updates.keys()])
-        values = list(updates.values())
-        values.extend([username, item_id])
-
-        cur.execute(f"""
-            UPDATE user_inventory 
-            SET {set_clause}, updated_at = CURRENT_TIMESTAMP 
-            WHERE username = %s AND id = %s
-        """, values)
-        db.conn.commit()
-        cur.close()
-        return True
-    except Exception as e:
-        print(f"Ошибка обновления предмета: {e}")
-        db.conn.rollback()
-        return False
+    success = db.update_inventory_item(username, item_id, updates)
+    if success:
+        activity_log.record('item_update', username, id=item_id, updates=updates)
+    return success
 
 
 def delete_inventory_item_db(username, item_id):
     """Удаляем предмет из инвентаря"""
-    if not db.is_connected:
-        if 'user_inventory' in db.in_memory_storage and username in db.in_memory_storage['user_inventory']:
-            db.in_memory_storage['user_inventory'][username] = [
-                item for item in db.in_memory_storage['user_inventory'][username]
-                if item['id'] != item_id
-            ]
-            return True
-        return False
+    _data_cache.pop('inventories_summary', None)
+    success = db.delete_inventory_item(username, item_id)
+    if success:
+        activity_log.record('item_delete', username, id=item_id)
+    return success
+
+
+# Сколько операций принимает /inventory/batch за один запрос
+INVENTORY_BATCH_LIMIT = int(os.environ.get('INVENTORY_BATCH_LIMIT', '200'))
+
 
+def parse_inventory_operation(raw):
+    """Операция пакета из JSON -> (операция для db.apply_inventory_batch, None) или (None, текст ошибки)"""
+    if not isinstance(raw, dict):
+        return None, 'Операция должна быть объектом'
+    kind = raw.get('op')
     try:
-        cur = db.conn.cursor()
-        cur.execute("DELETE FROM user_inventory WHERE username = %s AND id = %s", (username, item_id))
-        db.conn.commit()
-        cur.close()
-        return True
-    except Exception as e:
-        print(f"Ошибка удаления предмета: {e}")
-        db.conn.rollback()
-        return False
+        if kind == 'add':
+            if not raw.get('name'):
+                return None, 'Название предмета обязательно'
+            return {'op': 'add', 'name': raw['name'], 'description': raw.get('description', ''),
+                    'quantity': int(raw.get('quantity', 1))}, None
+        if kind == 'update':
+            updates = {key: raw[key] for key in ('name', 'description', 'quantity') if key in raw}
+            if 'quantity' in updates:
+                updates['quantity'] = int(updates['quantity'])
+            if not updates:
+                return None, 'Нет полей для изменения'
+            if updates.get('name') == '':
+                return None, 'Название предмета обязательно'
+            return {'op': 'update', 'id': int(raw['id']), 'updates': updates}, None
+        if kind == 'delete':
+            return {'op': 'delete', 'id': int(raw['id'])}, None
+    except (KeyError, TypeError, ValueError):
+        return None, 'Неверный id или количество'
+    return None, f'Неизвестная операция: {kind}'
+
+
+def apply_inventory_batch(username, raw_operations):
+    """Применяем пакет операций одной транзакцией; результат по каждой операции в исходном порядке"""
+    results = []
+    operations = []
+    for raw in raw_operations:
+        operation, error = parse_inventory_operation(raw)
+        results.append({'op': raw.get('op') if isinstance(raw, dict) else None, 'success': False, 'error': error})
+        if operation:
+            operations.append((len(results) - 1, operation))
+    # Удаление вместе с другой операцией над тем же предметом неоднозначно: отклоняем все такие операции
+    targets = collections.Counter(operation['id'] for _, operation in operations if operation['op'] != 'add')
+    conflicts = {operation['id'] for _, operation in operations
+                 if operation['op'] == 'delete' and targets[operation['id']] > 1}
+    if conflicts:
+        for index, operation in operations:
+            if operation.get('id') in conflicts:
+                results[index]['error'] = 'Предмет удаляется и изменяется в одном пакете'
+        operations = [(index, operation) for index, operation in operations if operation.get('id') not in conflicts]
+    if not operations:
+        return results
+
+    applied = db.apply_inventory_batch(username, [operation for _, operation in operations])
+    if applied is None:
+        return None
+    _data_cache.pop('inventories_summary', None)
+    for (index, operation), outcome in zip(operations, applied):
+        result = results[index]
+        if operation['op'] == 'add':
+            result.update(success=outcome is not None, id=outcome)
+        else:
+            result.update(success=bool(outcome), id=operation['id'])
+        result['error'] = None if result['success'] else 'Предмет не найден'
+    applied_ops = [{'op': result['op'], 'id': result['id']} for result in results if result['success']]
+    activity_log.record('inventory_batch', username, operations=applied_ops)
+    return results
 
 
 def get_all_users_with_stats():
-    """Получаем всех пользователей со статистикой и позициями"""
-    users = db.get_all_users()
-    users_with_stats = {}
-    for username, user_data in users.items():
-        user_position = get_user_position(username)
-        users_with_stats[username] = {
-            **user_data,
-            'position': user_position,
-            'registered_date': user_data.get('created_at', 'Неизвестно')
-        }
-    return users_with_stats
+    """Все пользователи (без паролей) с позициями на карте - одним запросом, а не запросом на каждого"""
+    return {user['username']: user for user in db.get_users_page(limit=None)}
 
 
-def get_all_inventories():
-    """Получаем инвентари всех пользователей"""
-    users = db.get_all_users()
-    all_inventories = {}
+# Постраничный вывод: курсор - ключ последней показанной записи (id или имя пользователя)
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', '50'))
+OWNERS_PAGE_SIZE = int(os.environ.get('OWNERS_PAGE_SIZE', '20'))
+BOARD_ACTIVE_STATUSES = ('free', 'taken')
+# Поиск предметов: размер выдачи и допустимая длина запроса
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', '20'))
+SEARCH_MIN_LENGTH = 2
+SEARCH_MAX_LENGTH = 100
+
+
+def paginate(fetch, cursor_of, limit):
+    """Запрашиваем на одну запись больше, чтобы узнать, есть ли следующая страница"""
+    rows = fetch(limit + 1)
+    next_cursor = cursor_of(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def page_limit(default=PAGE_SIZE):
+    return max(1, min(request.args.get('limit', default, type=int), default * 4))
+
+
+def load_board_page(after_id=None, statuses=BOARD_ACTIVE_STATUSES, newest_first=False, limit=PAGE_SIZE):
+    return paginate(lambda n: db.get_board_page(statuses, after_id, n, newest_first), lambda task: task['id'], limit)
+
+
+def load_archive_page(after_id=None, limit=PAGE_SIZE):
+    """Архив для страницы: выполненные задачи, еще не перенесенные с доски, и таблица архива, новые первыми"""
+    def fetch(n):
+        recent = db.get_board_page(('done',), after_id, n, newest_first=True)
+        archived = db.get_archive_page(after_id, n)
+        # Обе выборки уже отсортированы по убыванию id; задача, перенесенная между запросами, попадет в обе
+        merged = heapq.merge(recent, archived, key=lambda task: -task['id'])
+        unique = (next(group) for _, group in itertools.groupby(merged, key=lambda task: task['id']))
+        return list(itertools.islice(unique, n))
+    return paginate(fetch, lambda task: task['id'], limit)
+
+
+def count_archive_tasks():
+    return db.count_board_tasks(('done',)) + db.count_archived_tasks()
+
+
+def load_users_page(after=None, limit=PAGE_SIZE):
+    return paginate(lambda n: db.get_users_page(after, n), lambda user: user['username'], limit)
+
+
+def load_inventory_page(username, after_id=None, limit=PAGE_SIZE):
+    return paginate(lambda n: db.get_inventory_page(username, after_id, n), lambda item: item['id'], limit)
 
-    for username in users.keys():
-        inventory = get_user_inventory(username)
-        if inventory:
-            all_inventories[username] = {
-                'inventory': inventory,
-                'user_info': {
-                    'username': username,
-                    'coins': users[username]['coins']
-                }
-            }
 
-    return all_inventories
+def load_inventory_owners_page(after=None, limit=OWNERS_PAGE_SIZE):
+    return paginate(lambda n: db.get_inventory_owners_page(after, n), lambda owner: owner['username'], limit)
+
+
+@cached_data('users_summary', 30)
+def load_users_summary():
+    return db.get_users_summary() or {'users': 0, 'admins': 0, 'total_coins': 0, 'max_coins': 0}
+
+
+@cached_data('inventories_summary', 30)
+def load_inventories_summary():
+    return db.get_inventories_summary() or {'owners': 0, 'items': 0, 'units': 0, 'max_coins': 0}
+
+
+# Статистика для админки: готовые сводки по дням (rollups.py), а не весь прогресс
+STATS_DAYS = int(os.environ.get('STATS_DAYS', '30'))
+STATS_MAX_DAYS = 366
+STATS_TOP = 10
+
+
+def load_stats(days=STATS_DAYS):
+    """Сводка за последние days дней; сводки маленькие, поэтому без кэша - числа всегда свежие"""
+    today = date.today()
+    period = [(today - timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(days - 1, -1, -1)]
+    stats = db.get_stats(period[0], STATS_TOP)
+    if stats is None:
+        return None
+    week_start = (today - timedelta(days=6)).strftime('%Y-%m-%d')
+    stats['week_players'] = db.count_active_players(week_start)
+    # Дни без выполнений тоже показываем, чтобы график шел без пропусков
+    by_day = {row['date']: row for row in stats['per_day']}
+    stats['per_day'] = [by_day.get(day, {'date': day, 'completions': 0, 'players': 0}) for day in period]
+    stats['days'] = days
+    stats['max_per_day'] = max((row['completions'] for row in stats['per_day']), default=0)
+    return stats
+
+
+def stats_days():
+    return max(1, min(request.args.get('days', STATS_DAYS, type=int), STATS_MAX_DAYS))
+
+
+def page_response(template, items, next_cursor, **context):
+    """Ответ «Показать еще»: данные, готовый HTML карточек и курсор следующей страницы"""
+    return jsonify({
+        'items': items,
+        'html': render_template(template, **context),
+        'next': next_cursor
+    })
+
+
+# Периодические задачи (scheduler.py): общие данные обслуживает один ведущий воркер на все узлы
+MAP_HISTORY_KEEP = int(os.environ.get('MAP_HISTORY_KEEP', '50'))
+ACTIVITY_RETENTION_DAYS = int(os.environ.get('ACTIVITY_RETENTION_DAYS', '90'))
+PRUNE_INTERVAL = int(os.environ.get('PRUNE_INTERVAL', '3600'))
+STATS_ROLLUP_INTERVAL = int(os.environ.get('STATS_ROLLUP_INTERVAL', '3600'))
+STATS_ROLLUP_DAYS = 2
+CACHE_WARM_INTERVAL = int(os.environ.get('CACHE_WARM_INTERVAL', '10'))
+# Кэши, которые прогреваются заранее, чтобы запрос не ждал базу после истечения
+WARM_CACHES = (load_tasks, load_board, load_map_config, load_daily_tasks)
+
+
+def prune_history():
+    """Старые версии карты и события журнала действий старше ACTIVITY_RETENTION_DAYS (0 - не удалять)"""
+    if MAP_HISTORY_KEEP > 0:
+        deleted = db.prune_map_history(MAP_HISTORY_KEEP)
+        if deleted:
+            print(f"🧹 Удалено старых версий карты: {deleted}")
+    if ACTIVITY_RETENTION_DAYS > 0:
+        older_than = (datetime.now() - timedelta(days=ACTIVITY_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+        total = 0
+        while True:
+            deleted = db.prune_activity_events(older_than, ARCHIVE_BATCH)
+            total += deleted
+            if deleted < ARCHIVE_BATCH:
+                break
+        if total:
+            print(f"🧹 Удалено старых событий журнала действий: {total}")
+
+
+def refresh_stats_rollups():
+    """Сверяем сводки последних дней с user_progress: исправляет расхождения после сбоев и ручных правок"""
+    since = (date.today() - timedelta(days=STATS_ROLLUP_DAYS - 1)).strftime('%Y-%m-%d')
+    if db.rebuild_stats(since) is None:
+        raise RuntimeError("Не удалось пересчитать сводки статистики")
+
+
+def warm_caches(ahead=None):
+    for loader in WARM_CACHES:
+        loader.refresh(ahead)
+
+
+# Расчет задач просыпается сразу после полуночи, но не реже раза в час
+scheduler.register('daily_rollover', lambda: min(3600, seconds_until_midnight() + 1), precompute_daily_tasks)
+scheduler.register('board_archive', ARCHIVE_INTERVAL, archive_done_tasks)
+scheduler.register('prune_history', PRUNE_INTERVAL, prune_history)
+scheduler.register('stats_rollups', STATS_ROLLUP_INTERVAL, refresh_stats_rollups)
+# Кэш у каждого процесса свой, поэтому прогрев идет во всех воркерах
+scheduler.register('cache_warm', CACHE_WARM_INTERVAL,
+                   lambda: warm_caches(ahead=2 * CACHE_WARM_INTERVAL), exclusive=False)
+
+
+# Сколько длился прогрев перед приемом запросов (метрика rgg_warmup_seconds)
+_warmup_seconds = 0.0
+
+
+def compile_templates():
+    """Компилирует все шаблоны в кэш Jinja; уже скомпилированные берутся из кэша"""
+    compiled = 0
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        try:
+            app.jinja_env.get_template(name)
+            compiled += 1
+        except Exception as e:
+            print(f"❌ Ошибка компиляции шаблона {name}: {e}")
+    return compiled
+
+
+def warm_up():
+    """Заполняем кэши и компилируем все шаблоны до первого запроса, чтобы его не ждал холодный воркер"""
+    global _warmup_seconds
+    started = time.perf_counter()
+    for loader in WARM_CACHES:
+        try:
+            loader.refresh()
+        except Exception as e:
+            print(f"❌ Ошибка прогрева {loader.__name__}: {e}")
+        finally:
+            db.release()
+    caches_done = time.perf_counter()
+    templates = compile_templates()
+    finished = time.perf_counter()
+    _warmup_seconds = finished - started
+    print(f"🔥 Прогрев за {_warmup_seconds * 1000:.0f} мс: кэши {(caches_done - started) * 1000:.0f} мс, "
+          f"шаблоны ({templates}) {(finished - caches_done) * 1000:.0f} мс")
+    return _warmup_seconds
+
+
+metrics.Gauge('rgg_warmup_seconds', 'Длительность прогрева воркера перед приемом запросов', lambda: _warmup_seconds)
+
+
+def init_worker():
+    """Подключение к базе, прогрев и фоновые потоки - в процессе воркера (post_worker_init в gunicorn.conf.py)"""
+    wait_for_db()
+    warm_up()
+    scheduler.start()
+    activity_log.start()
+
+
+if DEFER_STARTUP:
+    # Под --preload шаблоны компилируются один раз в мастере, и воркеры получают их после fork готовыми
+    compile_templates()
+else:
+    warm_up()
+    scheduler.start()
+    activity_log.start()
 
 
 # Маршруты
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - started,
+                                        request.endpoint or 'unknown', request.method, response.status_code)
+    return tracing.finish_request(response, with_header=app.debug or QUERY_TRACE_HEADER)
+
+
+@app.before_request
+def route_db_reads():
+    """GET-запросы читают реплики, если игрок не записывал данные последние REPLICA_STICKY_SECONDS секунд"""
+    if db.replicas is None:
+        return
+    recent_write = time.time() - session.get('db_wrote_at', 0) < REPLICA_STICKY_SECONDS
+    db.begin_request(request.method in ('GET', 'HEAD') and not recent_write)
+
+
+@app.after_request
+def remember_db_write(response):
+    # Время записи в сессии: следующие запросы игрока увидят свои данные на любом воркере и узле
+    if db.replicas is not None and db.wrote_in_request:
+        session['db_wrote_at'] = time.time()
+    return response
+
+
 @app.before_request
 def load_user_from_cookie():
     if 'username' not in session:
         username = request.cookies.get('remembered_user')
         if username:
-            user = db.get_user(username)
+            # Контекст пользователя загружается здесь же и переиспользуется маршрутом
+            today = date.today().strftime('%Y-%m-%d')
+            user = g.user_context = db.get_user_context(username, today)
             if user:
                 session['username'] = username
                 session['role'] = user['role']
                 session['coins'] = user['coins']
 
 
+@app.before_request
+def apply_rate_limit():
+    """429 с Retry-After, если ведро токенов этого endpoint для игрока или IP пусто (ratelimit.py)"""
+    if ratelimit.limiter is None:
+        return None
+    ip = ratelimit.client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'))
+    retry_after = ratelimit.limiter.check(request.endpoint, request.method, session.get('username'), ip)
+    if not retry_after:
+        return None
+    metrics.RATE_LIMITED.inc(request.endpoint)
+    message = 'Слишком много запросов, попробуйте позже'
+    response = make_response(jsonify({'error': message}) if request.is_json else message, 429)
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+
+@app.before_request
+def start_admin_profiling():
+    """Профилирование запроса по ?_profile=1 или заголовку X-Profile: 1 (только для админа)"""
+    wanted = request.args.get('_profile') == '1' or request.headers.get('X-Profile') == '1'
+    if wanted and session.get('role') == 'admin':
+        if not profiler.profiling_available():
+            g.profile_disabled = True
+            return
+        g.profiler = profiler.SamplingProfiler(threading.get_ident())
+        g.profiler.start()
+
+
+@app.after_request
+def finish_admin_profiling(response):
+    request_profiler = g.pop('profiler', None)
+    if request_profiler is not None:
+        request_profiler.stop()
+        name = profiler.save_profile(request_profiler, request.endpoint)
+        response.headers['X-Profile-Id'] = name
+        response.headers['X-Profile-Samples'] = str(sum(request_profiler.samples.values()))
+    elif g.pop('profile_disabled', False):
+        response.headers['X-Profile-Disabled'] = 'gevent'
+    return response
+
+
+@app.teardown_request
+def release_db_connection(exc):
+    # Соединение из пула нужно следующему запросу
+    db.release()
+
+
 @app.route('/')
 def index():
     daily = load_daily_tasks()
-    board_data = load_board()
+    board_data, board_next = load_board_page()
     today_date = date.today().strftime('%d.%m.%Y')
     user_daily_done = []
     total_completed = 0
@@ -421,6 +769,7 @@ def index():
     return render_template('index.html',
                            daily=daily,
                            board=board_data,
+                           next_cursor=board_next,
                            today_date=today_date,
                            user_daily_done=user_daily_done,
                            total_completed=total_completed,
@@ -437,13 +786,12 @@ def map_page():
         user_coins = get_user_coins(session['username'])
         session['coins'] = user_coins
 
-        # Получаем сохраненную позицию пользователя
-        saved_position = get_user_position(session['username'])
-
         map_config = load_map_config()
 
-        # Получаем данные всех пользователей для отображения их фишек
+        # Получаем данные всех пользователей для отображения их фишек, среди них и сохраненную позицию игрока
         all_users = get_all_users_with_stats()
+        player = all_users.get(session['username'])
+        saved_position = player['position'] if player else get_user_position(session['username'])
 
         return render_template('map.html',
                                total_completed=user_position['total_completed'],
@@ -469,6 +817,7 @@ def save_user_position_route():
         y = float(data.get('y', 75))
 
         save_user_position(session['username'], x, y)
+        activity_log.record('position', session['username'], x=x, y=y)
         return jsonify({'success': True})
 
     except Exception as e:
@@ -491,6 +840,11 @@ def api_save_map():
 
     try:
         data = request.get_json()
+        # Редактор присылает активные точки колонками; старый формат - списком объектов
+        try:
+            data['active_points'] = PointColumns.decode(data.get('active_points'))
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({'error': f'Неверный формат точек: {e}'}), 400
         save_map_config(data)
         return jsonify({'success': True, 'message': 'Карта сохранена'})
 
@@ -554,12 +908,50 @@ def admin():
     board = load_board()
     daily_tasks = load_daily_tasks()
     users = db.get_all_users()
+    award_report = session.pop('award_report', None)
 
     return render_template('admin.html',
                            tasks=tasks,
                            board=board,
                            daily_tasks=daily_tasks,
-                           users=users)
+                           users=users,
+                           award_report=award_report)
+
+
+@app.route('/admin/stats')
+def admin_stats():
+    if 'username' not in session or session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
+    stats = load_stats(stats_days())
+    if stats is None:
+        return "Ошибка при загрузке статистики", 500
+    return render_template('admin_stats.html', stats=stats, rebuild_report=session.pop('stats_rebuild', None))
+
+
+@app.route('/api/admin/stats')
+def api_admin_stats():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    stats = load_stats(stats_days())
+    if stats is None:
+        return jsonify({'error': 'Ошибка при загрузке статистики'}), 500
+    return jsonify(stats)
+
+
+@app.route('/admin/stats/rebuild', methods=['POST'])
+def admin_stats_rebuild():
+    """Пересчет сводок из истории прогресса - то же, что python rollups.py rebuild"""
+    if 'username' not in session or session.get('role') != 'admin':
+        return "Доступ запрещен", 403
+
+    started = time.perf_counter()
+    report = db.rebuild_stats()
+    if report is None:
+        session['stats_rebuild'] = {'error': 'Ошибка пересчета статистики'}
+    else:
+        session['stats_rebuild'] = {**report, 'seconds': round(time.perf_counter() - started, 2)}
+    return redirect(url_for('admin_stats'))
 
 
 @app.route('/admin/save_tasks', methods=['POST'])
@@ -612,7 +1004,6 @@ def update_daily_tasks():
         return "Доступ запрещен", 403
 
     generate_daily_tasks()
-    _data_cache.pop('daily_tasks', None)
 
     return redirect(url_for('admin'))
 
@@ -629,6 +1020,8 @@ def admin_update_coins():
         try:
             coins = int(coins)
             db.update_user_coins(username, coins)
+            reset_user_context()
+            activity_log.record('coins', username, coins=coins, by=session['username'])
             # Обновляем сессию если это текущий пользователь
             if session.get('username') == username:
                 session['coins'] = coins
@@ -638,6 +1031,102 @@ def admin_update_coins():
     return redirect(url_for('admin'))
 
 
+def parse_coin_awards(text):
+    """Разбираем список строк вида "username amount" или "username,amount" """
+    awards = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = line.replace(';', ',').replace(',', ' ').split()
+        if len(parts) != 2:
+            raise ValueError(f"Неверная строка: {line}")
+        awards.append((parts[0], int(parts[1])))
+    return awards
+
+
+# Сессия Flask - подписанная cookie (~4 КБ), а событие журнала действий - строка в базе: в отчет для админки
+# и в журнал кладем счетчики и только начало списков
+AWARD_REPORT_NAMES = 20
+AWARD_REPORT_ERROR_LENGTH = 300
+
+
+def short_award_report(report):
+    """Отчет о начислении для сессии и журнала действий: полные списки игроков переполнили бы cookie"""
+    short = {'affected': report['affected'], 'mode': report.get('mode')}
+    for field in ('users', 'missing'):
+        names = report.get(field) or []
+        short[field] = names[:AWARD_REPORT_NAMES]
+        short[f'{field}_more'] = max(0, len(names) - AWARD_REPORT_NAMES)
+    return short
+
+
+def run_coin_award(mode, amount=None, task_text=None, awards_text=''):
+    """Выполняем массовое начисление монет, возвращаем отчет"""
+    if mode == 'all':
+        report = db.award_coins_all(int(amount))
+    elif mode == 'completed':
+        today = date.today().strftime('%Y-%m-%d')
+        report = db.award_coins_completed(today, int(amount), task_text or None)
+    elif mode == 'list':
+        report = db.award_coins_list(parse_coin_awards(awards_text))
+    else:
+        raise ValueError(f"Неизвестный режим: {mode}")
+
+    if report is None:
+        raise RuntimeError("Ошибка базы данных при начислении монет")
+    reset_user_context()
+    report['mode'] = mode
+    activity_log.record('coins_award', session.get('username'), **short_award_report(report))
+
+    # Обновляем сессию если текущий пользователь получил монеты
+    if session.get('username') in report['users']:
+        session['coins'] = get_user_coins(session['username'])
+    return report
+
+
+@app.route('/admin/award_coins', methods=['POST'])
+def admin_award_coins():
+    if 'username' not in session or session.get('role') != 'admin':
+        return "Доступ запрещен", 403
+
+    awards_text = request.form.get('awards', '')
+    awards_file = request.files.get('awards_file')
+    if awards_file and awards_file.filename:
+        awards_text += '\n' + awards_file.read().decode('utf-8-sig')
+
+    try:
+        report = run_coin_award(request.form.get('mode'),
+                                request.form.get('amount'),
+                                request.form.get('task', '').strip(),
+                                awards_text)
+        session['award_report'] = short_award_report(report)
+    except (ValueError, TypeError, RuntimeError) as e:
+        session['award_report'] = {'error': str(e)[:AWARD_REPORT_ERROR_LENGTH]}
+
+    return redirect(url_for('admin'))
+
+
+@app.route('/api/admin/award_coins', methods=['POST'])
+def api_admin_award_coins():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    data = request.get_json() or {}
+    awards = data.get('awards', [])
+    # Список можно передать как [{"username": ..., "amount": ...}] или как текст
+    if isinstance(awards, list):
+        awards = '\n'.join(f"{a['username']} {a['amount']}" for a in awards)
+
+    try:
+        report = run_coin_award(data.get('mode'), data.get('amount'), data.get('task'), awards)
+        return jsonify({'success': True, **report})
+    except (ValueError, TypeError, KeyError) as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/admin/update_game', methods=['POST'])
 def admin_update_game():
     if 'username' not in session or session.get('role') != 'admin':
@@ -649,18 +1138,12 @@ def admin_update_game():
     if username:
         try:
             # Обновляем игру пользователя
-            if db.is_connected:
-                cur = db.conn.cursor()
-                cur.execute("UPDATE users SET role = %s WHERE username = %s", (game, username))
-                db.conn.commit()
-                cur.close()
-            else:
-                if username in db.in_memory_storage['users']:
-                    db.in_memory_storage['users'][username]['role'] = game
+            db.update_user_role(username, game)
 
             # Обновляем сессию если это текущий пользователь
             if session.get('username') == username:
                 session['role'] = game
+                reset_user_context()
 
         except Exception as e:
             print(f"Ошибка обновления игры: {e}")
@@ -682,6 +1165,7 @@ def take_task(task_id):
             'taken_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         })
         _data_cache.pop('board_data', None)
+        activity_log.record('board_take', session['username'], id=task_id, text=task['text'])
 
     return redirect(url_for('index'))
 
@@ -699,6 +1183,7 @@ def mark_done(task_id):
             'done_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         })
         _data_cache.pop('board_data', None)
+        activity_log.record('board_done', session['username'], id=task_id, text=task['text'])
 
         # Обновляем прогресс пользователя
         mark_daily_done(session['username'], f"Задача с доски: {task['text']}")
@@ -711,9 +1196,10 @@ def archive():
     if 'username' not in session or session.get('role') != 'admin':
         return "Доступ запрещен", 403
 
-    board_data = [t for t in load_board() if t['status'] == 'done']
+    board_data, next_cursor = load_archive_page()
     user_coins = get_user_coins(session.get('username', '')) if 'username' in session else 0
-    return render_template('archive.html', board=board_data, user_coins=user_coins)
+    return render_template('archive.html', board=board_data, next_cursor=next_cursor,
+                           done_total=count_archive_tasks(), user_coins=user_coins)
 
 
 @app.route('/mark_daily_done', methods=['POST'])
@@ -747,11 +1233,13 @@ def users_list():
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    users_with_stats = get_all_users_with_stats()
+    users_page, next_cursor = load_users_page()
     user_coins = get_user_coins(session['username'])
 
     return render_template('users.html',
-                           users=users_with_stats,
+                           users=users_page,
+                           next_cursor=next_cursor,
+                           summary=load_users_summary(),
                            user_coins=user_coins)
 
 
@@ -764,14 +1252,13 @@ def inventory():
     username = session['username']
     user_coins = get_user_coins(username)
 
-    # Инициализируем таблицу если нужно
-    init_inventory_table()
-
-    # Получаем инвентарь пользователя из базы данных
-    user_inventory = get_user_inventory(username)
+    # Первая страница инвентаря; остальные - через /api/inventory
+    user_inventory, next_cursor = load_inventory_page(username)
 
     return render_template('inventory.html',
                            user_inventory=user_inventory,
+                           next_cursor=next_cursor,
+                           summary=db.get_inventory_summary(username) or {'items': 0, 'stacks': 0, 'units': 0},
                            user_coins=user_coins)
 
 
@@ -782,13 +1269,90 @@ def all_inventories():
         return redirect(url_for('login'))
 
     user_coins = get_user_coins(session['username'])
-    all_inventories_data = get_all_inventories()
+    owners, next_cursor = load_inventory_owners_page()
 
     return render_template('all_inventories.html',
-                           all_inventories=all_inventories_data,
+                           owners=owners,
+                           next_cursor=next_cursor,
+                           summary=load_inventories_summary(),
                            user_coins=user_coins)
 
 
+# «Показать еще»: следующие страницы по курсору ?after=
+@app.route('/api/board')
+def api_board_page():
+    if 'username' not in session:
+        return jsonify({'error': 'Не авторизован'}), 401
+    tasks, next_cursor = load_board_page(request.args.get('after', type=int), limit=page_limit())
+    return page_response('partials/board_tasks.html', tasks, next_cursor, board=tasks)
+
+
+@app.route('/api/archive')
+def api_archive_page():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    tasks, next_cursor = load_archive_page(request.args.get('after', type=int), limit=page_limit())
+    return page_response('partials/archive_rows.html', tasks, next_cursor, board=tasks)
+
+
+@app.route('/api/users')
+def api_users_page():
+    if 'username' not in session:
+        return jsonify({'error': 'Не авторизован'}), 401
+    users_page, next_cursor = load_users_page(request.args.get('after'), limit=page_limit())
+    return page_response('partials/user_cards.html', users_page, next_cursor, users=users_page)
+
+
+@app.route('/api/inventory')
+def api_inventory_page():
+    if 'username' not in session:
+        return jsonify({'error': 'Не авторизован'}), 401
+    items, next_cursor = load_inventory_page(session['username'], request.args.get('after', type=int),
+                                             limit=page_limit())
+    return page_response('partials/inventory_items.html', items, next_cursor, user_inventory=items)
+
+
+@app.route('/api/all_inventories')
+def api_all_inventories_page():
+    if 'username' not in session:
+        return jsonify({'error': 'Не авторизован'}), 401
+    owners, next_cursor = load_inventory_owners_page(request.args.get('after'),
+                                                     limit=page_limit(OWNERS_PAGE_SIZE))
+    return page_response('partials/inventory_owners.html', owners, next_cursor, owners=owners)
+
+
+@app.route('/api/admin/activity')
+def api_admin_activity():
+    """Журнал действий, новые первыми; ?user= - только один игрок, ?after= - курсор"""
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    after_id = request.args.get('after', type=int)
+    username = request.args.get('user') or None
+    events, next_cursor = paginate(lambda n: db.get_activity_page(after_id, n, username), lambda event: event['id'],
+                                   page_limit())
+    return jsonify({'items': events, 'next': next_cursor})
+
+
+@app.route('/api/admin/jobs')
+def api_admin_jobs():
+    """Периодические задачи: запуски в этом воркере и последние запуски ведущего из хранилища"""
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    return jsonify({**scheduler.status(), 'runs': db.get_job_runs()})
+
+
+@app.route('/api/inventory/search')
+def api_inventory_search():
+    """Поиск предметов всех игроков по названию и описанию (по началу слова и нечеткий)"""
+    if 'username' not in session:
+        return jsonify({'error': 'Не авторизован'}), 401
+    query = request.args.get('q', '').strip()
+    if len(query) < SEARCH_MIN_LENGTH:
+        return jsonify({'error': f'Запрос короче {SEARCH_MIN_LENGTH} символов'}), 400
+    results = db.search_inventory(query[:SEARCH_MAX_LENGTH], limit=page_limit(SEARCH_PAGE_SIZE))
+    return page_response('partials/inventory_search_results.html', results, None, results=results)
+
+
 @app.route('/inventory/add', methods=['POST'])
 def add_inventory_item():
     """Добавление предмета в инвентарь"""
@@ -804,10 +1368,10 @@ def add_inventory_item():
         if not item_name:
             return jsonify({'error': 'Название предмета обязательно'}), 400
 
-        success = add_item_to_inventory(session['username'], item_name, item_description, item_quantity)
+        item_id = add_item_to_inventory(session['username'], item_name, item_description, item_quantity)
 
-        if success:
-            return jsonify({'success': True, 'message': 'Предмет добавлен в инвентарь'})
+        if item_id:
+            return jsonify({'success': True, 'id': item_id, 'message': 'Предмет добавлен в инвентарь'})
         else:
             return jsonify({'error': 'Ошибка при добавлении предмета'}), 500
 
@@ -839,6 +1403,8 @@ def update_inventory_item(item_id):
         else:
             return jsonify({'error': 'Ошибка при обновлении предмета'}), 500
 
+    except OutageWriteRejected as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -857,15 +1423,71 @@ def delete_inventory_item(item_id):
         else:
             return jsonify({'error': 'Ошибка при удалении предмета'}), 500
 
+    except OutageWriteRejected as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/inventory/batch', methods=['POST'])
+def inventory_batch():
+    """Пакет добавлений, изменений и удалений предметов одной транзакцией"""
+    if 'username' not in session:
+        return jsonify({'error': 'Не авторизован'}), 401
+
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else data
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'Ожидается непустой список операций'}), 400
+    if len(operations) > INVENTORY_BATCH_LIMIT:
+        return jsonify({'error': f'Не больше {INVENTORY_BATCH_LIMIT} операций за запрос'}), 400
+
+    try:
+        results = apply_inventory_batch(session['username'], operations)
+    except OutageWriteRejected as e:
+        return jsonify({'error': str(e)}), 503
+    if results is None:
+        return jsonify({'error': 'Ошибка при изменении инвентаря'}), 500
+    return jsonify({
+        'success': all(result['success'] for result in results),
+        'applied': sum(1 for result in results if result['success']),
+        'results': results
+    })
+
+
+@app.route('/admin/profiles')
+def admin_profiles():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    return jsonify({'profiles': profiler.list_profiles()})
+
+
+@app.route('/admin/profiles/<name>')
+def admin_profile_download(name):
+    if 'username' not in session or session.get('role') != 'admin':
+        return "Доступ запрещен", 403
+    if not profiler.PROFILE_NAME.match(name):
+        abort(404)
+    return send_from_directory(profiler.PROFILE_DIR, name, as_attachment=True)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики Prometheus; если задан METRICS_TOKEN, требуется ?token= или Bearer"""
+    token = os.environ.get('METRICS_TOKEN')
+    if token:
+        provided = request.args.get('token') or request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if provided != token:
+            return "Доступ запрещен", 403
+    return Response(metrics.render_all(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
 # API маршруты
 @app.route('/api/map/config')
 def api_map_config():
+    # ?format=columnar - активные точки тремя массивами base64 вместо списка объектов
     config = load_map_config()
-    return jsonify(config)
+    return jsonify(map_config_payload(config, columnar=request.args.get('format') == COLUMNAR_FORMAT))
 
 
 if __name__ == '__main__':
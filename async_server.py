@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Асинхронный сервер на gevent: то же Flask-приложение, но каждый запрос - гринлет.
+
+JSON-обработчики (/map/save_position, /inventory/*, /api/map/*, действия доски)
+почти все время ждут PostgreSQL и под обычным сервером занимают поток целиком.
+Здесь ожидание сокета psycopg2 отдает управление другим гринлетам, поэтому
+один процесс держит тысячи запросов одновременно, а в базу параллельно ходят
+не больше DB_POOL_SIZE из них. Страницы обслуживаются тем же сервером без
+изменений.
+
+Запуск:
+    python async_server.py
+    gunicorn -k gevent async_server:app
+"""
+from gevent import monkey
+
+# Патчим стандартную библиотеку до импорта всего остального
+monkey.patch_all()
+
+import os
+
+import psycopg2
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+from gevent.socket import wait_read, wait_write
+from psycopg2 import extensions
+
+# Сколько запросов сервер держит одновременно
+ASYNC_MAX_CONNECTIONS = int(os.environ.get('ASYNC_MAX_CONNECTIONS', '5000'))
+
+
+def gevent_wait_callback(conn, timeout=None):
+    """Ожидание ответа PostgreSQL через хаб gevent вместо блокировки процесса"""
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Неожиданное состояние соединения: {state}")
+
+
+def patch_psycopg():
+    """Делает psycopg2 кооперативным: до первого соединения с базой"""
+    extensions.set_wait_callback(gevent_wait_callback)
+
+
+patch_psycopg()
+
+# Приложение подключается к базе при импорте (под gunicorn - в post_worker_init), поэтому импортируем его после патчей
+from app import app  # noqa: E402
+
+
+def main():
+    port = int(os.environ.get('PORT', 8000))
+    server = WSGIServer(('0.0.0.0', port), app, spawn=Pool(ASYNC_MAX_CONNECTIONS), log=None)
+    print(f"🚀 RGG QUEST (gevent) запущен на порту: {port}, до {ASYNC_MAX_CONNECTIONS} запросов одновременно")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
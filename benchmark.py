@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""Нагрузочный бенчмарк маршрутов RGG QUEST.
+
+Запускает приложение (или подключается к уже запущенному по --url), создает
+параллельных игроков и гоняет по всем основным маршрутам. Печатает пропускную
+способность и задержки p50/p95/p99 по каждому маршруту и сравнивает их с
+сохраненным базовым прогоном.
+
+Примеры:
+    python benchmark.py --backend memory
+    python benchmark.py --backend postgres --database-url postgresql://localhost/rgg_bench
+    python benchmark.py --backend sqlite
+    python benchmark.py --backend postgres --server gevent
+    python benchmark.py --backend memory --save-baseline
+    python benchmark.py --url http://127.0.0.1:8000 --players 50 --duration 60
+
+Внимание: при --seed-board (включено по умолчанию для запускаемого сервера)
+доска задач перезаписывается - используйте отдельную базу для бенчмарков.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# Сценарий игрока: (название, вес)
+SCENARIO = [
+    ('GET /', 20),
+    ('GET /map', 10),
+    ('GET /users', 5),
+    ('GET /all_inventories', 5),
+    ('GET /inventory', 5),
+    ('GET /api/map/config', 10),
+    ('POST /map/save_position', 20),
+    ('POST /board/take', 5),
+    ('POST /inventory/add', 8),
+    ('POST /inventory/update', 6),
+    ('POST /inventory/delete', 6),
+]
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Не следуем редиректам: измеряем сам обработчик, а не страницу после него"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Player:
+    def __init__(self, base_url, username, password):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            NoRedirect()
+        )
+        self.item_ids = []
+
+    def request(self, method, path, form=None, payload=None):
+        """Выполняет запрос, возвращает (статус, тело)"""
+        data = None
+        headers = {}
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode('utf-8')
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif payload is not None:
+            data = json.dumps(payload).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        elif method == 'POST':
+            data = b''
+
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def login(self):
+        status, _ = self.request('POST', '/register', form={'username': self.username, 'password': self.password})
+        if status >= 400:
+            status, _ = self.request('POST', '/login', form={'username': self.username, 'password': self.password})
+        return status < 400
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {name: [] for name, _ in SCENARIO}
+        self.errors = {name: 0 for name, _ in SCENARIO}
+
+    def record(self, name, elapsed, ok):
+        with self.lock:
+            self.latencies[name].append(elapsed)
+            if not ok:
+                self.errors[name] += 1
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_action(player, name, board_ids):
+    if name == 'GET /':
+        return player.request('GET', '/')
+    if name == 'GET /map':
+        return player.request('GET', '/map')
+    if name == 'GET /users':
+        return player.request('GET', '/users')
+    if name == 'GET /all_inventories':
+        return player.request('GET', '/all_inventories')
+    if name == 'GET /inventory':
+        return player.request('GET', '/inventory')
+    if name == 'GET /api/map/config':
+        return player.request('GET', '/api/map/config')
+    if name == 'POST /map/save_position':
+        return player.request('POST', '/map/save_position',
+                              payload={'x': round(random.uniform(0, 100), 2), 'y': round(random.uniform(0, 100), 2)})
+    if name == 'POST /board/take':
+        task_id = random.choice(board_ids) if board_ids else 1
+        return player.request('POST', f'/board/take/{task_id}')
+    if name == 'POST /inventory/add':
+        status, body = player.request('POST', '/inventory/add',
+                                      payload={'name': f'Предмет {random.randint(1, 10 ** 6)}',
+                                               'description': 'Бенчмарк', 'quantity': random.randint(1, 5)})
+        if status == 200:
+            item_id = json.loads(body).get('id')
+            if item_id:
+                player.item_ids.append(item_id)
+        return status, body
+    if name == 'POST /inventory/update':
+        if not player.item_ids:
+            return run_action(player, 'POST /inventory/add', board_ids)
+        item_id = random.choice(player.item_ids)
+        return player.request('POST', f'/inventory/update/{item_id}', payload={'quantity': random.randint(1, 9)})
+    if name == 'POST /inventory/delete':
+        if not player.item_ids:
+            return run_action(player, 'POST /inventory/add', board_ids)
+        item_id = player.item_ids.pop(random.randrange(len(player.item_ids)))
+        return player.request('POST', f'/inventory/delete/{item_id}')
+    raise ValueError(name)
+
+
+def player_loop(player, results, board_ids, deadline, max_requests):
+    names = [name for name, _ in SCENARIO]
+    weights = [weight for _, weight in SCENARIO]
+    done = 0
+    while time.perf_counter() < deadline and (not max_requests or done < max_requests):
+        name = random.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            status, _ = run_action(player, name, board_ids)
+            ok = status < 400
+        except Exception:
+            ok = False
+        results.record(name, time.perf_counter() - started, ok)
+        done += 1
+
+
+def seed_board(base_url, size):
+    """Заполняем доску свободными задачами от имени админа, возвращаем их id"""
+    admin = Player(base_url, 'admin', 'password')
+    admin.request('POST', '/login', form={'username': 'admin', 'password': 'password'})
+    form = [('board_tasks[]', f'Бенчмарк-задача {i}') for i in range(size)]
+    form += [('board_difficulties[]', 'Средняя') for _ in range(size)]
+    admin.request('POST', '/admin/save_board', form=form)
+    _, body = admin.request('GET', '/')
+    return [int(task_id) for task_id in re.findall(r'/board/take/(\d+)', body.decode('utf-8'))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+SERVER_SCRIPTS = {'threaded': 'app.py', 'gevent': 'async_server.py'}
+
+
+def start_server(backend, database_url, server_kind='threaded'):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port))
+    env.pop('USE_IN_MEMORY_DB', None)
+    env['STORAGE_BACKEND'] = backend
+    # Каждый прогон начинается с чистого хранилища
+    env['MEMORY_STORE_DIR'] = ''
+    if backend == 'sqlite':
+        env['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='rgg_bench_'), 'bench.sqlite3')
+    elif backend == 'postgres' and database_url:
+        env['DATABASE_URL'] = database_url
+    server = subprocess.Popen([sys.executable, SERVER_SCRIPTS[server_kind]], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('Сервер завершился при запуске')
+        try:
+            urllib.request.urlopen(base_url + '/api/map/config', timeout=2).read()
+            return server, base_url
+        except Exception:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError('Сервер не запустился за 120 секунд')
+
+
+def summarize(results, elapsed):
+    routes = {}
+    total = 0
+    for name, _ in SCENARIO:
+        values = sorted(results.latencies[name])
+        total += len(values)
+        routes[name] = {
+            'requests': len(values),
+            'errors': results.errors[name],
+            'throughput': round(len(values) / elapsed, 2),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+        }
+    return {'elapsed': round(elapsed, 2), 'requests': total, 'throughput': round(total / elapsed, 2), 'routes': routes}
+
+
+def print_report(report):
+    print(f"\n📊 Бэкенд: {report['backend']}, игроков: {report['players']}, "
+          f"время: {report['elapsed']} с, запросов: {report['requests']}, RPS: {report['throughput']}")
+    print(f"{'Маршрут':<28}{'запросов':>10}{'ошибок':>8}{'RPS':>9}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}")
+    for name, stats in report['routes'].items():
+        print(f"{name:<28}{stats['requests']:>10}{stats['errors']:>8}{stats['throughput']:>9}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+
+
+def compare_with_baseline(report, baseline, tolerance):
+    """Возвращает список регрессий относительно базового прогона"""
+    regressions = []
+    for name, stats in report['routes'].items():
+        base = baseline['routes'].get(name)
+        if not base or not base['requests'] or not stats['requests']:
+            continue
+        if stats['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']} → {stats['p95_ms']} мс")
+        if stats['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f"{name}: RPS {base['throughput']} → {stats['throughput']}")
+        if stats['errors'] > base['errors']:
+            regressions.append(f"{name}: ошибок {base['errors']} → {stats['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный бенчмарк маршрутов RGG QUEST')
+    parser.add_argument('--backend', choices=['memory', 'postgres', 'sqlite'], default='memory',
+                        help='какой бэкенд запускать (игнорируется при --url)')
+    parser.add_argument('--database-url', default=os.environ.get('BENCH_DATABASE_URL'),
+                        help='локальная база PostgreSQL для --backend postgres')
+    parser.add_argument('--server', choices=list(SERVER_SCRIPTS), default='threaded',
+                        help='обычный Flask-сервер или gevent (async_server.py)')
+    parser.add_argument('--url', help='адрес уже запущенного сервера')
+    parser.add_argument('--players', type=int, default=20, help='число параллельных игроков')
+    parser.add_argument('--duration', type=float, default=20, help='длительность прогона в секундах')
+    parser.add_argument('--requests', type=int, default=0, help='лимит запросов на игрока (0 - без лимита)')
+    parser.add_argument('--board-size', type=int, default=50, help='сколько задач положить на доску')
+    parser.add_argument('--seed-board', action=argparse.BooleanOptionalAction, default=None,
+                        help='перезаписать доску задачами для бенчмарка')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='файл с базовыми результатами')
+    parser.add_argument('--save-baseline', action='store_true', help='сохранить прогон как базовый')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимое ухудшение (0.2 = 20%%)')
+    parser.add_argument('--output', help='сохранить результаты прогона в JSON')
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+        backend = args.backend
+        seed = bool(args.seed_board)
+    else:
+        print(f"🚀 Запускаем сервер ({args.backend}, {args.server})...")
+        server, base_url = start_server(args.backend, args.database_url, args.server)
+        # Базовые прогоны разных серверов храним отдельно
+        backend = args.backend if args.server == 'threaded' else f'{args.backend}-{args.server}'
+        seed = args.seed_board is not False
+
+    try:
+        board_ids = seed_board(base_url, args.board_size) if seed else []
+
+        run_id = random.randint(1000, 9999)
+        players = [Player(base_url, f'bench_{run_id}_{i}', 'bench') for i in range(args.players)]
+        for player in players:
+            if not player.login():
+                raise RuntimeError(f'Не удалось войти как {player.username}')
+
+        results = Results()
+        started = time.perf_counter()
+        deadline = started + args.duration
+        threads = [threading.Thread(target=player_loop, args=(player, results, board_ids, deadline, args.requests))
+                   for player in players]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    report = {'backend': backend, 'players': args.players, **summarize(results, elapsed)}
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baselines = json.load(f)
+
+    if args.save_baseline:
+        baselines[backend] = report
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, ensure_ascii=False, indent=2)
+        print(f"💾 Базовый прогон для '{backend}' сохранен в {args.baseline}")
+        return 0
+
+    if backend not in baselines:
+        print(f"ℹ️ Нет базового прогона для '{backend}' - сравнение пропущено")
+        return 0
+
+    regressions = compare_with_baseline(report, baselines[backend], args.tolerance)
+    if regressions:
+        print("\n❌ Регрессии относительно базового прогона:")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+    print("\n✅ Регрессий нет")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""Выгрузка и загрузка всех данных игры в сжатом NDJSON.
+
+Каждая таблица - файл <таблица>.ndjson.gz (одна строка JSON на запись) плюс
+manifest.json с числом строк. Данные идут потоком в обе стороны, память не
+зависит от объема:
+
+- выгрузка из PostgreSQL читает серверным курсором пачками по --batch строк;
+- загрузка в PostgreSQL идет через COPY во временную таблицу и
+  INSERT ... ON CONFLICT DO NOTHING, после чего счетчики SERIAL сдвигаются
+  за максимальный id;
+- SQLite читается курсором и пишется executemany пачками.
+
+Команда load-json загружает тем же путем JSON-файлы из корня репозитория
+(tasks.json, map_config.json, users.json, daily_tasks.json,
+user_progress.json, user_positions.json) - для быстрого развертывания.
+
+Примеры:
+    python bulk_data.py export --dir backup/
+    python bulk_data.py import --dir backup/ --replace
+    python bulk_data.py load-json
+    python bulk_data.py export --dir backup/ --backend sqlite --tables users,user_progress
+
+По умолчанию записи, которые уже есть в базе (тот же ключ), пропускаются;
+--replace сначала очищает загружаемые таблицы.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from generate_dataset import CopyStream
+from map_points import encode_active_points
+from storage import create_backend
+
+# Таблица, ее столбцы и столбцы с JSON; порядок - порядок загрузки
+TABLES = [
+    ('users', ('username', 'password', 'role', 'coins', 'created_at'), ()),
+    ('tasks_config', ('id', 'button1', 'button2', 'button3', 'updated_at'), ('button1', 'button2', 'button3')),
+    ('daily_tasks', ('id', 'date', 'tasks', 'created_at'), ('tasks',)),
+    ('board_tasks', ('id', 'text', 'difficulty', 'status', 'user_taken', 'taken_at', 'done_at', 'created_at'), ()),
+    ('board_archive', ('id', 'text', 'difficulty', 'status', 'user_taken', 'taken_at', 'done_at', 'created_at',
+                       'archived_at'), ()),
+    ('user_progress', ('id', 'username', 'date', 'tasks_done'), ('tasks_done',)),
+    ('map_config', ('id', 'start_point', 'active_points', 'checkpoints', 'end_point', 'updated_at', 'updated_by'),
+     ('start_point', 'active_points', 'checkpoints', 'end_point')),
+    ('user_positions', ('username', 'x', 'y', 'updated_at'), ()),
+    ('user_inventory', ('id', 'username', 'name', 'description', 'quantity', 'created_at', 'updated_at'), ()),
+    ('activity_events', ('id', 'kind', 'username', 'payload', 'created_at'), ('payload',)),
+]
+TABLE_SPECS = {table: (columns, json_columns) for table, columns, json_columns in TABLES}
+# Таблицы с SERIAL id в PostgreSQL
+SERIAL_TABLES = {'tasks_config', 'daily_tasks', 'board_tasks', 'user_progress', 'map_config', 'user_inventory',
+                 'activity_events'}
+
+MANIFEST = 'manifest.json'
+DEFAULT_BATCH = 5000
+
+
+def dump_path(directory, table):
+    return os.path.join(directory, f'{table}.ndjson.gz')
+
+
+# Файлы NDJSON
+def write_ndjson(path, rows):
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=6) as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False, default=str) + '\n')
+            count += 1
+    return count
+
+
+def read_ndjson(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def row_values(row, columns, json_columns):
+    """Запись NDJSON -> кортеж значений в порядке столбцов; JSON-столбцы снова строкой"""
+    values = []
+    for column in columns:
+        value = row.get(column)
+        if column in json_columns and value is not None:
+            value = json.dumps(value, ensure_ascii=False)
+        values.append(value)
+    return tuple(values)
+
+
+# PostgreSQL
+def export_postgres(backend, table, columns, json_columns, batch):
+    # Серверный курсор: строки приходят пачками по itersize, а не всей таблицей
+    cur = backend.conn.cursor(name=f'export_{table}')
+    cur.itersize = batch
+    cur.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY 1")
+    try:
+        for row in cur:
+            yield dict(row)
+    finally:
+        cur.close()
+        backend.conn.rollback()
+
+
+def import_postgres(backend, table, columns, json_columns, rows, batch):
+    conn = backend.conn
+    cur = conn.cursor()
+    stage = f'import_{table}'
+    cur.execute(f"CREATE TEMP TABLE {stage} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+    values = (row_values(row, columns, json_columns) for row in rows)
+    cur.copy_expert(f"COPY {stage} ({', '.join(columns)}) FROM STDIN", CopyStream(values), size=1 << 16)
+    if table == 'board_archive':
+        # Секции по месяцам создаются заранее, иначе строки некуда положить
+        cur.execute(f"SELECT DISTINCT date_trunc('month', done_at) AS month FROM {stage}")
+        for row in cur.fetchall():
+            backend._create_archive_partition(cur, row['month'])
+    cur.execute(f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM {stage} "
+                f"ON CONFLICT DO NOTHING")
+    inserted = cur.rowcount
+    if table in SERIAL_TABLES and 'id' in columns:
+        cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)")
+    conn.commit()
+    cur.close()
+    return inserted
+
+
+def truncate_postgres(backend, tables):
+    cur = backend.conn.cursor()
+    cur.execute(f"TRUNCATE {', '.join(tables)}")
+    backend.conn.commit()
+    cur.close()
+
+
+# SQLite
+def export_sqlite(backend, table, columns, json_columns, batch):
+    cur = backend.conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY 1")
+    while True:
+        rows = cur.fetchmany(batch)
+        if not rows:
+            return
+        for row in rows:
+            for column in json_columns:
+                if row[column] is not None:
+                    row[column] = json.loads(row[column])
+            yield row
+
+
+def import_sqlite(backend, table, columns, json_columns, rows, batch):
+    sql = f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    inserted = 0
+    chunk = []
+    with backend.conn as conn:
+        for row in rows:
+            chunk.append(row_values(row, columns, json_columns))
+            if len(chunk) >= batch:
+                inserted += conn.executemany(sql, chunk).rowcount
+                chunk = []
+        if chunk:
+            inserted += conn.executemany(sql, chunk).rowcount
+    return inserted
+
+
+def truncate_sqlite(backend, tables):
+    with backend.conn as conn:
+        for table in tables:
+            conn.execute(f"DELETE FROM {table}")
+
+
+ADAPTERS = {
+    'postgres': (export_postgres, import_postgres, truncate_postgres),
+    'sqlite': (export_sqlite, import_sqlite, truncate_sqlite),
+}
+
+
+# JSON-файлы репозитория -> записи таблиц
+def _load_json(root, name):
+    path = os.path.join(root, name)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def repo_json_sources(root):
+    """{таблица: (столбцы, записи)} из JSON-файлов в каталоге root"""
+    sources = {}
+    tasks = _load_json(root, 'tasks.json')
+    if tasks:
+        sources['tasks_config'] = (('button1', 'button2', 'button3'),
+                                   [{key: tasks.get(key, []) for key in ('button1', 'button2', 'button3')}])
+    map_config = _load_json(root, 'map_config.json')
+    if map_config:
+        map_config['active_points'] = encode_active_points(map_config.get('active_points', []))
+        sources['map_config'] = (('start_point', 'active_points', 'checkpoints', 'end_point', 'updated_by'),
+                                 [map_config])
+    users = _load_json(root, 'users.json')
+    if users:
+        sources['users'] = (('username', 'password', 'role', 'coins'),
+                            ({'username': username, **user} for username, user in users.items()))
+    daily = _load_json(root, 'daily_tasks.json')
+    if daily and daily.get('date'):
+        sources['daily_tasks'] = (('date', 'tasks'), [daily])
+    progress = _load_json(root, 'user_progress.json')
+    if progress:
+        sources['user_progress'] = (('username', 'date', 'tasks_done'),
+                                    ({'username': username, 'date': day, 'tasks_done': tasks}
+                                     for username, days in progress.items() for day, tasks in days.items()))
+    positions = _load_json(root, 'user_positions.json')
+    if positions:
+        sources['user_positions'] = (('username', 'x', 'y'),
+                                     ({'username': username, **position} for username, position in positions.items()))
+    return sources
+
+
+def connect(args):
+    if args.backend not in ADAPTERS:
+        raise SystemExit(f"❌ Выгрузка и загрузка поддерживают только {', '.join(ADAPTERS)}, а не {args.backend}")
+    options = {}
+    if args.backend == 'postgres':
+        options = {'database_url': args.database_url, 'max_retries': 1}
+    elif args.sqlite_path:
+        options = {'path': args.sqlite_path}
+    backend = create_backend(args.backend, **options)
+    backend.connect()
+    return backend
+
+
+def selected_tables(args):
+    if not args.tables:
+        return [table for table, _, _ in TABLES]
+    tables = [table.strip() for table in args.tables.split(',') if table.strip()]
+    unknown = [table for table in tables if table not in TABLE_SPECS]
+    if unknown:
+        raise SystemExit(f"❌ Неизвестные таблицы: {', '.join(unknown)}")
+    return [table for table, _, _ in TABLES if table in tables]
+
+
+def run_export(backend, args):
+    export_rows = ADAPTERS[args.backend][0]
+    os.makedirs(args.dir, exist_ok=True)
+    manifest = {'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'backend': args.backend, 'tables': {}}
+    for table in selected_tables(args):
+        columns, json_columns = TABLE_SPECS[table]
+        started = time.perf_counter()
+        count = write_ndjson(dump_path(args.dir, table), export_rows(backend, table, columns, json_columns, args.batch))
+        manifest['tables'][table] = count
+        print(f"  📤 {table}: {count} строк за {time.perf_counter() - started:.2f} с")
+    with open(os.path.join(args.dir, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"✅ Выгрузка сохранена в {args.dir}")
+
+
+def load_sources(backend, args, sources):
+    """sources: [(таблица, столбцы, записи)] в порядке загрузки"""
+    _, import_rows, truncate = ADAPTERS[args.backend]
+    if args.replace and sources:
+        truncate(backend, [table for table, _, _ in sources])
+    for table, columns, rows in sources:
+        json_columns = tuple(column for column in TABLE_SPECS[table][1] if column in columns)
+        started = time.perf_counter()
+        inserted = import_rows(backend, table, columns, json_columns, rows, args.batch)
+        print(f"  📥 {table}: {inserted} новых строк за {time.perf_counter() - started:.2f} с")
+    if any(table == 'user_progress' for table, _, _ in sources):
+        # Сводки статистики производны от прогресса и в выгрузку не входят
+        report = backend.rebuild_stats()
+        if report is None:
+            print("  ❌ Сводки статистики не пересчитаны - запустите python rollups.py rebuild")
+        else:
+            print(f"  📊 Сводки статистики: {report['user_rows']} строк по игрокам, {report['task_rows']} по задачам")
+
+
+def run_import(backend, args):
+    sources = []
+    for table in selected_tables(args):
+        path = dump_path(args.dir, table)
+        if os.path.exists(path):
+            sources.append((table, TABLE_SPECS[table][0], read_ndjson(path)))
+    if not sources:
+        raise SystemExit(f"❌ В {args.dir} нет файлов выгрузки")
+    load_sources(backend, args, sources)
+    print(f"✅ Загрузка из {args.dir} завершена")
+
+
+def run_load_json(backend, args):
+    found = repo_json_sources(args.dir)
+    tables = selected_tables(args)
+    load_sources(backend, args, [(table, *found[table]) for table in tables if table in found])
+    print(f"✅ JSON-файлы из {args.dir} загружены")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Выгрузка и загрузка данных игры в сжатом NDJSON')
+    parser.add_argument('command', choices=['export', 'import', 'load-json'])
+    parser.add_argument('--dir', help='каталог выгрузки (для load-json - каталог с JSON-файлами)')
+    parser.add_argument('--backend', choices=['postgres', 'sqlite'],
+                        default=os.environ.get('STORAGE_BACKEND', 'postgres'))
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--sqlite-path', default=os.environ.get('SQLITE_PATH'))
+    parser.add_argument('--tables', help='только эти таблицы, через запятую')
+    parser.add_argument('--replace', action='store_true', help='очистить таблицы перед загрузкой')
+    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH, help='строк в пачке чтения и записи')
+    args = parser.parse_args()
+
+    if args.dir is None:
+        if args.command != 'load-json':
+            parser.error('нужен --dir')
+        args.dir = os.path.dirname(os.path.abspath(__file__))
+
+    backend = connect(args)
+    started = time.perf_counter()
+    try:
+        {'export': run_export, 'import': run_import, 'load-json': run_load_json}[args.command](backend, args)
+    finally:
+        backend.close()
+    print(f"⏱️ {time.perf_counter() - started:.2f} с")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,759 +1,231 @@
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import json
-from datetime import datetime
-import time
 import logging
+import threading
+import time
+
+import metrics
+from storage import (BACKENDS, JOURNALED_METHODS, PRIMARY_READ_METHODS, READ_METHODS, MemoryBackend, OutageJournal,
+                     ReplicaSet, create_backend, replica_urls)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Как часто проверять, вернулся ли PostgreSQL, пока работаем на памяти (секунды)
+OUTAGE_RETRY_INTERVAL = int(os.environ.get('OUTAGE_RETRY_INTERVAL', '30'))
+# Предел времени на подключение при запуске (секунды); gunicorn.conf.py ставит его меньше timeout воркера,
+# а дальше PostgreSQL ждет фоновый поток восстановления, пока запросы обслуживает память
+DB_CONNECT_BUDGET = float(os.environ.get('DB_CONNECT_BUDGET', '0')) or None
 
-class Database:
-    def __init__(self):
-        self.conn = None
-        self.is_connected = False
-
-    def connect(self):
-        """Подключение к базе данных с повторными попытками"""
-        max_retries = 10
-        retry_delay = 5
-
-        for attempt in range(max_retries):
-            try:
-                # Получаем DATABASE_URL из переменных окружения Railway
-                database_url = os.environ.get('DATABASE_URL')
 
-                if not database_url:
-                    logger.error("❌ DATABASE_URL не найден в переменных окружения")
-                    time.sleep(retry_delay)
-                    continue
+def configured_backend_name():
+    """Бэкенд из STORAGE_BACKEND (postgres | memory | sqlite); USE_IN_MEMORY_DB=1 - то же, что memory"""
+    if os.environ.get('USE_IN_MEMORY_DB') == '1':
+        return 'memory'
+    return os.environ.get('STORAGE_BACKEND', 'postgres').strip().lower()
 
-                logger.info(f"🔄 Попытка подключения к PostgreSQL (попытка {attempt + 1}/{max_retries})...")
 
-                # Конвертируем postgres:// в postgresql:// если нужно
-                if database_url.startswith('postgres://'):
-                    database_url = database_url.replace('postgres://', 'postgresql://', 1)
+class Database:
+    """Точка доступа к данным: выбирает бэкенд по конфигурации и делегирует ему все вызовы.
 
-                # Парсим URL для логирования (без пароля)
-                parsed_url = database_url.split('@')[-1] if '@' in database_url else database_url
-                logger.info(f"🔗 Подключаемся к: {parsed_url}")
+    Методы работы с данными (get_user, save_board_tasks, ...) описаны в storage.base.StorageBackend.
 
-                self.conn = psycopg2.connect(
-                    database_url,
-                    cursor_factory=RealDictCursor,
-                    connect_timeout=10
-                )
+    Если PostgreSQL недоступен, работаем на памяти, а пользовательские записи
+    ведем в журнале сбоя (storage/journal.py). Фоновый поток ждет возвращения
+    базы, проигрывает журнал и переключается обратно на PostgreSQL.
 
-                # Проверяем подключение
-                cur = self.conn.cursor()
-                cur.execute("SELECT 1")
-                cur.close()
+    С DATABASE_REPLICA_URL чтения GET-запросов идут на реплики (storage/replicas.py).
+    """
 
-                self.is_connected = True
-                logger.info("✅ Подключение к PostgreSQL установлено")
-                self.init_tables()
-                return
+    def __init__(self):
+        self.backend = None
+        self.journal = None
+        self.replicas = None
+        # Маршрутизация чтений текущего запроса (поток или гринлет gevent)
+        self._local = threading.local()
+        # Записи в журнал и переключение бэкенда при восстановлении не должны пересекаться
+        self._write_lock = threading.RLock()
 
-            except Exception as e:
-                logger.error(f"❌ Попытка {attempt + 1}/{max_retries}: Ошибка подключения к PostgreSQL: {e}")
-                if attempt < max_retries - 1:
-                    logger.info(f"⏳ Повторная попытка через {retry_delay} секунд...")
-                    time.sleep(retry_delay)
-                else:
-                    logger.error("❌ Не удалось подключиться к PostgreSQL после всех попыток")
-                    # Создаем временное хранилище в памяти для демо
-                    self.create_in_memory_storage()
-
-    def create_in_memory_storage(self):
-        """Создает временное хранилище в памяти при недоступности PostgreSQL"""
-        logger.warning("🔄 Создаем временное хранилище в памяти (данные будут сброшены после перезапуска)")
-        self.in_memory_storage = {
-            'users': {
-                "admin": {"password": "password", "role": "admin", "coins": 100},
-                "user1": {"password": "pass1", "role": "user", "coins": 50},
-                "user2": {"password": "pass2", "role": "user", "coins": 30}
-            },
-            'tasks_config': {
-                "button1": ["Изучить новый фреймворк", "Прочитать документацию", "Написать тесты"],
-                "button2": ["Создать прототип интерфейса", "Оптимизировать базу данных", "Настроить CI/CD"],
-                "button3": ["Изучить алгоритмы", "Попрактиковаться в английском", "Посмотреть вебинар"]
-            },
-            'daily_tasks': {},
-            'board_tasks': [],
-            'user_progress': {},
-            'map_config': {
-                'start_point': {'x': 15, 'y': 75, 'type': 'start'},
-                'active_points': [
-                    {'x': 25, 'y': 70, 'type': 'active'},
-                    {'x': 35, 'y': 65, 'type': 'active'},
-                    {'x': 45, 'y': 60, 'type': 'active'}
-                ],
-                'checkpoints': [
-                    {'x': 75, 'y': 45, 'type': 'checkpoint', 'name': "Первый уровень", 'required': 5, 'icon': "🎯"},
-                    {'x': 85, 'y': 40, 'type': 'checkpoint', 'name': "Второй уровень", 'required': 10, 'icon': "⭐"}
-                ],
-                'end_point': {'x': 95, 'y': 35, 'type': 'end'},
-                'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'updated_by': 'system'
-            },
-            'user_positions': {},
-            'user_inventory': {}
-        }
-
-    def init_tables(self):
-        """Инициализация таблиц только если подключение к БД установлено"""
-        if not self.is_connected:
-            logger.warning("⚠️ Пропускаем инициализацию таблиц - нет подключения к БД")
+    def connect(self):
+        name = configured_backend_name()
+        if name not in BACKENDS:
+            logger.error(f"❌ Неизвестный STORAGE_BACKEND={name}, используем postgres")
+            name = 'postgres'
+
+        if name == 'memory':
+            logger.warning("⚠️ STORAGE_BACKEND=memory - PostgreSQL не используется")
+            self.use_in_memory()
             return
 
-        commands = [
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                username VARCHAR(50) PRIMARY KEY,
-                password VARCHAR(100) NOT NULL,
-                role VARCHAR(100) NOT NULL DEFAULT 'user',  -- Увеличено с 20 до 100
-                coins INTEGER NOT NULL DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS tasks_config (
-                id SERIAL PRIMARY KEY,
-                button1 JSONB NOT NULL,
-                button2 JSONB NOT NULL,
-                button3 JSONB NOT NULL,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS daily_tasks (
-                id SERIAL PRIMARY KEY,
-                date DATE UNIQUE NOT NULL,
-                tasks JSONB NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS board_tasks (
-                id SERIAL PRIMARY KEY,
-                text TEXT NOT NULL,
-                difficulty VARCHAR(20) NOT NULL,
-                status VARCHAR(20) NOT NULL DEFAULT 'free',
-                user_taken VARCHAR(50),
-                taken_at TIMESTAMP,
-                done_at TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS user_progress (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(50) NOT NULL,
-                date DATE NOT NULL,
-                tasks_done JSONB NOT NULL,
-                UNIQUE(username, date)
-            )
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS map_config (
-                id SERIAL PRIMARY KEY,
-                start_point JSONB NOT NULL,
-                active_points JSONB NOT NULL,
-                checkpoints JSONB NOT NULL,
-                end_point JSONB NOT NULL,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_by VARCHAR(50)
-            )
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS user_positions (
-                username VARCHAR(50) PRIMARY KEY,
-                x FLOAT NOT NULL DEFAULT 15,
-                y FLOAT NOT NULL DEFAULT 75,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS user_inventory (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(50) NOT NULL,
-                name VARCHAR(100) NOT NULL,
-                description TEXT,
-                quantity INTEGER NOT NULL DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """
-        ]
-
+        options = {'connect_budget': DB_CONNECT_BUDGET} if name == 'postgres' else {}
+        backend = create_backend(name, **options)
         try:
-            cur = self.conn.cursor()
-            for command in commands:
-                cur.execute(command)
-            self.conn.commit()
-            cur.close()
-            logger.info("✅ Таблицы инициализированы")
-            self.insert_initial_data()
+            backend.connect()
         except Exception as e:
-            logger.error(f"❌ Ошибка инициализации таблиц: {e}")
-
-    def insert_initial_data(self):
-        """Вставка начальных данных только если подключение к БД установлено"""
-        if not self.is_connected:
-            logger.warning("⚠️ Пропускаем вставку начальных данных - нет подключения к БД")
+            logger.error(f"❌ {e}")
+            # Создаем временное хранилище в памяти для демо
+            self.use_in_memory()
+            if name == 'postgres':
+                self.start_outage_mode()
             return
+        self.backend = backend
+
+        if name == 'postgres':
+            # Журнал мог остаться от сбоя, после которого процесс перезапустили
+            journal = OutageJournal()
+            if journal.entries():
+                if self.replay_outage_journal(backend, journal):
+                    # Снимок памяти того сбоя устарел (id предметов не совпадают с базой): следующий сбой начнет с нуля
+                    MemoryBackend().discard()
+                backend.release()
+            self.connect_replicas()
+
+    def connect_replicas(self):
+        urls = replica_urls()
+        if not urls or self.replicas is not None:
+            return
+        replicas = ReplicaSet(urls)
+        replicas.start()
+        self.replicas = replicas
+        logger.info(f"📚 Реплики для чтения: {len(urls)}, в работе: {replicas.healthy_count}")
 
-        try:
-            cur = self.conn.cursor()
-
-            # Проверяем, есть ли уже пользователи
-            cur.execute("SELECT COUNT(*) as count FROM users")
-            if cur.fetchone()['count'] == 0:
-                # Добавляем начальных пользователей
-                users = [
-                    ('admin', 'password', 'admin', 100),
-                    ('user1', 'pass1', 'user', 50),
-                    ('user2', 'pass2', 'user', 30)
-                ]
-                for user in users:
-                    cur.execute(
-                        "INSERT INTO users (username, password, role, coins) VALUES (%s, %s, %s, %s)",
-                        user
-                    )
-
-            # Проверяем конфигурацию задач
-            cur.execute("SELECT COUNT(*) as count FROM tasks_config")
-            if cur.fetchone()['count'] == 0:
-                default_tasks = {
-                    "button1": ["Изучить новый фреймворк", "Прочитать документацию", "Написать тесты"],
-                    "button2": ["Создать прототип интерфейса", "Оптимизировать базу данных", "Настроить CI/CD"],
-                    "button3": ["Изучить алгоритмы", "Попрактиковаться в английском", "Посмотреть вебинар"]
-                }
-                cur.execute(
-                    "INSERT INTO tasks_config (button1, button2, button3) VALUES (%s, %s, %s)",
-                    (json.dumps(default_tasks['button1']),
-                     json.dumps(default_tasks['button2']),
-                     json.dumps(default_tasks['button3']))
-                )
-
-            # Проверяем конфигурацию карты
-            cur.execute("SELECT COUNT(*) as count FROM map_config")
-            if cur.fetchone()['count'] == 0:
-                default_map = {
-                    'start_point': {'x': 15, 'y': 75, 'type': 'start'},
-                    'active_points': [
-                        {'x': 25, 'y': 70, 'type': 'active'},
-                        {'x': 35, 'y': 65, 'type': 'active'},
-                        {'x': 45, 'y': 60, 'type': 'active'}
-                    ],
-                    'checkpoints': [
-                        {'x': 75, 'y': 45, 'type': 'checkpoint', 'name': "Первый уровень", 'required': 5, 'icon': "🎯"},
-                        {'x': 85, 'y': 40, 'type': 'checkpoint', 'name': "Второй уровень", 'required': 10, 'icon': "⭐"}
-                    ],
-                    'end_point': {'x': 95, 'y': 35, 'type': 'end'}
-                }
-                cur.execute(
-                    "INSERT INTO map_config (start_point, active_points, checkpoints, end_point, updated_by) VALUES (%s, %s, %s, %s, %s)",
-                    (json.dumps(default_map['start_point']),
-                     json.dumps(default_map['active_points']),
-                     json.dumps(default_map['checkpoints']),
-                     json.dumps(default_map['end_point']),
-                     'system')
-                )
-
-            self.conn.commit()
-            cur.close()
-            logger.info("✅ Начальные данные добавлены")
-
-        except Exception as e:
-            logger.error(f"❌ Ошибка добавления начальных данных: {e}")
-            self.conn.rollback()
+    def use_in_memory(self):
+        backend = MemoryBackend()
+        backend.connect()
+        metrics.IN_MEMORY_ACTIVATIONS.inc()
+        self.backend = backend
 
-    # Методы для работы с пользователями
-    def get_user(self, username):
-        if not self.is_connected:
-            return self.in_memory_storage['users'].get(username)
+    def start_outage_mode(self):
+        self.journal = OutageJournal()
+        logger.warning(f"📝 Записи пользователей сохраняются в журнал {self.journal.path} до возвращения PostgreSQL")
+        threading.Thread(target=self._recovery_worker, daemon=True, name='outage-recovery').start()
 
+    def replay_outage_journal(self, backend, journal):
+        """Переносит журнал сбоя в PostgreSQL; после успеха журнал удаляется"""
         try:
-            if self.conn and self.conn.closed == 0:
-                try:
-                    cur = self.conn.cursor()
-                    cur.execute("SELECT 1")
-                    cur.close()
-                except Exception as e:
-                    print(f"⚠️ Восстановление соединения для get_user: {e}")
-                    self.conn.rollback()
-
-            cur = self.conn.cursor()
-            cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-            user = cur.fetchone()
-            cur.close()
-            return user
+            applied = backend.replay_journal(journal.entries())
         except Exception as e:
-            print(f"❌ Ошибка получения пользователя {username}: {e}")
-            if self.is_connected:
-                try:
-                    self.conn.rollback()
-                except:
-                    pass
-            return None
-
-    def ensure_connection(self):
-        """Восстанавливает соединение если оно в ошибочном состоянии"""
-        if not self.is_connected:
+            logger.error(f"❌ Ошибка применения журнала сбоя: {e}")
             return False
-
-        try:
-            # Проверяем состояние соединения
-            cur = self.conn.cursor()
-            cur.execute("SELECT 1")
-            cur.close()
-            return True
-        except Exception as e:
-            print(f"⚠️ Соединение с БД требует восстановления: {e}")
+        journal.clear()
+        metrics.OUTAGE_JOURNAL_REPLAYED.inc(amount=applied)
+        logger.info(f"✅ Журнал сбоя применен: {applied} записей")
+        return True
+
+    def _recovery_worker(self):
+        while True:
+            time.sleep(OUTAGE_RETRY_INTERVAL)
+            backend = create_backend('postgres', max_retries=1)
             try:
-                self.conn.rollback()
-                # Пробуем переподключиться
-                self.connect()
-                return True
-            except Exception as reconnect_error:
-                print(f"❌ Не удалось восстановить соединение: {reconnect_error}")
-                return False
-
-    def get_all_users(self):
-        if not self.is_connected:
-            return self.in_memory_storage['users']
-
-        try:
-            # Проверяем, есть ли активная ошибочная транзакция
-            if self.conn and self.conn.closed == 0:
-                try:
-                    # Пытаемся выполнить простой запрос для проверки соединения
-                    cur = self.conn.cursor()
-                    cur.execute("SELECT 1")
-                    cur.close()
-                except Exception as e:
-                    print(f"⚠️ Восстановление соединения с БД: {e}")
-                    self.conn.rollback()  # Откатываем ошибочную транзакцию
-
-            cur = self.conn.cursor()
-            cur.execute("SELECT * FROM users ORDER BY username")
-            users = cur.fetchall()
-            cur.close()
-            return {user['username']: dict(user) for user in users}
-        except Exception as e:
-            print(f"❌ Ошибка получения всех пользователей: {e}")
-            if self.is_connected:
-                try:
-                    self.conn.rollback()  # Откатываем транзакцию при ошибке
-                except:
-                    pass
-            return {}
-
-    def update_user_coins(self, username, coins):
-        if not self.is_connected:
-            if username in self.in_memory_storage['users']:
-                self.in_memory_storage['users'][username]['coins'] = coins
-            return True
-
-        try:
-            cur = self.conn.cursor()
-            cur.execute("UPDATE users SET coins = %s WHERE username = %s", (coins, username))
-            self.conn.commit()
-            cur.close()
-            return True
-        except Exception as e:
-            logger.error(f"❌ Ошибка обновления монет пользователя {username}: {e}")
-            self.conn.rollback()
-            return False
-
-    def create_user(self, username, password, role='user', coins=0):
-        if not self.is_connected:
-            self.in_memory_storage['users'][username] = {
-                'password': password,
-                'role': role,
-                'coins': coins
-            }
-            return True
-
-        try:
-            cur = self.conn.cursor()
-            cur.execute(
-                "INSERT INTO users (username, password, role, coins) VALUES (%s, %s, %s, %s)",
-                (username, password, role, coins)
-            )
-            self.conn.commit()
-            cur.close()
-            return True
-        except Exception as e:
-            logger.error(f"❌ Ошибка создания пользователя {username}: {e}")
-            self.conn.rollback()
-            return False
-
-    # Методы для работы с задачами
-    def get_tasks_config(self):
-        if not self.is_connected:
-            return self.in_memory_storage['tasks_config']
-
-        try:
-            cur = self.conn.cursor()
-            cur.execute("SELECT * FROM tasks_config ORDER BY id DESC LIMIT 1")
-            config = cur.fetchone()
-            cur.close()
-            if config:
-                return {
-                    "button1": config['button1'],
-                    "button2": config['button2'],
-                    "button3": config['button3']
-                }
-            return {"button1": [], "button2": [], "button3": []}
-        except Exception as e:
-            logger.error(f"❌ Ошибка получения конфигурации задач: {e}")
-            return {"button1": [], "button2": [], "button3": []}
-
-    def update_tasks_config(self, tasks):
-        if not self.is_connected:
-            self.in_memory_storage['tasks_config'] = tasks
-            return True
-
-        try:
-            cur = self.conn.cursor()
-            cur.execute(
-                "INSERT INTO tasks_config (button1, button2, button3) VALUES (%s, %s, %s)",
-                (json.dumps(tasks['button1']), json.dumps(tasks['button2']), json.dumps(tasks['button3']))
-            )
-            self.conn.commit()
-            cur.close()
-            return True
-        except Exception as e:
-            logger.error(f"❌ Ошибка обновления конфигурации задач: {e}")
-            self.conn.rollback()
-            return False
-
-    def get_daily_tasks(self, date):
-        if not self.is_connected:
-            return self.in_memory_storage['daily_tasks'].get(date)
-
-        try:
-            cur = self.conn.cursor()
-            cur.execute("SELECT tasks FROM daily_tasks WHERE date = %s", (date,))
-            result = cur.fetchone()
-            cur.close()
-            return result['tasks'] if result else None
-        except Exception as e:
-            logger.error(f"❌ Ошибка получения ежедневных задач: {e}")
-            return None
-
-    def save_daily_tasks(self, date, tasks):
-        if not self.is_connected:
-            self.in_memory_storage['daily_tasks'][date] = tasks
-            return True
-
-        try:
-            cur = self.conn.cursor()
-            cur.execute(
-                "INSERT INTO daily_tasks (date, tasks) VALUES (%s, %s) ON CONFLICT (date) DO UPDATE SET tasks = %s",
-                (date, json.dumps(tasks), json.dumps(tasks))
-            )
-            self.conn.commit()
-            cur.close()
-            return True
-        except Exception as e:
-            logger.error(f"❌ Ошибка сохранения ежедневных задач: {e}")
-            self.conn.rollback()
-            return False
-
-    def get_board_tasks(self):
-        if not self.is_connected:
-            return self.in_memory_storage['board_tasks']
-
-        try:
-            if self.conn and self.conn.closed == 0:
-                try:
-                    cur = self.conn.cursor()
-                    cur.execute("SELECT 1")
-                    cur.close()
-                except Exception as e:
-                    print(f"⚠️ Восстановление соединения для board_tasks: {e}")
-                    self.conn.rollback()
-
-            cur = self.conn.cursor()
-            cur.execute("SELECT * FROM board_tasks ORDER BY id")
-            tasks = cur.fetchall()
-            cur.close()
-            return [dict(task) for task in tasks]
-        except Exception as e:
-            print(f"❌ Ошибка получения задач доски: {e}")
-            if self.is_connected:
-                try:
-                    self.conn.rollback()
-                except:
-                    pass
-            return []
-
-    def save_board_tasks(self, tasks):
-        if not self.is_connected:
-            self.in_memory_storage['board_tasks'] = tasks
-            return True
-
-        try:
-            cur = self.conn.cursor()
-            # Очищаем старые задачи
-            cur.execute("DELETE FROM board_tasks")
-            # Добавляем новые
-            for task in tasks:
-                cur.execute(
-                    "INSERT INTO board_tasks (text, difficulty, status, user_taken, taken_at, done_at) VALUES (%s, %s, %s, %s, %s, %s)",
-                    (task['text'], task['difficulty'], task['status'], task.get('user'), task.get('taken_at'),
-                     task.get('done_at'))
-                )
-            self.conn.commit()
-            cur.close()
-            return True
-        except Exception as e:
-            logger.error(f"❌ Ошибка сохранения задач доски: {e}")
-            self.conn.rollback()
-            return False
-
-    def update_board_task(self, task_id, updates):
-        if not self.is_connected:
-            # Обновляем задачу в памяти
-            for task in self.in_memory_storage['board_tasks']:
-                if task['id'] == task_id:
-                    task.update(updates)
-                    break
-            return True
-
-        try:
-            cur = self.conn.cursor()
-            set_clause = ", ".join([f"{key} = %s" for key in updates.keys()])
-            values = list(updates.values())
-            values.append(task_id)
-            cur.execute(f"UPDATE board_tasks SET {set_clause} WHERE id = %s", values)
-            self.conn.commit()
-            cur.close()
-            return True
-        except Exception as e:
-            logger.error(f"❌ Ошибка обновления задачи доски {task_id}: {e}")
-            self.conn.rollback()
-            return False
-
-    # Методы для прогресса пользователей
-    def get_user_progress(self, username, date):
-        if not self.is_connected:
-            user_progress = self.in_memory_storage['user_progress']
-            key = f"{username}_{date}"
-            return user_progress.get(key, [])
-
-        try:
-            cur = self.conn.cursor()
-            cur.execute("SELECT tasks_done FROM user_progress WHERE username = %s AND date = %s", (username, date))
-            result = cur.fetchone()
-            cur.close()
-            return result['tasks_done'] if result else []
-        except Exception as e:
-            logger.error(f"❌ Ошибка получения прогресса пользователя {username}: {e}")
-            return []
-
-    def save_user_progress(self, username, date, tasks_done):
-        if not self.is_connected:
-            key = f"{username}_{date}"
-            self.in_memory_storage['user_progress'][key] = tasks_done
-            return True
-
-        try:
-            cur = self.conn.cursor()
-            cur.execute(
-                "INSERT INTO user_progress (username, date, tasks_done) VALUES (%s, %s, %s) ON CONFLICT (username, date) DO UPDATE SET tasks_done = %s",
-                (username, date, json.dumps(tasks_done), json.dumps(tasks_done))
-            )
-            self.conn.commit()
-            cur.close()
-            return True
-        except Exception as e:
-            logger.error(f"❌ Ошибка сохранения прогресса пользователя {username}: {e}")
-            self.conn.rollback()
-            return False
-
-    def get_user_all_progress(self, username):
-        if not self.is_connected:
-            all_tasks = []
-            for key, tasks in self.in_memory_storage['user_progress'].items():
-                if key.startswith(f"{username}_"):
-                    all_tasks.extend(tasks)
-            return all_tasks
+                backend.connect()
+            except Exception:
+                continue
 
-        try:
-            cur = self.conn.cursor()
-            cur.execute("SELECT tasks_done FROM user_progress WHERE username = %s", (username,))
-            results = cur.fetchall()
-            cur.close()
-            all_tasks = []
-            for result in results:
-                all_tasks.extend(result['tasks_done'])
-            return all_tasks
-        except Exception as e:
-            logger.error(f"❌ Ошибка получения всего прогресса пользователя {username}: {e}")
-            return []
-
-    # Методы для карты
-    def get_map_config(self):
-        if not self.is_connected:
-            return self.in_memory_storage.get('map_config')
-
-        try:
-            cur = self.conn.cursor()
-            cur.execute("SELECT * FROM map_config ORDER BY id DESC LIMIT 1")
-            config = cur.fetchone()
-            cur.close()
-
-            if config:
-                # Преобразуем JSONB поля в словари
-                return {
-                    'start_point': config['start_point'],
-                    'active_points': config['active_points'],
-                    'checkpoints': config['checkpoints'],
-                    'end_point': config['end_point'],
-                    'updated_at': config['updated_at'].strftime('%Y-%m-%d %H:%M:%S') if config[
-                        'updated_at'] else 'Неизвестно',
-                    'updated_by': config['updated_by'] or 'system'
-                }
-            return None
-
-        except Exception as e:
-            logger.error(f"❌ Ошибка получения конфигурации карты: {e}")
-            return None
-
-    def save_map_config(self, config, updated_by):
-        if not self.is_connected:
-            self.in_memory_storage['map_config'] = config
-            self.in_memory_storage['map_config']['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            self.in_memory_storage['map_config']['updated_by'] = updated_by
-            return True
-
-        try:
-            cur = self.conn.cursor()
-            cur.execute(
-                "INSERT INTO map_config (start_point, active_points, checkpoints, end_point, updated_by) VALUES (%s, %s, %s, %s, %s)",
-                (json.dumps(config['start_point']),
-                 json.dumps(config['active_points']),
-                 json.dumps(config['checkpoints']),
-                 json.dumps(config['end_point']),
-                 updated_by)
-            )
-            db.conn.commit()
-            cur.close()
-            return True
-        except Exception as e:
-            logger.error(f"❌ Ошибка сохранения конфигурации карты: {e}")
-            self.conn.rollback()
-            return False
-
-    def get_user_position(self, username):
-        if not self.is_connected:
-            return self.in_memory_storage['user_positions'].get(username, {'x': 15, 'y': 75})
-
-        try:
-            cur = self.conn.cursor()
-            cur.execute("SELECT x, y FROM user_positions WHERE username = %s", (username,))
-            result = cur.fetchone()
-            cur.close()
-
-            if result:
-                # Убедимся, что координаты в пределах карты
-                x = max(0, min(float(result['x']), 100))
-                y = max(0, min(float(result['y']), 100))
-                return {'x': x, 'y': y}
-            else:
-                # Создаем дефолтную позицию если нет в базе
-                self.save_user_position(username, 15, 75)
-                return {'x': 15, 'y': 75}
-
-        except Exception as e:
-            logger.error(f"❌ Ошибка получения позиции пользователя {username}: {e}")
-            return {'x': 15, 'y': 75}  # Дефолтная позиция при ошибке
-
-    def save_user_position(self, username, x, y):
-        if not self.is_connected:
-            self.in_memory_storage['user_positions'][username] = {'x': x, 'y': y}
-            return True
-
-        try:
-            cur = self.conn.cursor()
-            # Убедимся, что координаты в пределах карты
-            x = max(0, min(float(x), 100))
-            y = max(0, min(float(y), 100))
-
-            cur.execute(
-                "INSERT INTO user_positions (username, x, y) VALUES (%s, %s, %s) ON CONFLICT (username) DO UPDATE SET x = %s, y = %s, updated_at = CURRENT_TIMESTAMP",
-                (username, x, y, x, y)
-            )
-            self.conn.commit()
-            cur.close()
-            logger.info(f"✅ Позиция пользователя {username} сохранена: x={x}, y={y}")
-            return True
-        except Exception as e:
-            logger.error(f"❌ Ошибка сохранения позиции пользователя {username}: {e}")
-            self.conn.rollback()
-            return False
-
-    # Функции для работы с инвентарем
-    def get_user_inventory(self, username):
-        """Получаем инвентарь пользователя"""
-        if not self.is_connected:
-            return self.in_memory_storage.get('user_inventory', {}).get(username, [])
-
-        try:
-            cur = self.conn.cursor()
-            cur.execute("""
-                SELECT id, name, description, quantity, created_at, updated_at 
-                FROM user_inventory 
-                WHERE username = %s 
-                ORDER BY created_at DESC
-            """, (username,))
-            inventory = cur.fetchall()
-            cur.close()
-            return [dict(item) for item in inventory]
-        except Exception as e:
-            logger.error(f"Ошибка получения инвентаря: {e}")
-            return []
-
-    def add_item_to_inventory(self, username, name, description, quantity=1):
-        """Добавляем предмет в инвентарь"""
-        if not self.is_connected:
-            if 'user_inventory' not in self.in_memory_storage:
-                self.in_memory_storage['user_inventory'] = {}
-            if username not in self.in_memory_storage['user_inventory']:
-                self.in_memory_storage['user_inventory'][username] = []
-
-            new_id = max([item.get('id', 0) for item in self.in_memory_storage['user_inventory'][username]],
-                         default=0) + 1
-            self.in_memory_storage['user_inventory'][username].append({
-                'id': new_id,
-                'name': name,
-                'description': description,
-                'quantity': quantity,
-                'created_at': datetime.now()
-            })
-            return True
-
-        try:
-            cur = self.conn.cursor()
-            cur.execute("""
-                INSERT INTO user_inventory (username, name, description, quantity) 
-                VALUES (%s, %s, %s, %s)
-            """, (username, name, description, quantity))
-            self.conn.commit()
-            cur.close()
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка добавления предмета: {e}")
-            self.conn.rollback()
-            return False
+            journal = self.journal
+            # Основную часть журнала применяем, не останавливая запросы
+            try:
+                backend.replay_journal(journal.entries())
+            except Exception as e:
+                logger.error(f"❌ Ошибка применения журнала сбоя: {e}")
+                backend.close()
+                continue
+            # Хвост, записанный за это время, - уже под блокировкой записи
+            with self._write_lock:
+                if not self.replay_outage_journal(backend, journal):
+                    backend.close()
+                    continue
+                memory, self.backend, self.journal = self.backend, backend, None
+            backend.release()
+            memory.discard()
+            logger.info("✅ PostgreSQL снова доступен - хранилище в памяти отключено")
+            self.connect_replicas()
+            return
 
+    def _journaled(self, name):
+        def call(*args, **kwargs):
+            with self._write_lock:
+                journal = self.journal
+                if journal is None:
+                    # Пока ждали блокировку, база вернулась
+                    return getattr(self.backend, name)(*args, **kwargs)
+                return getattr(journal, name)(self.backend, *args, **kwargs)
+        return call
+
+    # Реплики: чтение своих записей
+    def begin_request(self, replica_reads):
+        """Начало запроса: replica_reads - можно ли читать с реплик (GET без недавних записей игрока)"""
+        self._local.replica_reads = replica_reads
+        self._local.wrote = False
+
+    @property
+    def wrote_in_request(self):
+        return getattr(self._local, 'wrote', False)
+
+    def release(self):
+        """Освобождает соединения текущего потока и сбрасывает маршрутизацию чтений (конец запроса)"""
+        self._local.replica_reads = False
+        self._local.wrote = False
+        backend = self.backend
+        if backend is not None:
+            backend.release()
+        if self.replicas is not None:
+            self.replicas.release()
+
+    def close(self):
+        if self.replicas is not None:
+            self.replicas.close()
+            self.replicas = None
+        if self.backend is not None:
+            self.backend.close()
+
+    def _routed(self, backend, name):
+        local = self._local
+        if name in PRIMARY_READ_METHODS:
+            metrics.DB_READS.inc('primary')
+            return getattr(backend, name)
+        if name not in READ_METHODS:
+            # Все, что не чтение, считаем записью: до конца запроса читаем основную базу
+            local.wrote = True
+            return getattr(backend, name)
+        if not getattr(local, 'replica_reads', False) or getattr(local, 'wrote', False):
+            metrics.DB_READS.inc('primary')
+            return getattr(backend, name)
+
+        def call(*args, **kwargs):
+            return self.replicas.read(backend, name, args, kwargs)
+        return call
+
+    @property
+    def is_connected(self):
+        """Подключены к PostgreSQL"""
+        return self.backend is not None and self.backend.name == 'postgres' and self.backend.is_connected
+
+    @property
+    def in_memory(self):
+        return self.backend is not None and self.backend.volatile
+
+    def __getattr__(self, name):
+        backend = self.__dict__.get('backend')
+        if backend is None:
+            raise AttributeError(f"Хранилище не подключено: {name}")
+        if self.__dict__.get('journal') is not None:
+            if name in JOURNALED_METHODS:
+                return self._journaled(name)
+        elif self.__dict__.get('replicas') is not None and backend.name == 'postgres':
+            return self._routed(backend, name)
+        return getattr(backend, name)
+
+
+# Замер времени всех методов бэкендов
+for backend_class in BACKENDS.values():
+    metrics.instrument_methods(backend_class)
 
 # Глобальный объект базы данных
-db = Database()
\ No newline at end of file
+db = Database()
+
+metrics.Gauge('rgg_db_connected', 'Подключение к PostgreSQL активно (1/0)', lambda: db.is_connected)
+metrics.Gauge('rgg_db_replicas_healthy', 'Реплики для чтения в работе',
+              lambda: db.replicas.healthy_count if db.replicas is not None else 0)
+metrics.Gauge('rgg_in_memory_fallback_active', 'Используется временное хранилище в памяти (1/0)',
+              lambda: db.in_memory)
+metrics.Gauge('rgg_outage_journal_active', 'Записи ведутся в журнал сбоя (1/0)', lambda: db.journal is not None)
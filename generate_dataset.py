@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""Генератор синтетических данных и отчет о масштабировании страниц.
+
+Массово загружает пользователей, прогресс, инвентарь и задачи доски в
+PostgreSQL (через COPY) или во временное хранилище в памяти, после чего
+замеряет задержку основных страниц на каждом объеме данных.
+
+Примеры:
+    python generate_dataset.py --target postgres --database-url postgresql://localhost/rgg_scale \\
+        --users 10000 --progress 1000000 --items 200000 --board 5000
+    python generate_dataset.py --target memory --steps 0.01,0.1,1 --report scaling_report.md
+    python generate_dataset.py --target postgres --clean
+
+Все синтетические пользователи получают префикс synth_, так что --clean
+удаляет только сгенерированные данные.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+PREFIX = 'synth_'
+DIFFICULTIES = ['Легкая', 'Средняя', 'Сложная']
+ITEM_NAMES = ['Кибердека', 'Имплант', 'Стимулятор', 'Чип памяти', 'Пистолет', 'Броня', 'Аптечка', 'Граната',
+              'Дрон', 'Глушитель', 'Визор', 'Шифратор', 'Катана', 'Батарея', 'Ключ-карта']
+TASK_TEXTS = ['Изучить новый фреймворк', 'Прочитать документацию', 'Написать тесты', 'Создать прототип интерфейса',
+              'Оптимизировать базу данных', 'Настроить CI/CD', 'Изучить алгоритмы', 'Посмотреть вебинар']
+
+ENDPOINTS = ['/', '/map', '/users', '/all_inventories', '/inventory', '/archive', '/api/map/config']
+
+
+def username(i):
+    return f'{PREFIX}{i:07d}'
+
+
+# Генераторы строк: каждая функция отдает кортежи значений для COPY
+def user_rows(volumes):
+    for i in range(volumes['users']):
+        yield username(i), 'synth', 'user', random.randint(0, 500)
+
+
+def position_rows(volumes):
+    for i in range(volumes['users']):
+        yield username(i), round(random.uniform(0, 100), 2), round(random.uniform(0, 100), 2)
+
+
+def progress_rows(volumes):
+    # Одна строка - день пользователя; уникальность (username, date) сохраняется
+    today = date.today()
+    users = max(1, volumes['users'])
+    for i in range(volumes['progress']):
+        day = today - timedelta(days=i // users)
+        tasks = random.sample(TASK_TEXTS, random.randint(1, 3))
+        yield username(i % users), day.strftime('%Y-%m-%d'), json.dumps(tasks, ensure_ascii=False)
+
+
+def item_rows(volumes):
+    users = max(1, volumes['users'])
+    for i in range(volumes['items']):
+        name = f"{random.choice(ITEM_NAMES)} #{i}"
+        yield username(random.randrange(users)), name, f'Синтетический предмет {i}', random.randint(1, 10)
+
+
+def board_rows(volumes):
+    users = max(1, volumes['users'])
+    now = date.today()
+    for i in range(volumes['board']):
+        status = random.choices(['free', 'taken', 'done'], [2, 1, 7])[0]
+        user = username(random.randrange(users)) if status != 'free' else None
+        taken_at = (now - timedelta(days=random.randint(1, 365))).strftime('%Y-%m-%d 12:00:00') if user else None
+        done_at = taken_at if status == 'done' else None
+        yield f'{PREFIX}задача {i}', random.choice(DIFFICULTIES), status, user, taken_at, done_at
+
+
+class CopyStream(io.TextIOBase):
+    """Файлоподобный поток для COPY: строки генерируются по мере чтения, память не растет"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.buffer = ''
+
+    @staticmethod
+    def encode(value):
+        if value is None:
+            return '\\N'
+        text = str(value)
+        # В текстовом формате COPY сырые \n и \r заканчивают строку, \t - поле
+        return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.buffer += '\t'.join(self.encode(v) for v in row) + '\n'
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+COPY_TARGETS = [
+    ('users', '(username, password, role, coins)', user_rows),
+    ('user_positions', '(username, x, y)', position_rows),
+    ('user_progress', '(username, date, tasks_done)', progress_rows),
+    ('user_inventory', '(username, name, description, quantity)', item_rows),
+    ('board_tasks', '(text, difficulty, status, user_taken, taken_at, done_at)', board_rows),
+]
+
+
+def clean_postgres(db):
+    cur = db.backend.conn.cursor()
+    pattern = PREFIX + '%'
+    for table in ('user_inventory', 'user_progress', 'user_positions', 'users'):
+        cur.execute(f"DELETE FROM {table} WHERE username LIKE %s", (pattern,))
+    cur.execute("DELETE FROM board_tasks WHERE text LIKE %s", (pattern,))
+    db.backend.conn.commit()
+    cur.close()
+    db.rebuild_stats()
+
+
+def load_postgres(db, volumes):
+    clean_postgres(db)
+    cur = db.backend.conn.cursor()
+    for table, columns, rows in COPY_TARGETS:
+        started = time.perf_counter()
+        cur.copy_expert(f"COPY {table} {columns} FROM STDIN", CopyStream(rows(volumes)), size=1 << 16)
+        print(f"  📥 {table}: {time.perf_counter() - started:.2f} с")
+    db.backend.conn.commit()
+    cur.close()
+    # Прогресс залит мимо save_user_progress - сводки статистики пересчитываем целиком
+    db.rebuild_stats()
+    cur = db.backend.conn.cursor()
+    cur.execute("ANALYZE")
+    db.backend.conn.commit()
+    cur.close()
+
+
+def clean_memory(db):
+    storage = db.backend.storage
+    for key in ('users', 'user_positions', 'user_inventory'):
+        for name in [name for name in storage[key] if name.startswith(PREFIX)]:
+            del storage[key][name]
+    for key in [key for key in storage['user_progress'] if key.startswith(PREFIX)]:
+        del storage['user_progress'][key]
+    storage['board_tasks'] = [t for t in storage['board_tasks'] if not t['text'].startswith(PREFIX)]
+    db.backend.rebuild_indexes()
+
+
+def load_memory(db, volumes):
+    clean_memory(db)
+    storage = db.backend.storage
+    for name, password, role, coins in user_rows(volumes):
+        storage['users'][name] = {'password': password, 'role': role, 'coins': coins}
+    for name, x, y in position_rows(volumes):
+        storage['user_positions'][name] = {'x': x, 'y': y}
+    for name, day, tasks in progress_rows(volumes):
+        storage['user_progress'].setdefault(name, {})[day] = json.loads(tasks)
+    next_id = storage['next_item_id']
+    for name, item_name, description, quantity in item_rows(volumes):
+        storage['user_inventory'].setdefault(name, {})[next_id] = {
+            'id': next_id, 'name': item_name, 'description': description, 'quantity': quantity
+        }
+        next_id += 1
+    storage['next_item_id'] = next_id
+    next_id = max([t['id'] for t in storage['board_tasks']], default=0)
+    for text, difficulty, status, user, taken_at, done_at in board_rows(volumes):
+        next_id += 1
+        storage['board_tasks'].append({'id': next_id, 'text': text, 'difficulty': difficulty, 'status': status,
+                                       'user_taken': user, 'taken_at': taken_at, 'done_at': done_at})
+    db.backend.rebuild_indexes()
+
+
+def measure(app_module, repeat):
+    """Замеряем задержку страниц от имени синтетического пользователя и админа"""
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['username'] = username(0)
+        sess['role'] = 'user'
+    admin = app_module.app.test_client()
+    with admin.session_transaction() as sess:
+        sess['username'] = 'admin'
+        sess['role'] = 'admin'
+
+    results = {}
+    for endpoint in ENDPOINTS:
+        current = admin if endpoint == '/archive' else client
+        current.get(endpoint)  # прогрев: компиляция шаблона
+        timings = []
+        for _ in range(repeat):
+            app_module._data_cache.clear()
+            started = time.perf_counter()
+            response = current.get(endpoint)
+            timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                print(f"  ⚠️ {endpoint}: HTTP {response.status_code}")
+        timings.sort()
+        results[endpoint] = {
+            'p50_ms': round(statistics.median(timings), 2),
+            'max_ms': round(timings[-1], 2),
+            'bytes': len(response.data)
+        }
+    return results
+
+
+def write_report(path, rows):
+    lines = ['# Масштабирование страниц', '',
+             '| Пользователи | Прогресс | Предметы | Доска | ' + ' | '.join(ENDPOINTS) + ' |',
+             '|' + '---|' * (4 + len(ENDPOINTS))]
+    for volumes, results in rows:
+        cells = [str(volumes[key]) for key in ('users', 'progress', 'items', 'board')]
+        cells += [f"{results[endpoint]['p50_ms']} мс" for endpoint in ENDPOINTS]
+        lines.append('| ' + ' | '.join(cells) + ' |')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    if path.endswith('.md'):
+        with open(path[:-3] + '.json', 'w', encoding='utf-8') as f:
+            json.dump([{'volumes': v, 'results': r} for v, r in rows], f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Синтетические данные и отчет о масштабировании')
+    parser.add_argument('--target', choices=['postgres', 'memory'], default='postgres')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--progress', type=int, default=1000000)
+    parser.add_argument('--items', type=int, default=200000)
+    parser.add_argument('--board', type=int, default=5000)
+    parser.add_argument('--steps', default='1', help='доли объема через запятую, например 0.01,0.1,1')
+    parser.add_argument('--repeat', type=int, default=5, help='сколько раз запрашивать каждую страницу')
+    parser.add_argument('--report', default='scaling_report.md', help='файл отчета (пусто - без замеров)')
+    parser.add_argument('--clean', action='store_true', help='только удалить синтетические данные')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    if args.target == 'memory':
+        os.environ['USE_IN_MEMORY_DB'] = '1'
+        # Синтетические данные не пишем в журнал хранилища
+        os.environ['MEMORY_STORE_DIR'] = ''
+    elif args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+
+    # Импортируем приложение здесь: оно подключается к базе при импорте
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as app_module
+    db = app_module.db
+
+    if args.target == 'postgres' and not db.is_connected:
+        print("❌ Нет подключения к PostgreSQL")
+        return 1
+
+    if args.clean:
+        clean_postgres(db) if args.target == 'postgres' else clean_memory(db)
+        print("🧹 Синтетические данные удалены")
+        return 0
+
+    full = {'users': args.users, 'progress': args.progress, 'items': args.items, 'board': args.board}
+    rows = []
+    for step in [float(s) for s in args.steps.split(',') if s.strip()]:
+        volumes = {key: int(value * step) for key, value in full.items()}
+        print(f"🔄 Загрузка: {volumes}")
+        started = time.perf_counter()
+        load_postgres(db, volumes) if args.target == 'postgres' else load_memory(db, volumes)
+        print(f"✅ Загружено за {time.perf_counter() - started:.2f} с")
+
+        if args.report:
+            results = measure(app_module, args.repeat)
+            for endpoint, stats in results.items():
+                print(f"  {endpoint:<20} p50 {stats['p50_ms']:>9} мс   max {stats['max_ms']:>9} мс   "
+                      f"{stats['bytes']} байт")
+            rows.append((volumes, results))
+
+    if args.report and rows:
+        write_report(args.report, rows)
+        print(f"📄 Отчет сохранен в {args.report}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
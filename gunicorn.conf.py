@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Конфигурация gunicorn для продакшена (Railway).
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Число воркеров и потоков считается от числа CPU и переопределяется
+переменными окружения. Приложение загружается в мастере (preload_app), а
+подключение к базе и фоновые потоки запускаются в каждом воркере (хук
+post_worker_init, app.init_worker): соединение PostgreSQL нельзя делить между
+процессами. Там же воркер прогревает кэши и шаблоны (app.warm_up) и только
+потом начинает принимать запросы. post_fork лишь выдает воркеру его файлы:
+каталог хранилища в памяти и журнал сбоя по номеру слота.
+
+Подключение при запуске воркера ограничено DB_CONNECT_BUDGET (по умолчанию
+половина timeout): если PostgreSQL недоступен, воркер переходит на хранилище в
+памяти и журнал сбоя, а не молчит, пока его не убьет арбитр.
+
+Переменные окружения:
+    WEB_CONCURRENCY          число воркеров (по умолчанию 2 * CPU + 1, не больше GUNICORN_MAX_WORKERS)
+    GUNICORN_THREADS         потоков в воркере gthread (по умолчанию 4)
+    GUNICORN_WORKER_CLASS    gthread (по умолчанию) или gevent
+    GUNICORN_TIMEOUT         сколько секунд воркер может молчать до перезапуска
+    GUNICORN_MAX_REQUESTS    перезапуск воркера после стольких запросов (0 - никогда)
+    RATE_LIMITS              лимиты частоты запросов по endpoint (см. ratelimit.py)
+"""
+import multiprocessing
+import os
+import sys
+
+# Конфиг читается до того, как gunicorn добавит каталог приложения в sys.path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Ведра ограничения частоты - в общей памяти, созданной здесь, в мастере: после fork она общая для воркеров
+import ratelimit  # noqa: E402,F401
+
+_cpu = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             min(2 * _cpu + 1, int(os.environ.get('GUNICORN_MAX_WORKERS', '8')))))
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+# Для gevent - сколько запросов воркер держит одновременно
+worker_connections = int(os.environ.get('ASYNC_MAX_CONNECTIONS', '1000'))
+
+if worker_class == 'gevent':
+    # Патчи gevent должны примениться до импорта приложения, поэтому без preload
+    wsgi_app = 'async_server:app'
+    preload_app = False
+else:
+    wsgi_app = 'app:app'
+    preload_app = True
+# app.py не подключается к базе при импорте (в мастере или при загрузке gevent-воркера) - это делает post_worker_init
+os.environ['RGG_DEFER_STARTUP'] = '1'
+
+# Пул соединений на воркер: по одному на поток
+os.environ.setdefault('DB_POOL_SIZE', str(threads if worker_class == 'gthread' else 10))
+
+# Самые долгие запросы - выгрузка профилей и массовое начисление монет из файла;
+# страницы и JSON-обработчики отвечают за десятки миллисекунд
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '20'))
+# Часы timeout идут с запуска воркера: подключение к базе должно уложиться в них с запасом
+os.environ.setdefault('DB_CONNECT_BUDGET', str(timeout / 2))
+# Railway держит соединения через свой прокси
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+
+# Плавный перезапуск воркеров против утечек памяти; разброс, чтобы они не перезапускались разом
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', str(max_requests // 10)))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+# Хранилище в памяти и журнал сбоя - файлы одного процесса, каждому воркеру свой слот
+_memory_store_dir = os.environ.get('MEMORY_STORE_DIR', 'memory_store')
+_outage_journal = os.environ.get('OUTAGE_JOURNAL', 'outage_journal.jsonl')
+
+
+def pre_fork(server, worker):
+    # Наименьший свободный номер: новый воркер занимает слот упавшего и подхватывает его файлы
+    busy = {getattr(other, 'slot', None) for other in server.WORKERS.values()}
+    worker.slot = next(slot for slot in range(len(busy) + 1) if slot not in busy)
+
+
+def post_fork(server, worker):
+    # Только окружение слота: подключение к базе - в post_worker_init, когда воркер загрузил приложение
+    if _memory_store_dir:
+        os.environ['MEMORY_STORE_DIR'] = os.path.join(_memory_store_dir, f'worker-{worker.slot}')
+    base, ext = os.path.splitext(_outage_journal)
+    os.environ['OUTAGE_JOURNAL'] = f'{base}-{worker.slot}{ext}'
+
+
+def post_worker_init(worker):
+    # Приложение уже загружено (в мастере или, для gevent, в этом воркере после патчей)
+    import app
+    app.init_worker()
+    worker.log.info(f"👷 Воркер {worker.pid} (слот {worker.slot}) готов")
+
+
+def worker_exit(server, worker):
+    # Дописываем журнал действий, возвращаем соединения и сохраняем снимок хранилища в памяти
+    from activity import activity_log
+    from database import db
+    if db.backend is not None:
+        activity_log.flush()
+        db.close()
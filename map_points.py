@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Компактное колоночное представление точек карты.
+
+Активных точек на карте около тысячи, и каждая в JSON - отдельный объект
+{"type": "active", "x": 11.2, "y": 3.6}. PointColumns хранит их тремя
+массивами: x и y - float32, тип - код в один байт. В памяти это 9 байт на
+точку вместо словаря, а в базе и в ответе API - три строки base64:
+
+    {"format": "columnar", "count": 938, "types": ["start", "active", ...],
+     "x": "<float32 LE>", "y": "<float32 LE>", "t": "<uint8>"}
+
+Координаты - проценты от 0 до 100, точности float32 (7 знаков) хватает с
+запасом; при выдаче списком они округляются до COORDINATE_DIGITS знаков.
+decode принимает и старый формат (список объектов), поэтому сохраненные
+раньше карты читаются без миграции.
+"""
+import base64
+import sys
+from array import array
+
+COLUMNAR_FORMAT = 'columnar'
+# Коды типов; новые типы дописываются в конец, чтобы не менять старые коды
+POINT_TYPES = ('start', 'active', 'checkpoint', 'end')
+COORDINATE_DIGITS = 4
+
+
+def _pack(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+
+def _unpack(typecode, data):
+    values = array(typecode)
+    values.frombytes(base64.b64decode(data))
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+class PointColumns:
+    """Точки одного списка карты в трех массивах; при итерации отдает обычные словари"""
+
+    __slots__ = ('xs', 'ys', 'codes')
+
+    def __init__(self, xs=None, ys=None, codes=None):
+        self.xs = xs if xs is not None else array('f')
+        self.ys = ys if ys is not None else array('f')
+        self.codes = codes if codes is not None else array('B')
+
+    @classmethod
+    def from_points(cls, points):
+        columns = cls()
+        for point in points:
+            columns.append(point['x'], point['y'], point.get('type', 'active'))
+        return columns
+
+    @classmethod
+    def decode(cls, data):
+        """Колонки из сохраненного или присланного значения: колоночный dict, список точек или None"""
+        if data is None:
+            return cls()
+        if isinstance(data, cls):
+            return data
+        if isinstance(data, dict) and data.get('format') == COLUMNAR_FORMAT:
+            types = data.get('types', POINT_TYPES)
+            codes = _unpack('B', data['t'])
+            # Коды клиента переводим в свои, если его список типов отличается
+            if tuple(types) != POINT_TYPES:
+                codes = array('B', (POINT_TYPES.index(types[code]) for code in codes))
+            columns = cls(_unpack('f', data['x']), _unpack('f', data['y']), codes)
+            if not len(columns.xs) == len(columns.ys) == len(columns.codes) == data.get('count', len(codes)):
+                raise ValueError("Колонки точек разной длины")
+            return columns
+        return cls.from_points(data)
+
+    def append(self, x, y, point_type='active'):
+        if point_type not in POINT_TYPES:
+            raise ValueError(f"Неизвестный тип точки: {point_type}")
+        self.xs.append(float(x))
+        self.ys.append(float(y))
+        self.codes.append(POINT_TYPES.index(point_type))
+
+    def encode(self):
+        return {
+            'format': COLUMNAR_FORMAT,
+            'count': len(self),
+            'types': list(POINT_TYPES),
+            'x': _pack(self.xs),
+            'y': _pack(self.ys),
+            't': _pack(self.codes),
+        }
+
+    def to_points(self):
+        return list(self)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        for x, y, code in zip(self.xs, self.ys, self.codes):
+            yield {'type': POINT_TYPES[code], 'x': round(x, COORDINATE_DIGITS), 'y': round(y, COORDINATE_DIGITS)}
+
+    def __eq__(self, other):
+        return (isinstance(other, PointColumns) and self.xs == other.xs and self.ys == other.ys
+                and self.codes == other.codes)
+
+
+def decode_map_config(config):
+    """Конфиг карты с active_points в виде PointColumns"""
+    if config is None:
+        return None
+    return {**config, 'active_points': PointColumns.decode(config.get('active_points'))}
+
+
+def encode_active_points(points):
+    """active_points для записи в базу: колоночный dict"""
+    return PointColumns.decode(points).encode()
+
+
+def map_config_payload(config, columnar=False):
+    """Конфиг карты для JSON-ответа: active_points колонками или, по умолчанию, списком объектов"""
+    points = PointColumns.decode(config.get('active_points'))
+    return {**config, 'active_points': points.encode() if columnar else points.to_points()}
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Метрики в текстовом формате Prometheus.
+
+Без внешних зависимостей: гистограммы и счетчики хранятся в словарях
+процесса, запись - это bisect по границам корзин и инкремент под блокировкой,
+поэтому инструментирование можно держать включенным на полной нагрузке.
+При нескольких воркерах gunicorn каждый воркер отдает свои значения.
+"""
+import bisect
+import functools
+import threading
+import time
+
+# Границы корзин в секундах: от долей миллисекунды (память) до секунд (тяжелые страницы)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Gauge:
+    """Значение вычисляется в момент запроса /metrics"""
+
+    def __init__(self, name, documentation, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        _registry.append(self)
+
+    def render(self):
+        try:
+            value = float(self.callback())
+        except Exception:
+            value = float('nan')
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge', f'{self.name} {value}']
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # [счетчики корзин..., +Inf] + сумма
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, ("le", le))} {cumulative}')
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_str} {total}')
+            lines.append(f'{self.name}_count{label_str} {cumulative}')
+        return lines
+
+
+def render_all():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Метрики приложения
+REQUEST_LATENCY = Histogram('rgg_request_duration_seconds', 'Время обработки запроса по endpoint Flask',
+                            ('endpoint', 'method', 'status'))
+DB_METHOD_LATENCY = Histogram('rgg_db_method_duration_seconds', 'Время выполнения методов Database',
+                              ('method',))
+DB_METHOD_ERRORS = Counter('rgg_db_method_errors_total', 'Исключения, вышедшие из методов Database', ('method',))
+CACHE_REQUESTS = Counter('rgg_cache_requests_total', 'Обращения к кэшу данных', ('cache', 'result'))
+IN_MEMORY_ACTIVATIONS = Counter('rgg_in_memory_fallback_activations_total',
+                                'Сколько раз включалось временное хранилище в памяти')
+OUTAGE_JOURNAL_REPLAYED = Counter('rgg_outage_journal_replayed_total',
+                                  'Записи журнала сбоя, перенесенные в PostgreSQL')
+DB_READS = Counter('rgg_db_reads_total', 'Чтения при настроенных репликах: replica, primary, fallback', ('target',))
+RATE_LIMITED = Counter('rgg_rate_limited_total', 'Запросы, отклоненные ограничением частоты (429)', ('endpoint',))
+
+
+def instrument_methods(cls, histogram=DB_METHOD_LATENCY, errors=DB_METHOD_ERRORS):
+    """Оборачивает публичные методы класса замером времени"""
+    for name, method in list(vars(cls).items()):
+        if name.startswith('_') or not callable(method):
+            continue
+        setattr(cls, name, _timed(method, name, histogram, errors))
+    return cls
+
+
+def _timed(method, name, histogram, errors):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            errors.inc(name)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started, name)
+
+    return wrapper
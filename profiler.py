@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Профилирование отдельного запроса по требованию администратора.
+
+Используется семплирующий профайлер: отдельный поток раз в PROFILE_INTERVAL_MS
+снимает стек только того потока, который обрабатывает профилируемый запрос,
+поэтому остальные запросы не трассируются и не замедляются заметно.
+Результат сохраняется в двух видах:
+  * .prof - файл в формате pstats (python -m pstats, snakeviz);
+  * .collapsed - свернутые стеки для flamegraph.pl / speedscope.
+
+Под gevent (async_server.py, gunicorn -k gevent) профилирование отключено:
+все запросы - гринлеты одного потока, и стек потока смешал бы их между собой.
+"""
+import marshal
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 2))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+
+PROFILE_NAME = re.compile(r'^[\w.-]+\.(prof|collapsed)$')
+
+
+def profiling_available():
+    """False, если потоки подменены гринлетами gevent"""
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is None or not monkey.is_module_patched('threading')
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id, interval_ms=PROFILE_INTERVAL_MS):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000.0
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self.started = None
+        self.elapsed = 0.0
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+    def collapsed(self):
+        """Свернутые стеки: "модуль:функция;модуль:функция N" """
+        lines = []
+        for stack, count in self.samples.most_common():
+            names = ';'.join(f"{os.path.basename(filename)}:{name}" for filename, _, name in stack)
+            lines.append(f"{names} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def pstats_data(self):
+        """Словарь статистики в формате pstats; время восстанавливается по числу семплов"""
+        stats = {}
+        for stack, count in self.samples.items():
+            seconds = count * self.interval
+            seen = set()
+            for depth, func in enumerate(stack):
+                cc, nc, tt, ct, callers = stats.get(func, (0, 0, 0.0, 0.0, {}))
+                if func not in seen:
+                    # Рекурсивные вызовы учитываются в ct один раз
+                    ct += seconds
+                    seen.add(func)
+                if depth == len(stack) - 1:
+                    tt += seconds
+                nc += count
+                cc += count
+                if depth > 0:
+                    caller = stack[depth - 1]
+                    c_cc, c_nc, c_tt, c_ct = callers.get(caller, (0, 0, 0.0, 0.0))
+                    callers[caller] = (c_cc + count, c_nc + count, c_tt + (seconds if depth == len(stack) - 1 else 0.0),
+                                       c_ct + seconds)
+                stats[func] = (cc, nc, tt, ct, callers)
+        return stats
+
+
+def save_profile(profiler, label):
+    """Сохраняет результат и возвращает базовое имя файлов"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe_label = re.sub(r'[^\w-]+', '_', label or 'request').strip('_') or 'request'
+    base = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{safe_label}"
+
+    with open(os.path.join(PROFILE_DIR, base + '.prof'), 'wb') as f:
+        marshal.dump(profiler.pstats_data(), f)
+    with open(os.path.join(PROFILE_DIR, base + '.collapsed'), 'w', encoding='utf-8') as f:
+        f.write(profiler.collapsed())
+
+    prune_profiles()
+    return base
+
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return sorted((name for name in os.listdir(PROFILE_DIR) if PROFILE_NAME.match(name)), reverse=True)
+
+
+def prune_profiles(keep=PROFILE_KEEP):
+    """Храним только последние keep профилей (по два файла на профиль)"""
+    for name in list_profiles()[keep * 2:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except OSError:
+            pass
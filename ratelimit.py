@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Ограничение частоты запросов (token bucket) для входа, регистрации и записей.
+
+Для каждого правила (endpoint Flask) и ключа (игрок или IP) есть ведро:
+число токенов и время последнего обращения. Запрос забирает токен, токены
+восполняются со скоростью requests / seconds в секунду, но не больше
+requests. Пустое ведро - ответ 429 с Retry-After: через сколько секунд
+появится следующий токен.
+
+Ведра лежат в общей памяти: анонимный mmap (MAP_SHARED), созданный до fork
+воркеров gunicorn. gunicorn.conf.py импортирует модуль в мастере, поэтому все
+воркеры работают с одной таблицей и лимит общий на сервер, а не на воркер.
+Таблица - RATE_LIMIT_SLOTS ячеек по 24 байта (хэш ключа, токены, время),
+разбитых на группы по PROBES: ключ ищется только в своей группе, а если его
+там нет, занимает ячейку, которую дольше всех не трогали. Вытесненное ведро
+просто снова полное. Группы защищены полосами межпроцессных блокировок;
+решение - хэш и пара struct.unpack_from/pack_into, единицы микросекунд.
+
+RATE_LIMITS переопределяет правила, например
+"login=10/60,save_user_position_route=20/5" - endpoint=запросов/секунд;
+0 вместо числа запросов отключает правило. RATE_LIMIT_ENABLED=0 отключает
+ограничение целиком. За прокси (Railway) адрес клиента берется из
+X-Forwarded-For: RATE_LIMIT_PROXY_HOPS - сколько прокси добавляют туда адрес.
+"""
+import hashlib
+import logging
+import mmap
+import multiprocessing
+import os
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_SLOTS = int(os.environ.get('RATE_LIMIT_SLOTS', '65536'))
+RATE_LIMIT_PROXY_HOPS = int(os.environ.get('RATE_LIMIT_PROXY_HOPS', '0'))
+
+# endpoint: (запросов, за секунд, ключ ведра: 'user' - игрок из сессии, 'ip' - адрес клиента)
+DEFAULT_LIMITS = {
+    'login': (10, 60, 'ip'),
+    'register': (5, 300, 'ip'),
+    'save_user_position_route': (20, 5, 'user'),
+    'add_inventory_item': (30, 60, 'user'),
+    'update_inventory_item': (60, 60, 'user'),
+    'delete_inventory_item': (30, 60, 'user'),
+    'inventory_batch': (10, 60, 'user'),
+}
+# Ограничиваются только изменяющие запросы: GET /login - это просто форма
+LIMITED_METHODS = frozenset(['POST', 'PUT', 'PATCH', 'DELETE'])
+
+# Ячейка: хэш ключа (0 - пусто), токены, время последнего обращения (time.monotonic, общее для процессов)
+SLOT = struct.Struct('<Qdd')
+PROBES = 4
+LOCK_STRIPES = 64
+# Дольше ждать блокировку не стоит: лучше пропустить запрос, чем задержать
+LOCK_TIMEOUT = 0.05
+
+
+def parse_limits(text, defaults=DEFAULT_LIMITS):
+    """RATE_LIMITS "endpoint=запросов/секунд[:ip|user],..." поверх defaults"""
+    limits = dict(defaults)
+    for part in (text or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            endpoint, spec = part.split('=', 1)
+            spec, _, key = spec.partition(':')
+            requests, seconds = spec.split('/', 1)
+            endpoint = endpoint.strip()
+            requests, seconds = int(requests), float(seconds)
+            key = key.strip() or limits.get(endpoint, (0, 0, 'user'))[2]
+            if key not in ('ip', 'user') or seconds <= 0:
+                raise ValueError(part)
+        except ValueError:
+            logger.warning(f"⚠️ Пропущено правило RATE_LIMITS: {part}")
+            continue
+        if requests <= 0:
+            limits.pop(endpoint, None)
+        else:
+            limits[endpoint] = (requests, seconds, key)
+    return limits
+
+
+def client_ip(remote_addr, forwarded_for=None, hops=RATE_LIMIT_PROXY_HOPS):
+    """Адрес клиента: hops-й справа в X-Forwarded-For (его добавил наш прокси), иначе адрес соединения"""
+    if hops and forwarded_for:
+        chain = [address.strip() for address in forwarded_for.split(',')]
+        if len(chain) >= hops:
+            return chain[-hops]
+    return remote_addr or 'unknown'
+
+
+class RateLimiter:
+    def __init__(self, limits=None, slots=RATE_LIMIT_SLOTS):
+        self.limits = limits if limits is not None else parse_limits(os.environ.get('RATE_LIMITS'))
+        self.groups = max(1, slots // PROBES)
+        # Анонимная память MAP_SHARED наследуется воркерами после fork
+        self._buffer = mmap.mmap(-1, self.groups * PROBES * SLOT.size)
+        self._locks = [multiprocessing.Lock() for _ in range(min(LOCK_STRIPES, self.groups))]
+
+    def check(self, endpoint, method, username, ip):
+        """Забирает токен; 0 - запрос разрешен, иначе через сколько секунд повторить"""
+        rule = self.limits.get(endpoint)
+        if rule is None or method not in LIMITED_METHODS:
+            return 0
+        requests, seconds, key_kind = rule
+        key = username if key_kind == 'user' and username else ip
+        return self.take(f"{endpoint}\0{key_kind}\0{key}", requests / seconds, requests)
+
+    def take(self, key, rate, burst, now=None):
+        digest = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+        group = digest % self.groups
+        lock = self._locks[group % len(self._locks)]
+        if not lock.acquire(timeout=LOCK_TIMEOUT):
+            return 0
+        try:
+            now = time.monotonic() if now is None else now
+            buffer = self._buffer
+            first = group * PROBES * SLOT.size
+            offset = None
+            victim, victim_time = first, float('inf')
+            for slot in range(first, first + PROBES * SLOT.size, SLOT.size):
+                stored, tokens, updated = SLOT.unpack_from(buffer, slot)
+                if stored == digest:
+                    offset = slot
+                    break
+                if updated < victim_time:
+                    victim, victim_time = slot, updated
+            if offset is None:
+                offset, tokens, updated = victim, burst, now
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0
+            else:
+                retry_after = (1 - tokens) / rate
+            SLOT.pack_into(buffer, offset, digest, tokens, now)
+            return retry_after
+        finally:
+            lock.release()
+
+
+# Создается при импорте: под gunicorn это происходит в мастере, до fork воркеров
+limiter = RateLimiter() if RATE_LIMIT_ENABLED else None
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Сводки статистики для админки: пересчет из истории прогресса.
+
+Таблицы stats_user_daily (дата, игрок, выполнений) и stats_task_daily
+(дата, задача, выполнений) обновляются на разницу при каждом
+save_user_progress, поэтому страница /admin/stats читает готовые числа, а не
+весь user_progress. Пересчет с нуля нужен после первого развертывания (история
+уже есть, сводок еще нет), после загрузки данных мимо приложения и если
+сводки разошлись с историей.
+
+Примеры:
+    python rollups.py rebuild
+    python rollups.py rebuild --backend sqlite --sqlite-path rgg_quest.sqlite3
+    python rollups.py show --days 7
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+from storage import create_backend
+
+
+def connect(args):
+    options = {}
+    if args.backend == 'postgres':
+        options = {'database_url': args.database_url, 'max_retries': 1}
+    elif args.sqlite_path:
+        options = {'path': args.sqlite_path}
+    backend = create_backend(args.backend, **options)
+    backend.connect()
+    return backend
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сводки статистики RGG QUEST')
+    parser.add_argument('command', choices=['rebuild', 'show'])
+    parser.add_argument('--backend', choices=['postgres', 'sqlite'],
+                        default=os.environ.get('STORAGE_BACKEND', 'postgres'))
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--sqlite-path', default=os.environ.get('SQLITE_PATH'))
+    parser.add_argument('--days', type=int, default=30, help='период для show')
+    args = parser.parse_args()
+    if args.backend not in ('postgres', 'sqlite'):
+        # Хранилище в памяти пересчитывает сводки само при запуске процесса
+        parser.error(f'сводки хранятся только в postgres или sqlite, а не в {args.backend}')
+
+    backend = connect(args)
+    started = time.perf_counter()
+    try:
+        if args.command == 'rebuild':
+            report = backend.rebuild_stats()
+            if report is None:
+                print("❌ Пересчет не удался, подробности в логе")
+                return 1
+            print(f"✅ Сводки пересчитаны: {report['user_rows']} строк по игрокам, {report['task_rows']} по задачам")
+        else:
+            since = (date.today() - timedelta(days=args.days - 1)).strftime('%Y-%m-%d')
+            print(json.dumps(backend.get_stats(since), ensure_ascii=False, indent=2, default=str))
+    finally:
+        backend.close()
+    print(f"⏱️ {time.perf_counter() - started:.2f} с")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""Планировщик периодических задач с выбором одного ведущего на все процессы.
+
+Задачи регистрируются в app.py: scheduler.register(name, interval, func).
+Поток scheduler в каждом воркере раз в SCHEDULER_TICK секунд проверяет, какие
+задачи пора запускать. interval - секунды между запусками или функция, которая
+возвращает их после каждого запуска (например, «до полуночи, но не больше часа»).
+
+Задачи бывают двух видов:
+    exclusive=True  - работа над общими данными (расчет задач на день, архив,
+                      чистка истории, пересчет сводок). Их выполняет только
+                      ведущий - воркер, который держит блокировку хранилища
+                      (advisory lock в PostgreSQL, flock файла рядом с базой
+                      SQLite). Блокировка одна на базу, поэтому при любом
+                      числе воркеров и узлов задача выполняется один раз.
+    exclusive=False - работа над данными процесса (прогрев кэша). Выполняется
+                      в каждом воркере.
+
+Блокировка PostgreSQL живет вместе с соединением: если ведущий упал или
+потерял базу, блокировку снимает сервер, и ее забирает другой воркер, который
+пробует раз в SCHEDULER_LEADER_RETRY секунд. Время последних запусков лежит в
+таблице scheduled_jobs, поэтому новый ведущий продолжает расписание, а не
+запускает все сразу. На хранилище в памяти (и во время сбоя PostgreSQL)
+данные у каждого процесса свои, и каждый процесс сам себе ведущий.
+
+SCHEDULER_ENABLED=0 отключает планировщик (например, на узле только для чтения).
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import metrics
+from database import db
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', '1') == '1'
+SCHEDULER_TICK = float(os.environ.get('SCHEDULER_TICK', '5'))
+# Как часто не ведущий воркер пробует забрать блокировку (каждая попытка - новое соединение с базой)
+SCHEDULER_LEADER_RETRY = float(os.environ.get('SCHEDULER_LEADER_RETRY', '30'))
+
+RUNS = metrics.Counter('rgg_scheduler_runs_total', 'Запуски периодических задач: ok, error', ('job', 'result'))
+DURATION = metrics.Histogram('rgg_scheduler_job_seconds', 'Время выполнения периодических задач', ('job',))
+
+
+class Job:
+    __slots__ = ('name', 'interval', 'func', 'exclusive', 'next_run', 'last_run_at', 'duration', 'error')
+
+    def __init__(self, name, interval, func, exclusive=True):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.exclusive = exclusive
+        self.next_run = 0
+        self.last_run_at = None
+        self.duration = None
+        self.error = None
+
+    def seconds_between_runs(self):
+        return self.interval() if callable(self.interval) else self.interval
+
+    def status(self):
+        return {'exclusive': self.exclusive, 'last_run_at': self.last_run_at, 'duration': self.duration,
+                'error': self.error,
+                'next_run_in': max(0, round(self.next_run - time.time())) if self.next_run else None}
+
+
+class Scheduler:
+    def __init__(self, tick=SCHEDULER_TICK, leader_retry=SCHEDULER_LEADER_RETRY):
+        self.tick = tick
+        self.leader_retry = leader_retry
+        self.jobs = {}
+        # Бэкенд, на котором этот процесс держит блокировку ведущего; None - не ведущий
+        self._leader_backend = None
+        self._next_leader_attempt = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_leader(self):
+        return self._leader_backend is not None
+
+    def register(self, name, interval, func, exclusive=True):
+        self.jobs[name] = Job(name, interval, func, exclusive)
+        return func
+
+    def start(self):
+        if not SCHEDULER_ENABLED:
+            logger.info("⏸️ Планировщик отключен (SCHEDULER_ENABLED=0)")
+            return None
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._resign()
+
+    def run_pending(self, now=None):
+        """Один проход: подтверждает роль ведущего и запускает задачи, которым пора"""
+        now = time.time() if now is None else now
+        self._update_leadership(now)
+        for job in list(self.jobs.values()):
+            if self._stop.is_set():
+                break
+            if job.exclusive and not self.is_leader:
+                continue
+            if now >= job.next_run:
+                self.run_job(job)
+
+    def run_job(self, job):
+        started_at = datetime.now()
+        started = time.perf_counter()
+        error = None
+        try:
+            job.func()
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            logger.error(f"❌ Ошибка периодической задачи {job.name}: {e}")
+        finally:
+            job.duration = round(time.perf_counter() - started, 3)
+            job.last_run_at = started_at.strftime('%Y-%m-%d %H:%M:%S')
+            job.error = error
+            job.next_run = time.time() + job.seconds_between_runs()
+            RUNS.inc(job.name, 'error' if error else 'ok')
+            DURATION.observe(job.duration, job.name)
+            if job.exclusive:
+                try:
+                    db.record_job_run(job.name, job.last_run_at, job.duration, error)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка записи запуска задачи {job.name}: {e}")
+            db.release()
+
+    def status(self):
+        return {'leader': self.is_leader, 'jobs': {name: job.status() for name, job in self.jobs.items()}}
+
+    def _update_leadership(self, now):
+        backend = db.backend
+        if self._leader_backend is not None:
+            # Хранилище переключилось (сбой PostgreSQL или его возвращение): блокировка была на старом
+            if self._leader_backend is not backend or not backend.try_acquire_scheduler_lock():
+                logger.warning("⚠️ Планировщик: роль ведущего потеряна")
+                self._resign()
+            return
+        if backend is None or now < self._next_leader_attempt:
+            return
+        self._next_leader_attempt = now + self.leader_retry
+        try:
+            acquired = backend.try_acquire_scheduler_lock()
+        except Exception as e:
+            logger.error(f"❌ Ошибка выбора ведущего планировщика: {e}")
+            return
+        if acquired:
+            self._leader_backend = backend
+            self._resume_schedule()
+            logger.info(f"👑 Планировщик: воркер {os.getpid()} стал ведущим")
+
+    def _resume_schedule(self):
+        """Новый ведущий продолжает расписание по последним запускам из хранилища"""
+        try:
+            runs = db.get_job_runs()
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения запусков задач: {e}")
+            runs = {}
+        for job in self.jobs.values():
+            run = runs.get(job.name)
+            if not job.exclusive or not run:
+                continue
+            try:
+                last_run = datetime.strptime(str(run['last_run_at'])[:19], '%Y-%m-%d %H:%M:%S')
+            except ValueError:
+                continue
+            job.last_run_at = last_run.strftime('%Y-%m-%d %H:%M:%S')
+            job.duration, job.error = run['duration'], run['error']
+            job.next_run = max(job.next_run, (last_run + timedelta(seconds=job.seconds_between_runs())).timestamp())
+
+    def _resign(self):
+        backend, self._leader_backend = self._leader_backend, None
+        self._next_leader_attempt = 0
+        if backend is not None:
+            try:
+                backend.release_scheduler_lock()
+            except Exception as e:
+                logger.error(f"❌ Ошибка освобождения блокировки планировщика: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.error(f"❌ Ошибка планировщика: {e}")
+            self._stop.wait(self.tick)
+        self._resign()
+
+
+# Глобальный планировщик
+scheduler = Scheduler()
+
+metrics.Gauge('rgg_scheduler_leader', 'Этот процесс - ведущий планировщика (1/0)', lambda: int(scheduler.is_leader))
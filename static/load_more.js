@@ -0,0 +1,28 @@
+// Кнопка «Показать еще»: запрашивает следующую страницу по курсору и дописывает готовый HTML
+document.addEventListener('click', async function(event) {
+    const button = event.target.closest('.load-more');
+    if (!button || button.disabled) {
+        return;
+    }
+
+    button.disabled = true;
+    try {
+        const url = new URL(button.dataset.url, window.location.origin);
+        url.searchParams.set('after', button.dataset.after);
+        const response = await fetch(url);
+        const result = await response.json();
+        if (!response.ok) {
+            throw new Error(result.error || response.status);
+        }
+
+        document.querySelector(button.dataset.target).insertAdjacentHTML('beforeend', result.html);
+        if (result.next === null) {
+            button.closest('.load-more-container').remove();
+            return;
+        }
+        button.dataset.after = result.next;
+    } catch (error) {
+        alert('Ошибка загрузки: ' + error.message);
+    }
+    button.disabled = false;
+});
@@ -0,0 +1,61 @@
+// Колоночный формат точек карты (map_points.py): x и y - float32, тип - байт, все в base64
+const MapPoints = {
+    FORMAT: 'columnar',
+    TYPES: ['start', 'active', 'checkpoint', 'end'],
+
+    _bytes(base64) {
+        const binary = atob(base64);
+        const bytes = new Uint8Array(binary.length);
+        for (let i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        return bytes;
+    },
+
+    _base64(bytes) {
+        let binary = '';
+        for (let i = 0; i < bytes.length; i += 0x8000) {
+            binary += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000));
+        }
+        return btoa(binary);
+    },
+
+    // Колонки -> [{type, x, y}]; список объектов (старый формат) возвращается как есть
+    decode(data) {
+        if (!data || data.format !== this.FORMAT) {
+            return data || [];
+        }
+        const xs = new Float32Array(this._bytes(data.x).buffer);
+        const ys = new Float32Array(this._bytes(data.y).buffer);
+        const codes = this._bytes(data.t);
+        const types = data.types || this.TYPES;
+        const points = new Array(codes.length);
+        for (let i = 0; i < codes.length; i++) {
+            points[i] = {
+                type: types[codes[i]],
+                x: Math.round(xs[i] * 1e4) / 1e4,
+                y: Math.round(ys[i] * 1e4) / 1e4
+            };
+        }
+        return points;
+    },
+
+    encode(points) {
+        const xs = new Float32Array(points.length);
+        const ys = new Float32Array(points.length);
+        const codes = new Uint8Array(points.length);
+        points.forEach((point, i) => {
+            xs[i] = point.x;
+            ys[i] = point.y;
+            codes[i] = Math.max(this.TYPES.indexOf(point.type), 0);
+        });
+        return {
+            format: this.FORMAT,
+            count: points.length,
+            types: this.TYPES,
+            x: this._base64(new Uint8Array(xs.buffer)),
+            y: this._base64(new Uint8Array(ys.buffer)),
+            t: this._base64(codes)
+        };
+    }
+};
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""Бэкенды хранилища: PostgreSQL, память процесса и SQLite"""
+from .base import StorageBackend
+from .journal import JOURNALED_METHODS, OutageJournal, OutageWriteRejected
+from .memory import MemoryBackend
+from .postgres import PostgresBackend
+from .replicas import PRIMARY_READ_METHODS, READ_METHODS, REPLICA_STICKY_SECONDS, ReplicaSet, replica_urls
+from .sqlite import SQLiteBackend
+
+BACKENDS = {
+    'postgres': PostgresBackend,
+    'memory': MemoryBackend,
+    'sqlite': SQLiteBackend,
+}
+
+
+def create_backend(name, **options):
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Неизвестный бэкенд хранилища: {name}") from None
+    return backend_class(**options)
+
+
+__all__ = ['StorageBackend', 'MemoryBackend', 'PostgresBackend', 'SQLiteBackend', 'BACKENDS', 'create_backend',
+           'OutageJournal', 'OutageWriteRejected', 'JOURNALED_METHODS', 'ReplicaSet', 'READ_METHODS',
+           'PRIMARY_READ_METHODS', 'REPLICA_STICKY_SECONDS', 'replica_urls']
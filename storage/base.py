@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""Интерфейс хранилища данных.
+
+Каждый бэкенд (PostgreSQL, память, SQLite) реализует одинаковый набор методов,
+а Database в database.py выбирает бэкенд по конфигурации и делегирует ему
+вызовы. Методы возвращают обычные dict/list, чтобы app.py не зависел от
+конкретного хранилища.
+"""
+import copy
+from collections import Counter
+from datetime import datetime
+
+DEFAULT_USERS = [
+    ('admin', 'password', 'admin', 100),
+    ('user1', 'pass1', 'user', 50),
+    ('user2', 'pass2', 'user', 30)
+]
+
+DEFAULT_TASKS = {
+    "button1": ["Изучить новый фреймворк", "Прочитать документацию", "Написать тесты"],
+    "button2": ["Создать прототип интерфейса", "Оптимизировать базу данных", "Настроить CI/CD"],
+    "button3": ["Изучить алгоритмы", "Попрактиковаться в английском", "Посмотреть вебинар"]
+}
+
+DEFAULT_MAP = {
+    'start_point': {'x': 15, 'y': 75, 'type': 'start'},
+    'active_points': [
+        {'x': 25, 'y': 70, 'type': 'active'},
+        {'x': 35, 'y': 65, 'type': 'active'},
+        {'x': 45, 'y': 60, 'type': 'active'}
+    ],
+    'checkpoints': [
+        {'x': 75, 'y': 45, 'type': 'checkpoint', 'name': "Первый уровень", 'required': 5, 'icon': "🎯"},
+        {'x': 85, 'y': 40, 'type': 'checkpoint', 'name': "Второй уровень", 'required': 10, 'icon': "⭐"}
+    ],
+    'end_point': {'x': 95, 'y': 35, 'type': 'end'}
+}
+
+DEFAULT_POSITION = {'x': 15, 'y': 75}
+
+# Порядок применения операций в apply_inventory_batch
+INVENTORY_BATCH_ORDER = {'add': 0, 'update': 1, 'delete': 2}
+
+
+def default_map_config():
+    config = copy.deepcopy(DEFAULT_MAP)
+    config['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    config['updated_by'] = 'system'
+    return config
+
+
+def clamp_coordinate(value):
+    """Координаты на карте в процентах: от 0 до 100"""
+    return max(0, min(float(value), 100))
+
+
+class StorageBackend:
+    """Базовый класс бэкенда. name используется в логах и метриках."""
+
+    name = 'base'
+    # Бэкенд хранит данные только в памяти процесса
+    volatile = False
+
+    def connect(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def release(self):
+        """Освобождает ресурсы текущего потока (соединение из пула) в конце запроса"""
+        pass
+
+    # Пользователи
+    def get_user(self, username):
+        raise NotImplementedError
+
+    def get_all_users(self):
+        raise NotImplementedError
+
+    def create_user(self, username, password, role='user', coins=0):
+        raise NotImplementedError
+
+    def update_user_coins(self, username, coins):
+        raise NotImplementedError
+
+    def update_user_role(self, username, role):
+        raise NotImplementedError
+
+    def get_user_context(self, username, date):
+        """Пользователь + today_done (прогресс за date) + total_completed одним запросом"""
+        raise NotImplementedError
+
+    # Массовое начисление монет: отчет {'affected', 'users', 'missing'} или None при ошибке
+    def award_coins_all(self, amount):
+        raise NotImplementedError
+
+    def award_coins_completed(self, date, amount, task_text=None):
+        raise NotImplementedError
+
+    def award_coins_list(self, awards):
+        raise NotImplementedError
+
+    # Задачи
+    def get_tasks_config(self):
+        raise NotImplementedError
+
+    def update_tasks_config(self, tasks):
+        raise NotImplementedError
+
+    def get_daily_tasks(self, date):
+        raise NotImplementedError
+
+    def save_daily_tasks(self, date, tasks):
+        raise NotImplementedError
+
+    def create_daily_tasks(self, date, tasks):
+        """Сохраняет задачи на день только если их еще нет"""
+        raise NotImplementedError
+
+    # Доска задач
+    def get_board_tasks(self):
+        raise NotImplementedError
+
+    def save_board_tasks(self, tasks):
+        raise NotImplementedError
+
+    def update_board_task(self, task_id, updates):
+        raise NotImplementedError
+
+    # Архив выполненных задач доски
+    def archive_done_tasks(self, older_than, limit=500):
+        """Переносит в архив до limit выполненных задач с done_at раньше older_than; возвращает их число"""
+        raise NotImplementedError
+
+    def get_archive_page(self, after_id=None, limit=50):
+        """Задачи архива, новые первыми; after_id - последний id предыдущей страницы"""
+        raise NotImplementedError
+
+    def count_archived_tasks(self):
+        raise NotImplementedError
+
+    # Прогресс
+    def get_user_progress(self, username, date):
+        raise NotImplementedError
+
+    def save_user_progress(self, username, date, tasks_done):
+        raise NotImplementedError
+
+    def get_user_all_progress(self, username):
+        raise NotImplementedError
+
+    # Карта
+    def get_map_config(self):
+        raise NotImplementedError
+
+    def save_map_config(self, config, updated_by):
+        raise NotImplementedError
+
+    def prune_map_history(self, keep):
+        """Удаляет старые версии конфигурации карты, кроме keep последних; возвращает число удаленных"""
+        raise NotImplementedError
+
+    def get_user_position(self, username):
+        raise NotImplementedError
+
+    def save_user_position(self, username, x, y):
+        raise NotImplementedError
+
+    # Инвентарь
+    def get_user_inventory(self, username):
+        raise NotImplementedError
+
+    def add_item_to_inventory(self, username, name, description, quantity=1):
+        """Возвращает id нового предмета или None"""
+        raise NotImplementedError
+
+    def update_inventory_item(self, username, item_id, updates):
+        raise NotImplementedError
+
+    def delete_inventory_item(self, username, item_id):
+        raise NotImplementedError
+
+    def search_inventory(self, query, limit=20):
+        """Предметы всех игроков по названию и описанию: совпадение по началу слова или нечеткое.
+
+        [{'id', 'username', 'name', 'description', 'quantity', 'score'}], лучшие первыми.
+        """
+        raise NotImplementedError
+
+    def apply_inventory_batch(self, username, operations):
+        """Пакет операций одной транзакцией: [{'op': 'add', 'name', 'description', 'quantity'},
+        {'op': 'update', 'id', 'updates'}, {'op': 'delete', 'id'}].
+
+        Сначала добавления, затем изменения, затем удаления: вызывающий код не
+        передает удаление предмета вместе с другими операциями над ним, поэтому
+        результат тот же, что и при исходном порядке. Возвращает список
+        результатов по порядку операций (id нового предмета для add, True/False для
+        update и delete) или None, если транзакция не прошла.
+        """
+        raise NotImplementedError
+
+    # Журнал действий игроков (activity.py)
+    def record_activity_events(self, events):
+        """Дописывает пачку событий {'kind', 'username', 'payload', 'created_at'}; число записанных или None"""
+        raise NotImplementedError
+
+    def get_activity_page(self, after_id=None, limit=50, username=None):
+        """События, новые первыми; after_id - последний id предыдущей страницы"""
+        raise NotImplementedError
+
+    def prune_activity_events(self, older_than, limit=10000):
+        """Удаляет до limit событий с created_at раньше older_than; возвращает их число"""
+        raise NotImplementedError
+
+    # Статистика: сводки по дням обновляются в save_user_progress, rebuild_stats пересчитывает их из истории
+    def rebuild_stats(self, since=None):
+        """Пересчитывает сводки из user_progress (с даты since или все); {'user_rows', 'task_rows'} или None"""
+        raise NotImplementedError
+
+    def get_stats(self, since, top=10):
+        """Сводка с даты since: {'per_day': [{'date', 'completions', 'players'}], 'completions', 'active_players',
+        'top_players': [{'username', 'completions'}], 'top_tasks': [{'task', 'completions'}]}"""
+        raise NotImplementedError
+
+    def count_active_players(self, since):
+        """Игроки, выполнившие хотя бы одну задачу с даты since"""
+        raise NotImplementedError
+
+    # Планировщик периодических задач (scheduler.py)
+    def try_acquire_scheduler_lock(self):
+        """Захватывает или подтверждает роль ведущего планировщика; True, если она у этого процесса"""
+        raise NotImplementedError
+
+    def release_scheduler_lock(self):
+        pass
+
+    def get_job_runs(self):
+        """Последние запуски задач: {name: {'last_run_at', 'duration', 'error'}}"""
+        raise NotImplementedError
+
+    def record_job_run(self, name, started_at, duration, error=None):
+        raise NotImplementedError
+
+    # Постраничная выборка по ключу (keyset): страница не дороже первой при любом объеме данных
+    def get_board_page(self, statuses, after_id=None, limit=50, newest_first=False):
+        """Задачи доски с указанными статусами по id; after_id - последний id предыдущей страницы"""
+        raise NotImplementedError
+
+    def count_board_tasks(self, statuses):
+        raise NotImplementedError
+
+    def get_users_page(self, after=None, limit=50):
+        """Пользователи по имени (без паролей) с позицией на карте; limit=None - все одним запросом"""
+        raise NotImplementedError
+
+    def get_users_summary(self):
+        """{'users', 'admins', 'total_coins', 'max_coins'}"""
+        raise NotImplementedError
+
+    def get_inventory_page(self, username, after_id=None, limit=50):
+        """Предметы пользователя, новые первыми; after_id - последний id предыдущей страницы"""
+        raise NotImplementedError
+
+    def get_inventory_summary(self, username):
+        """{'items', 'stacks', 'units'} по инвентарю пользователя"""
+        raise NotImplementedError
+
+    def get_inventory_owners_page(self, after=None, limit=20):
+        """Владельцы предметов по имени: [{'username', 'coins', 'inventory'}]"""
+        raise NotImplementedError
+
+    def get_inventories_summary(self):
+        """{'owners', 'items', 'units', 'max_coins'} по всем инвентарям"""
+        raise NotImplementedError
+
+
+def sum_awards(awards):
+    """Суммируем повторы, чтобы один пользователь попадал в UPDATE один раз"""
+    totals = {}
+    for username, amount in awards:
+        totals[username] = totals.get(username, 0) + amount
+    return totals
+
+
+def progress_delta(old, new):
+    """Сдвиг сводок при перезаписи прогресса за день: (приращение для игрока, {задача: приращение})"""
+    old_counts, new_counts = Counter(old), Counter(new)
+    tasks = {task: new_counts[task] - old_counts[task] for task in old_counts.keys() | new_counts.keys()}
+    return len(new) - len(old), {task: delta for task, delta in tasks.items() if delta}
+
+
+def stats_report(per_day, top_players, top_tasks, active_players):
+    return {
+        'per_day': per_day,
+        'completions': sum(day['completions'] for day in per_day),
+        'active_players': active_players,
+        'top_players': top_players,
+        'top_tasks': top_tasks
+    }
+
+
+def award_report(awarded, requested=()):
+    awarded = list(awarded)
+    missing = [username for username in requested if username not in awarded]
+    return {'affected': len(awarded), 'users': awarded, 'missing': missing}
+
+
+def public_user(username, user, position=None):
+    """Пользователь для страниц и API: без пароля"""
+    return {
+        'username': username,
+        'role': user['role'],
+        'coins': user['coins'],
+        'created_at': user.get('created_at'),
+        'position': position or dict(DEFAULT_POSITION)
+    }
+
+
+def group_inventory_owners(rows):
+    """Строки (владелец, предмет) -> [{'username', 'coins', 'inventory'}]"""
+    owners = []
+    for row in rows:
+        if not owners or owners[-1]['username'] != row['username']:
+            owners.append({'username': row['username'], 'coins': row['coins'], 'inventory': []})
+        owners[-1]['inventory'].append({key: row[key] for key in ('id', 'name', 'description', 'quantity',
+                                                                   'created_at')})
+    return owners
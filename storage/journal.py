@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Журнал записей, сделанных во время недоступности PostgreSQL.
+
+Пока Database работает на хранилище в памяти вместо PostgreSQL, пользовательские
+записи (прогресс, позиции, инвентарь, монеты, роли) дописываются строками JSON
+в OUTAGE_JOURNAL. Каждая запись получает ключ идемпотентности; когда база снова
+доступна, PostgresBackend.replay_journal применяет записи по порядку и отмечает
+ключи в таблице journal_applied, поэтому повторное проигрывание ничего не
+дублирует.
+
+Монеты пишутся как приращения, а не итоговые значения: хранилище в памяти не
+знает настоящих балансов из PostgreSQL. Предметы, созданные во время сбоя,
+адресуются ключом записи о создании, потому что их id в памяти не совпадут с
+id в базе. По той же причине изменять и удалять во время сбоя можно только
+такие предметы: остальные отклоняются с OutageWriteRejected, а не теряются
+молча. Прогресс за день пишется как отмеченные и снятые задачи и при
+проигрывании применяется по порядку поверх сохраненного в базе: в памяти нет
+отметок, сделанных до сбоя, и простая перезапись стерла бы их.
+"""
+import json
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime
+
+from .base import INVENTORY_BATCH_ORDER, sum_awards
+
+logger = logging.getLogger(__name__)
+
+# Методы хранилища, которые перехватывает журнал
+JOURNALED_METHODS = frozenset([
+    'create_user', 'update_user_coins', 'update_user_role',
+    'award_coins_all', 'award_coins_completed', 'award_coins_list',
+    'save_user_progress', 'save_user_position',
+    'add_item_to_inventory', 'update_inventory_item', 'delete_inventory_item', 'apply_inventory_batch',
+    'record_activity_events',
+])
+
+
+class OutageWriteRejected(Exception):
+    """Запись, которую нельзя перенести в PostgreSQL после сбоя; ничего не изменено"""
+
+
+class OutageJournal:
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('OUTAGE_JOURNAL', 'outage_journal.jsonl')
+        self._lock = threading.Lock()
+        # (username, id предмета в памяти) -> ключ записи add_item
+        self._item_keys = {}
+        for entry in self.entries():
+            if entry['op'] == 'add_item':
+                self._item_keys[(entry['username'], entry['item_id'])] = entry['key']
+
+    def entries(self):
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    logger.warning("⚠️ Пропущена поврежденная строка журнала сбоя")
+        return entries
+
+    def append(self, op, **data):
+        key = uuid.uuid4().hex
+        entry = {'key': key, 'op': op, 'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), **data}
+        line = json.dumps(entry, ensure_ascii=False, default=str) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        return key
+
+    def clear(self):
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._item_keys.clear()
+
+    # Перехватчики: выполняют запись в хранилище backend и журналируют ее
+    def create_user(self, backend, username, password, role='user', coins=0):
+        result = backend.create_user(username, password, role, coins)
+        if result:
+            self.append('create_user', username=username, password=password, role=role, coins=coins)
+        return result
+
+    def update_user_coins(self, backend, username, coins):
+        old = (backend.get_user(username) or {}).get('coins')
+        result = backend.update_user_coins(username, coins)
+        if result and old is not None and coins != old:
+            self.append('add_coins', amounts={username: coins - old})
+        return result
+
+    def update_user_role(self, backend, username, role):
+        result = backend.update_user_role(username, role)
+        if result:
+            self.append('update_user_role', username=username, role=role)
+        return result
+
+    def _journal_award(self, report, amount_for):
+        if report and report['users']:
+            self.append('add_coins', amounts={username: amount_for(username) for username in report['users']})
+        return report
+
+    def award_coins_all(self, backend, amount):
+        return self._journal_award(backend.award_coins_all(amount), lambda username: amount)
+
+    def award_coins_completed(self, backend, date, amount, task_text=None):
+        return self._journal_award(backend.award_coins_completed(date, amount, task_text), lambda username: amount)
+
+    def award_coins_list(self, backend, awards):
+        totals = sum_awards(awards)
+        return self._journal_award(backend.award_coins_list(awards), totals.get)
+
+    def save_user_progress(self, backend, username, date, tasks_done):
+        previous = backend.get_user_progress(username, date)
+        result = backend.save_user_progress(username, date, tasks_done)
+        if result:
+            self.append('save_user_progress', username=username, date=date,
+                        added=[task for task in tasks_done if task not in previous],
+                        removed=[task for task in previous if task not in tasks_done])
+        return result
+
+    def save_user_position(self, backend, username, x, y):
+        result = backend.save_user_position(username, x, y)
+        if result:
+            self.append('save_user_position', username=username, x=x, y=y)
+        return result
+
+    def add_item_to_inventory(self, backend, username, name, description, quantity=1):
+        item_id = backend.add_item_to_inventory(username, name, description, quantity)
+        if item_id is not None:
+            self._journal_add_item(username, item_id, name, description, quantity)
+        return item_id
+
+    def update_inventory_item(self, backend, username, item_id, updates):
+        self._check_outage_item(username, item_id)
+        result = backend.update_inventory_item(username, item_id, updates)
+        if result:
+            self._journal_update_item(username, item_id, updates)
+        return result
+
+    def delete_inventory_item(self, backend, username, item_id):
+        self._check_outage_item(username, item_id)
+        result = backend.delete_inventory_item(username, item_id)
+        if result:
+            self._journal_delete_item(username, item_id)
+        return result
+
+    def apply_inventory_batch(self, backend, username, operations):
+        # Пакет - одна транзакция: если хоть один предмет нельзя изменить, не применяем ничего
+        for op in operations:
+            if op['op'] != 'add':
+                self._check_outage_item(username, op['id'])
+        # В журнал - отдельными записями в порядке применения: при проигрывании они снова собираются в пачки
+        results = backend.apply_inventory_batch(username, operations)
+        applied = sorted(zip(operations, results or []), key=lambda pair: INVENTORY_BATCH_ORDER[pair[0]['op']])
+        for op, result in applied:
+            if op['op'] == 'add' and result is not None:
+                self._journal_add_item(username, result, op['name'], op['description'], op['quantity'])
+            elif op['op'] == 'update' and result:
+                self._journal_update_item(username, op['id'], op['updates'])
+            elif op['op'] == 'delete' and result:
+                self._journal_delete_item(username, op['id'])
+        return results
+
+    def record_activity_events(self, backend, events):
+        result = backend.record_activity_events(events)
+        if result:
+            self.append('activity_events', events=events)
+        return result
+
+    def _journal_add_item(self, username, item_id, name, description, quantity):
+        key = self.append('add_item', username=username, item_id=item_id,
+                          name=name, description=description, quantity=quantity)
+        self._item_keys[(username, item_id)] = key
+
+    def _check_outage_item(self, username, item_id):
+        # id остальных предметов в памяти не совпадают с id в PostgreSQL: изменение некуда перенести
+        if (username, item_id) not in self._item_keys:
+            raise OutageWriteRejected("База данных недоступна: изменять можно только предметы, "
+                                      "добавленные во время сбоя")
+
+    def _journal_update_item(self, username, item_id, updates):
+        self.append('update_item', username=username, item_key=self._item_keys[(username, item_id)], updates=updates)
+
+    def _journal_delete_item(self, username, item_id):
+        self.append('delete_item', username=username, item_key=self._item_keys.pop((username, item_id)))
@@ -0,0 +1,741 @@
+# -*- coding: utf-8 -*-
+"""Хранилище в памяти процесса (демо и работа без PostgreSQL).
+
+Данные лежат в индексированных структурах: прогресс - словарь
+{username: {date: [задачи]}}, инвентарь - {username: {id: предмет}} со
+сквозным счетчиком id и обратным индексом для поиска (storage/search.py),
+доска - список плюс индекс по id.
+
+Если задан каталог MEMORY_STORE_DIR (по умолчанию memory_store), каждая
+изменяющая операция дописывается строкой в журнал oplog.jsonl, а фоновый
+поток раз в MEMORY_SNAPSHOT_INTERVAL секунд сохраняет снимок snapshot.json
+и очищает журнал. При старте снимок загружается и журнал проигрывается
+поверх него, поэтому данные переживают перезапуск во время сбоя PostgreSQL.
+Пустой MEMORY_STORE_DIR отключает сохранение на диск.
+"""
+import atexit
+import bisect
+import copy
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from map_points import PointColumns, encode_active_points
+
+from .base import (StorageBackend, DEFAULT_USERS, DEFAULT_TASKS, DEFAULT_POSITION, INVENTORY_BATCH_ORDER,
+                   default_map_config, sum_awards, award_report, public_user, progress_delta, stats_report)
+from .search import InvertedIndex
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = 'snapshot.json'
+OPLOG_FILE = 'oplog.jsonl'
+# Сколько последних событий журнала действий держим в памяти
+ACTIVITY_LIMIT = int(os.environ.get('MEMORY_ACTIVITY_LIMIT', '10000'))
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class MemoryBackend(StorageBackend):
+    name = 'memory'
+    volatile = True
+
+    def __init__(self, store_dir=None, snapshot_interval=None, fsync=None):
+        if store_dir is None:
+            store_dir = os.environ.get('MEMORY_STORE_DIR', 'memory_store')
+        self.store_dir = store_dir or None
+        self.snapshot_interval = snapshot_interval or int(os.environ.get('MEMORY_SNAPSHOT_INTERVAL', '60'))
+        self.fsync = fsync if fsync is not None else os.environ.get('MEMORY_FSYNC') == '1'
+        self.storage = None
+        self._lock = threading.RLock()
+        self._oplog = None
+        self._seq = 0
+        self._snapshot_seq = 0
+        # Запуски задач планировщика: процесс с хранилищем в памяти всегда ведущий, на диск не пишутся
+        self._job_runs = {}
+
+    @property
+    def persistent(self):
+        return self.store_dir is not None
+
+    def connect(self):
+        self.storage = self._empty_storage()
+        if not self.persistent:
+            logger.warning("🔄 Создаем временное хранилище в памяти (данные будут сброшены после перезапуска)")
+            self.rebuild_indexes()
+            return
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        restored = self._load_snapshot()
+        self.rebuild_indexes()
+        replayed = self._replay_oplog()
+        self._oplog = open(os.path.join(self.store_dir, OPLOG_FILE), 'a', encoding='utf-8')
+        if restored or replayed:
+            logger.warning(f"🔄 Хранилище в памяти восстановлено из {self.store_dir}: "
+                           f"снимок={'да' if restored else 'нет'}, операций из журнала: {replayed}")
+        else:
+            logger.warning(f"🔄 Создаем хранилище в памяти с журналом в {self.store_dir}")
+
+        threading.Thread(target=self._snapshot_worker, daemon=True, name='memory-snapshot').start()
+        atexit.register(self.close)
+
+    def close(self):
+        if self._oplog is None:
+            return
+        self.snapshot()
+        with self._lock:
+            self._oplog.close()
+            self._oplog = None
+
+    def discard(self):
+        """Закрывает хранилище и удаляет его файлы (данные уже перенесены в другой бэкенд)"""
+        with self._lock:
+            if self._oplog is not None:
+                self._oplog.close()
+                self._oplog = None
+            if self.persistent:
+                for name in (SNAPSHOT_FILE, OPLOG_FILE):
+                    path = os.path.join(self.store_dir, name)
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    @staticmethod
+    def _empty_storage():
+        return {
+            'users': {username: {"password": password, "role": role, "coins": coins}
+                      for username, password, role, coins in DEFAULT_USERS},
+            'tasks_config': copy.deepcopy(DEFAULT_TASKS),
+            'daily_tasks': {},
+            'board_tasks': [],
+            'board_archive': [],
+            'user_progress': {},
+            'map_config': default_map_config(),
+            'user_positions': {},
+            'user_inventory': {},
+            'activity_events': [],
+            'next_item_id': 1
+        }
+
+    def rebuild_indexes(self):
+        """Пересчитываем производные индексы после загрузки снимка или прямой правки storage"""
+        storage = self.storage
+        self._index_board(storage['board_tasks'])
+        # Снимки, сохраненные до появления архива
+        storage.setdefault('board_archive', [])
+        self._index_archive(storage['board_archive'])
+        storage.setdefault('activity_events', [])
+        self._sorted_usernames = None
+        self._sorted_owners = None
+        self._completed_totals = {username: sum(len(tasks) for tasks in days.values())
+                                  for username, days in storage['user_progress'].items()}
+        self._rebuild_stats()
+        max_item_id = max((item_id for items in storage['user_inventory'].values() for item_id in items), default=0)
+        storage['next_item_id'] = max(storage['next_item_id'], max_item_id + 1)
+        self._map_points = PointColumns.decode(storage['map_config']['active_points'])
+        self._item_search = InvertedIndex()
+        # id предметов каждого игрока по возрастанию: страница инвентаря - bisect, а не копия всех id
+        self._inventory_ids = {username: sorted(items) for username, items in storage['user_inventory'].items()}
+        for username, items in storage['user_inventory'].items():
+            for item in items.values():
+                self._index_item(username, item)
+
+    # Журнал и снимки
+    def _apply(self, op, *args):
+        """Выполняет изменяющую операцию и дописывает ее в журнал"""
+        with self._lock:
+            result = getattr(self, '_op_' + op)(*args)
+            if self._oplog is not None:
+                self._seq += 1
+                self._oplog.write(json.dumps({'seq': self._seq, 'op': op, 'args': args},
+                                             ensure_ascii=False, default=str) + '\n')
+                self._oplog.flush()
+                if self.fsync:
+                    os.fsync(self._oplog.fileno())
+            return result
+
+    def _load_snapshot(self):
+        path = os.path.join(self.store_dir, SNAPSHOT_FILE)
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"❌ Не удалось прочитать снимок {path}: {e}")
+            return False
+        data = snapshot['storage']
+        # В JSON ключи всегда строки - возвращаем числовые id предметов
+        data['user_inventory'] = {username: {int(item_id): item for item_id, item in items.items()}
+                                  for username, items in data['user_inventory'].items()}
+        self.storage = data
+        self._seq = self._snapshot_seq = snapshot['seq']
+        return True
+
+    def _replay_oplog(self):
+        path = os.path.join(self.store_dir, OPLOG_FILE)
+        if not os.path.exists(path):
+            return 0
+        replayed = 0
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Оборванная последняя строка после аварийной остановки
+                    logger.warning("⚠️ Пропущена поврежденная строка журнала")
+                    continue
+                if entry['seq'] <= self._seq:
+                    continue
+                getattr(self, '_op_' + entry['op'])(*entry['args'])
+                self._seq = entry['seq']
+                replayed += 1
+        return replayed
+
+    def snapshot(self):
+        """Сохраняет снимок и начинает журнал заново"""
+        if not self.persistent:
+            return False
+        with self._lock:
+            if self._seq == self._snapshot_seq:
+                return False
+            data = json.dumps({'seq': self._seq, 'storage': self.storage}, ensure_ascii=False, default=str)
+            path = os.path.join(self.store_dir, SNAPSHOT_FILE)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+            # Записи журнала до seq уже в снимке; если упадем до очистки, они будут пропущены при проигрывании
+            if self._oplog is not None:
+                self._oplog.truncate(0)
+                self._oplog.seek(0)
+            self._snapshot_seq = self._seq
+        return True
+
+    def _snapshot_worker(self):
+        while self._oplog is not None:
+            time.sleep(self.snapshot_interval)
+            try:
+                if self.snapshot():
+                    logger.info(f"💾 Снимок хранилища в памяти сохранен (seq={self._snapshot_seq})")
+            except Exception as e:
+                logger.error(f"❌ Ошибка сохранения снимка: {e}")
+
+    # Пользователи
+    def get_user(self, username):
+        return self.storage['users'].get(username)
+
+    def get_all_users(self):
+        return self.storage['users']
+
+    def create_user(self, username, password, role='user', coins=0):
+        return self._apply('create_user', username, password, role, coins)
+
+    def _op_create_user(self, username, password, role, coins):
+        if username not in self.storage['users']:
+            self._sorted_usernames = None
+        self.storage['users'][username] = {
+            'password': password,
+            'role': role,
+            'coins': coins
+        }
+        return True
+
+    def update_user_coins(self, username, coins):
+        return self._apply('update_user_coins', username, coins)
+
+    def _op_update_user_coins(self, username, coins):
+        if username in self.storage['users']:
+            self.storage['users'][username]['coins'] = coins
+        return True
+
+    def update_user_role(self, username, role):
+        return self._apply('update_user_role', username, role)
+
+    def _op_update_user_role(self, username, role):
+        if username in self.storage['users']:
+            self.storage['users'][username]['role'] = role
+            return True
+        return False
+
+    def get_user_context(self, username, date):
+        user = self.storage['users'].get(username)
+        if not user:
+            return None
+        return {
+            **user,
+            'username': username,
+            'today_done': list(self.storage['user_progress'].get(username, {}).get(date, [])),
+            'total_completed': self._completed_totals.get(username, 0)
+        }
+
+    def award_coins_all(self, amount):
+        return self._apply('award_coins_all', amount)
+
+    def _op_award_coins_all(self, amount):
+        awarded = []
+        for username, user in self.storage['users'].items():
+            user['coins'] = user['coins'] + amount
+            awarded.append(username)
+        return award_report(awarded)
+
+    def award_coins_completed(self, date, amount, task_text=None):
+        return self._apply('award_coins_completed', date, amount, task_text)
+
+    def _op_award_coins_completed(self, date, amount, task_text):
+        awarded = []
+        for username, days in self.storage['user_progress'].items():
+            tasks_done = days.get(date) or []
+            user = self.storage['users'].get(username)
+            if user and ((task_text in tasks_done) if task_text else tasks_done):
+                user['coins'] = user['coins'] + amount
+                awarded.append(username)
+        return award_report(awarded)
+
+    def award_coins_list(self, awards):
+        return self._apply('award_coins_list', sum_awards(awards))
+
+    def _op_award_coins_list(self, totals):
+        awarded = []
+        for username, amount in totals.items():
+            user = self.storage['users'].get(username)
+            if user:
+                user['coins'] = user['coins'] + amount
+                awarded.append(username)
+        return award_report(awarded, totals)
+
+    # Задачи
+    def get_tasks_config(self):
+        return self.storage['tasks_config']
+
+    def update_tasks_config(self, tasks):
+        return self._apply('update_tasks_config', tasks)
+
+    def _op_update_tasks_config(self, tasks):
+        self.storage['tasks_config'] = tasks
+        return True
+
+    def get_daily_tasks(self, date):
+        return self.storage['daily_tasks'].get(date)
+
+    def save_daily_tasks(self, date, tasks):
+        return self._apply('save_daily_tasks', date, tasks)
+
+    def _op_save_daily_tasks(self, date, tasks):
+        self.storage['daily_tasks'][date] = tasks
+        return True
+
+    def create_daily_tasks(self, date, tasks):
+        if date in self.storage['daily_tasks']:
+            return False
+        return self._apply('create_daily_tasks', date, tasks)
+
+    def _op_create_daily_tasks(self, date, tasks):
+        if date in self.storage['daily_tasks']:
+            return False
+        self.storage['daily_tasks'][date] = tasks
+        return True
+
+    # Доска задач
+    def get_board_tasks(self):
+        return self.storage['board_tasks']
+
+    def save_board_tasks(self, tasks):
+        return self._apply('save_board_tasks', tasks)
+
+    def _op_save_board_tasks(self, tasks):
+        # Новые задачи получают id как max + 1 по доске - после переноса в архив он может быть занят
+        next_id = max(self._archive_ids[-1] if self._archive_ids else 0,
+                      max((task['id'] for task in tasks), default=0)) + 1
+        for task in tasks:
+            if task['id'] in self._archive_by_id:
+                task['id'] = next_id
+                next_id += 1
+        self.storage['board_tasks'] = tasks
+        self._index_board(tasks)
+        return True
+
+    def _index_board(self, tasks):
+        self._board_by_id = {task['id']: task for task in tasks}
+        self._board_ids = sorted(self._board_by_id)
+        self._board_statuses = Counter(task['status'] for task in tasks)
+
+    def update_board_task(self, task_id, updates):
+        return self._apply('update_board_task', task_id, updates)
+
+    def _op_update_board_task(self, task_id, updates):
+        task = self._board_by_id.get(task_id)
+        if task is not None:
+            self._board_statuses[task['status']] -= 1
+            task.update(updates)
+            self._board_statuses[task['status']] += 1
+        return True
+
+    # Архив доски (без секций по месяцам: они нужны только PostgreSQL)
+    def archive_done_tasks(self, older_than, limit=500):
+        return self._apply('archive_done_tasks', older_than, limit, _now())
+
+    def _op_archive_done_tasks(self, older_than, limit, now=None):
+        # Время архивации - аргумент операции: повтор из журнала даст те же archived_at.
+        # now=None - запись журнала, сделанная до появления этого аргумента
+        now = now or _now()
+        moved = []
+        for task in self.storage['board_tasks']:
+            done_at = task.get('done_at') or task.get('taken_at') or task.get('created_at') or ''
+            if task['status'] == 'done' and done_at < older_than:
+                moved.append({**task, 'done_at': done_at, 'archived_at': now})
+                if len(moved) == limit:
+                    break
+        if not moved:
+            return 0
+        moved_ids = {task['id'] for task in moved}
+        self.storage['board_tasks'] = [task for task in self.storage['board_tasks'] if task['id'] not in moved_ids]
+        self._index_board(self.storage['board_tasks'])
+        self.storage['board_archive'].extend(moved)
+        for task in moved:
+            self._archive_by_id[task['id']] = task
+            bisect.insort(self._archive_ids, task['id'])
+        return len(moved)
+
+    def _index_archive(self, tasks):
+        self._archive_by_id = {task['id']: task for task in tasks}
+        self._archive_ids = sorted(self._archive_by_id)
+
+    def get_archive_page(self, after_id=None, limit=50):
+        ids = self._archive_ids
+        end = bisect.bisect_left(ids, after_id) if after_id is not None else len(ids)
+        return [self._archive_by_id[ids[i]] for i in range(end - 1, max(end - limit, 0) - 1, -1)]
+
+    def count_archived_tasks(self):
+        return len(self._archive_ids)
+
+    # Журнал действий: старые события вытесняются после ACTIVITY_LIMIT
+    def record_activity_events(self, events):
+        return self._apply('record_activity_events', events)
+
+    def _op_record_activity_events(self, events):
+        stored = self.storage['activity_events']
+        next_id = stored[-1]['id'] + 1 if stored else 1
+        for offset, event in enumerate(events):
+            stored.append({**event, 'id': next_id + offset})
+        if len(stored) > ACTIVITY_LIMIT:
+            del stored[:len(stored) - ACTIVITY_LIMIT]
+        return len(events)
+
+    def prune_activity_events(self, older_than, limit=10000):
+        return self._apply('prune_activity_events', older_than, limit)
+
+    def _op_prune_activity_events(self, older_than, limit):
+        stored = self.storage['activity_events']
+        count = 0
+        while count < min(limit, len(stored)) and stored[count]['created_at'] < older_than:
+            count += 1
+        del stored[:count]
+        return count
+
+    def get_activity_page(self, after_id=None, limit=50, username=None):
+        with self._lock:
+            stored = self.storage['activity_events']
+            end = len(stored)
+            if after_id is not None:
+                end = bisect.bisect_left(stored, after_id, key=lambda event: event['id'])
+            page = []
+            for index in range(end - 1, -1, -1):
+                event = stored[index]
+                if username is None or event['username'] == username:
+                    page.append(event)
+                    if len(page) == limit:
+                        break
+            return page
+
+    # Прогресс
+    def get_user_progress(self, username, date):
+        # Копия: вызывающий код меняет список и сохраняет его, а прежний нужен для разницы
+        return list(self.storage['user_progress'].get(username, {}).get(date, []))
+
+    def save_user_progress(self, username, date, tasks_done):
+        return self._apply('save_user_progress', username, date, tasks_done)
+
+    def _op_save_user_progress(self, username, date, tasks_done):
+        days = self.storage['user_progress'].setdefault(username, {})
+        user_delta, task_deltas = progress_delta(days.get(date, ()), tasks_done)
+        days[date] = tasks_done
+        self._completed_totals[username] = self._completed_totals.get(username, 0) + user_delta
+        self._bump_stats(username, date, user_delta, task_deltas)
+        return True
+
+    def get_user_all_progress(self, username):
+        all_tasks = []
+        for tasks in self.storage['user_progress'].get(username, {}).values():
+            all_tasks.extend(tasks)
+        return all_tasks
+
+    # Статистика: сводки {дата: {игрок или задача: выполнений}} - производные индексы, на диск не пишутся
+    def _bump_stats(self, username, date, user_delta, task_deltas):
+        for rollup, deltas in ((self._stats_users, {username: user_delta}), (self._stats_tasks, task_deltas)):
+            day = rollup.setdefault(date, {})
+            for key, delta in deltas.items():
+                count = day.get(key, 0) + delta
+                if count > 0:
+                    day[key] = count
+                else:
+                    day.pop(key, None)
+
+    def _rebuild_stats(self):
+        self._stats_users = {}
+        self._stats_tasks = {}
+        for username, days in self.storage['user_progress'].items():
+            for date, tasks in days.items():
+                self._bump_stats(username, date, *progress_delta((), tasks))
+
+    def rebuild_stats(self, since=None):
+        # Сводки в памяти дешево пересчитать целиком, since не нужен
+        with self._lock:
+            self._rebuild_stats()
+            return {'user_rows': sum(len(day) for day in self._stats_users.values()),
+                    'task_rows': sum(len(day) for day in self._stats_tasks.values())}
+
+    @staticmethod
+    def _sum_since(rollup, since):
+        totals = {}
+        for date, day in rollup.items():
+            if date >= since:
+                for key, count in day.items():
+                    totals[key] = totals.get(key, 0) + count
+        return totals
+
+    def get_stats(self, since, top=10):
+        with self._lock:
+            per_day = [{'date': date, 'completions': sum(day.values()), 'players': len(day)}
+                       for date, day in sorted(self._stats_users.items()) if date >= since and day]
+            players = self._sum_since(self._stats_users, since)
+            tasks = self._sum_since(self._stats_tasks, since)
+        top_players = sorted(players.items(), key=lambda pair: (-pair[1], pair[0]))[:top]
+        top_tasks = sorted(tasks.items(), key=lambda pair: (-pair[1], pair[0]))[:top]
+        return stats_report(per_day,
+                            [{'username': username, 'completions': count} for username, count in top_players],
+                            [{'task': task, 'completions': count} for task, count in top_tasks],
+                            len(players))
+
+    def count_active_players(self, since):
+        with self._lock:
+            return len(self._sum_since(self._stats_users, since))
+
+    # Карта
+    def get_map_config(self):
+        return {**self.storage['map_config'], 'active_points': self._map_points}
+
+    def save_map_config(self, config, updated_by):
+        # В журнал и снимок точки попадают колонками base64, в памяти лежат массивами
+        config = {**config, 'active_points': encode_active_points(config['active_points'])}
+        return self._apply('save_map_config', config, updated_by, _now())
+
+    def _op_save_map_config(self, config, updated_by, updated_at):
+        self.storage['map_config'] = config
+        self.storage['map_config']['updated_at'] = updated_at
+        self.storage['map_config']['updated_by'] = updated_by
+        self._map_points = PointColumns.decode(config['active_points'])
+        return True
+
+    def prune_map_history(self, keep):
+        # В памяти хранится только текущая версия карты
+        return 0
+
+    def get_user_position(self, username):
+        return self.storage['user_positions'].get(username, dict(DEFAULT_POSITION))
+
+    def save_user_position(self, username, x, y):
+        return self._apply('save_user_position', username, x, y)
+
+    def _op_save_user_position(self, username, x, y):
+        self.storage['user_positions'][username] = {'x': x, 'y': y}
+        return True
+
+    # Инвентарь
+    def get_user_inventory(self, username):
+        return list(self.storage['user_inventory'].get(username, {}).values())
+
+    def add_item_to_inventory(self, username, name, description, quantity=1):
+        return self._apply('add_item_to_inventory', username, name, description, quantity, _now())
+
+    def _op_add_item_to_inventory(self, username, name, description, quantity, created_at):
+        new_id = self.storage['next_item_id']
+        self.storage['next_item_id'] = new_id + 1
+        if username not in self.storage['user_inventory']:
+            self._sorted_owners = None
+        item = self.storage['user_inventory'].setdefault(username, {})[new_id] = {
+            'id': new_id,
+            'name': name,
+            'description': description,
+            'quantity': quantity,
+            'created_at': created_at
+        }
+        self._index_item(username, item)
+        # Новый id больше всех выданных, порядок списка сохраняется
+        self._inventory_ids.setdefault(username, []).append(new_id)
+        return new_id
+
+    def update_inventory_item(self, username, item_id, updates):
+        if item_id not in self.storage['user_inventory'].get(username, {}):
+            return False
+        return self._apply('update_inventory_item', username, item_id, updates, _now())
+
+    def _op_update_inventory_item(self, username, item_id, updates, updated_at):
+        item = self.storage['user_inventory'].get(username, {}).get(item_id)
+        if item is None:
+            return False
+        item.update(updates)
+        item['updated_at'] = updated_at
+        if 'name' in updates or 'description' in updates:
+            self._index_item(username, item)
+        return True
+
+    def delete_inventory_item(self, username, item_id):
+        if username not in self.storage['user_inventory']:
+            return False
+        return self._apply('delete_inventory_item', username, item_id)
+
+    def _op_delete_inventory_item(self, username, item_id):
+        items = self.storage['user_inventory'].get(username)
+        if items is None:
+            return False
+        self._remove_item(username, item_id)
+        return True
+
+    def _remove_item(self, username, item_id):
+        self._item_search.remove((username, item_id))
+        if self.storage['user_inventory'].get(username, {}).pop(item_id, None) is None:
+            return False
+        ids = self._inventory_ids.get(username, [])
+        index = bisect.bisect_left(ids, item_id)
+        if index < len(ids) and ids[index] == item_id:
+            del ids[index]
+        return True
+
+    def _index_item(self, username, item):
+        self._item_search.add((username, item['id']), f"{item['name']} {item.get('description') or ''}")
+
+    def apply_inventory_batch(self, username, operations):
+        return self._apply('inventory_batch', username, operations, _now())
+
+    def _op_inventory_batch(self, username, operations, now):
+        # Одна строка журнала на пакет: при проигрывании пакет применяется целиком
+        results = [None] * len(operations)
+        for index in sorted(range(len(operations)), key=lambda i: INVENTORY_BATCH_ORDER[operations[i]['op']]):
+            op = operations[index]
+            if op['op'] == 'add':
+                results[index] = self._op_add_item_to_inventory(username, op['name'], op['description'],
+                                                                op['quantity'], now)
+            elif op['op'] == 'update':
+                results[index] = self._op_update_inventory_item(username, op['id'], op['updates'], now)
+            else:
+                results[index] = self._remove_item(username, op['id'])
+        return results
+
+    def search_inventory(self, query, limit=20):
+        with self._lock:
+            found = self._item_search.search(query, limit)
+            return [{**self.storage['user_inventory'][username][item_id], 'username': username, 'score': score}
+                    for (username, item_id), score in found]
+
+    # Планировщик: данные в памяти одного процесса, и этот процесс всегда ведущий
+    def try_acquire_scheduler_lock(self):
+        return True
+
+    def get_job_runs(self):
+        with self._lock:
+            return {name: dict(run) for name, run in self._job_runs.items()}
+
+    def record_job_run(self, name, started_at, duration, error=None):
+        with self._lock:
+            self._job_runs[name] = {'last_run_at': started_at, 'duration': duration, 'error': error}
+        return True
+
+    # Постраничная выборка
+    def get_board_page(self, statuses, after_id=None, limit=50, newest_first=False):
+        ids = self._board_ids
+        if newest_first:
+            start = bisect.bisect_left(ids, after_id) if after_id is not None else len(ids)
+            candidates = (ids[i] for i in range(start - 1, -1, -1))
+        else:
+            start = bisect.bisect_right(ids, after_id) if after_id is not None else 0
+            candidates = (ids[i] for i in range(start, len(ids)))
+        page = []
+        for task_id in candidates:
+            task = self._board_by_id[task_id]
+            if task['status'] in statuses:
+                page.append(task)
+                if len(page) == limit:
+                    break
+        return page
+
+    def count_board_tasks(self, statuses):
+        return sum(self._board_statuses[status] for status in statuses)
+
+    def _usernames(self):
+        if self._sorted_usernames is None:
+            self._sorted_usernames = sorted(self.storage['users'])
+        return self._sorted_usernames
+
+    def get_users_page(self, after=None, limit=50):
+        names = self._usernames()
+        start = bisect.bisect_right(names, after) if after is not None else 0
+        users = self.storage['users']
+        return [public_user(name, users[name], self.storage['user_positions'].get(name))
+                for name in (names[start:] if limit is None else names[start:start + limit]) if name in users]
+
+    def get_users_summary(self):
+        coins = [user['coins'] for user in self.storage['users'].values()]
+        return {
+            'users': len(coins),
+            'admins': sum(1 for user in self.storage['users'].values() if user['role'] == 'admin'),
+            'total_coins': sum(coins),
+            'max_coins': max(coins, default=0)
+        }
+
+    def get_inventory_page(self, username, after_id=None, limit=50):
+        with self._lock:
+            items = self.storage['user_inventory'].get(username, {})
+            ids = self._inventory_ids.get(username, [])
+            end = bisect.bisect_left(ids, after_id) if after_id is not None else len(ids)
+            return [items[ids[i]] for i in range(end - 1, max(0, end - limit) - 1, -1)]
+
+    def get_inventory_summary(self, username):
+        items = self.storage['user_inventory'].get(username, {}).values()
+        return {
+            'items': len(items),
+            'stacks': sum(1 for item in items if item['quantity'] > 1),
+            'units': sum(item['quantity'] for item in items)
+        }
+
+    def get_inventory_owners_page(self, after=None, limit=20):
+        if self._sorted_owners is None:
+            self._sorted_owners = sorted(self.storage['user_inventory'])
+        owners = self._sorted_owners
+        start = bisect.bisect_right(owners, after) if after is not None else 0
+        page = []
+        for name in owners[start:]:
+            items = self.storage['user_inventory'].get(name)
+            user = self.storage['users'].get(name)
+            if items and user:
+                page.append({'username': name, 'coins': user['coins'], 'inventory': list(reversed(items.values()))})
+                if len(page) == limit:
+                    break
+        return page
+
+    def get_inventories_summary(self):
+        owners = [name for name, items in self.storage['user_inventory'].items()
+                  if items and name in self.storage['users']]
+        items = [item for name in owners for item in self.storage['user_inventory'][name].values()]
+        return {
+            'owners': len(owners),
+            'items': len(items),
+            'units': sum(item['quantity'] for item in items),
+            'max_coins': max((self.storage['users'][name]['coins'] for name in owners), default=0)
+        }
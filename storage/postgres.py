@@ -0,0 +1,1496 @@
+# -*- coding: utf-8 -*-
+"""Хранилище в PostgreSQL (основной бэкенд на Railway)"""
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+import psycopg2
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+import tracing
+from map_points import PointColumns, encode_active_points
+from .base import (StorageBackend, DEFAULT_USERS, DEFAULT_TASKS, DEFAULT_MAP, DEFAULT_POSITION, clamp_coordinate,
+                   sum_awards, award_report, public_user, group_inventory_owners, progress_delta, stats_report)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        username VARCHAR(50) PRIMARY KEY,
+        password VARCHAR(100) NOT NULL,
+        role VARCHAR(100) NOT NULL DEFAULT 'user',  -- Увеличено с 20 до 100
+        coins INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tasks_config (
+        id SERIAL PRIMARY KEY,
+        button1 JSONB NOT NULL,
+        button2 JSONB NOT NULL,
+        button3 JSONB NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS daily_tasks (
+        id SERIAL PRIMARY KEY,
+        date DATE UNIQUE NOT NULL,
+        tasks JSONB NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS board_tasks (
+        id SERIAL PRIMARY KEY,
+        text TEXT NOT NULL,
+        difficulty VARCHAR(20) NOT NULL,
+        status VARCHAR(20) NOT NULL DEFAULT 'free',
+        user_taken VARCHAR(50),
+        taken_at TIMESTAMP,
+        done_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_progress (
+        id SERIAL PRIMARY KEY,
+        username VARCHAR(50) NOT NULL,
+        date DATE NOT NULL,
+        tasks_done JSONB NOT NULL,
+        UNIQUE(username, date)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS map_config (
+        id SERIAL PRIMARY KEY,
+        start_point JSONB NOT NULL,
+        active_points JSONB NOT NULL,
+        checkpoints JSONB NOT NULL,
+        end_point JSONB NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_by VARCHAR(50)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_positions (
+        username VARCHAR(50) PRIMARY KEY,
+        x FLOAT NOT NULL DEFAULT 15,
+        y FLOAT NOT NULL DEFAULT 75,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_inventory (
+        id SERIAL PRIMARY KEY,
+        username VARCHAR(50) NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        description TEXT,
+        quantity INTEGER NOT NULL DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Индексы для постраничной выборки по ключу
+    "CREATE INDEX IF NOT EXISTS idx_board_tasks_status_id ON board_tasks (status, id)",
+    "CREATE INDEX IF NOT EXISTS idx_user_inventory_username_id ON user_inventory (username, id)",
+    # Архив выполненных задач доски: секции по месяцам done_at создаются при переносе
+    """
+    CREATE TABLE IF NOT EXISTS board_archive (
+        id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        difficulty VARCHAR(20) NOT NULL,
+        status VARCHAR(20) NOT NULL DEFAULT 'done',
+        user_taken VARCHAR(50),
+        taken_at TIMESTAMP,
+        done_at TIMESTAMP NOT NULL,
+        created_at TIMESTAMP,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, done_at)
+    ) PARTITION BY RANGE (done_at)
+    """,
+    # Журнал действий игроков (activity.py): строки только добавляются
+    """
+    CREATE TABLE IF NOT EXISTS activity_events (
+        id BIGSERIAL PRIMARY KEY,
+        kind VARCHAR(50) NOT NULL,
+        username VARCHAR(50),
+        payload JSONB NOT NULL DEFAULT '{}',
+        created_at TIMESTAMP NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_activity_events_username_id ON activity_events (username, id)",
+    # Строки идут в порядке времени - BRIN по created_at почти ничего не весит и годится для чистки старых
+    "CREATE INDEX IF NOT EXISTS idx_activity_events_created_at ON activity_events USING brin (created_at)",
+    # Сводки статистики по дням: обновляются в save_user_progress, пересчитываются rebuild_stats
+    """
+    CREATE TABLE IF NOT EXISTS stats_user_daily (
+        date DATE NOT NULL,
+        username VARCHAR(50) NOT NULL,
+        completions INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (date, username)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_task_daily (
+        date DATE NOT NULL,
+        task TEXT NOT NULL,
+        completions INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (date, task)
+    )
+    """,
+    # Последние запуски периодических задач (scheduler.py), общие для всех воркеров
+    """
+    CREATE TABLE IF NOT EXISTS scheduled_jobs (
+        name VARCHAR(50) PRIMARY KEY,
+        last_run_at TIMESTAMP NOT NULL,
+        duration FLOAT,
+        error TEXT
+    )
+    """,
+    # Ключи идемпотентности примененных записей журнала сбоя (storage/journal.py)
+    """
+    CREATE TABLE IF NOT EXISTS journal_applied (
+        key VARCHAR(32) PRIMARY KEY,
+        result INTEGER,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """
+]
+
+# Текст предмета для поиска; то же выражение в триграммном индексе, иначе индекс не используется
+SEARCH_DOCUMENT = "(name || ' ' || COALESCE(description, ''))"
+
+SEARCH_SCHEMA = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS idx_user_inventory_search ON user_inventory USING gin ({SEARCH_DOCUMENT} gin_trgm_ops)",
+]
+
+# Записей журнала сбоя в одной транзакции
+REPLAY_BATCH = 500
+# Сколько дней хранить ключи примененных записей журнала сбоя (0 - не удалять): дольше, чем журнал
+# может пролежать непримененным, иначе его повторное проигрывание задвоит записи
+JOURNAL_APPLIED_RETENTION_DAYS = int(os.environ.get('JOURNAL_APPLIED_RETENTION_DAYS', '30'))
+
+# Ключ advisory lock ведущего планировщика (scheduler.py): один на базу, для всех процессов и узлов
+SCHEDULER_LOCK_KEY = 0x52474753  # 'RGGS'
+
+# Соединений в пуле; потоки (или гринлеты gevent) сверх этого ждут свободное
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+# Сколько секунд ждать ответа сервера при открытии соединения
+DB_CONNECT_TIMEOUT = 10
+
+
+class PostgresBackend(StorageBackend):
+    name = 'postgres'
+
+    def __init__(self, database_url=None, max_retries=10, retry_delay=5, pool_size=None, read_only=False,
+                 connect_budget=None):
+        self.database_url = database_url
+        # Реплика (storage/replicas.py): только чтение, схему не создаем - она приходит с основной базы
+        self.read_only = read_only
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        # Предел времени на все попытки connect(): воркер gunicorn, который молчит дольше timeout, убивают
+        self.connect_budget = connect_budget
+        self.connect_timeout = DB_CONNECT_TIMEOUT
+        if connect_budget is not None:
+            self.connect_timeout = max(1, min(DB_CONNECT_TIMEOUT, int(connect_budget)))
+        self.pool_size = pool_size or DB_POOL_SIZE
+        self.pool = None
+        # pg_trgm доступен: нечеткий поиск по предметам, иначе только ILIKE
+        self.trigram_search = False
+        self._pool_slots = threading.BoundedSemaphore(self.pool_size)
+        self._local = threading.local()
+        self._dsn = None
+        # Отдельное соединение вне пула, которое держит advisory lock ведущего планировщика
+        self._leader_conn = None
+
+    @property
+    def conn(self):
+        """Соединение текущего потока: берется из пула при первом обращении и держится до release()"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self.pool is None:
+                return None
+            self._pool_slots.acquire()
+            try:
+                conn = self.pool.getconn()
+            except Exception:
+                self._pool_slots.release()
+                raise
+            self._local.conn = conn
+        return conn
+
+    def release(self):
+        """Возвращает соединение потока в пул (в конце запроса)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        try:
+            if not conn.closed:
+                conn.rollback()
+            self.pool.putconn(conn, close=bool(conn.closed))
+        except Exception as e:
+            logger.error(f"❌ Ошибка возврата соединения в пул: {e}")
+        finally:
+            self._pool_slots.release()
+
+    @property
+    def is_connected(self):
+        return self.pool is not None and not self.pool.closed
+
+    @property
+    def thread_errors(self):
+        """Сколько ошибок запросов было в текущем потоке: методы не бросают исключений, а возвращают пустое"""
+        return getattr(self._local, 'errors', 0)
+
+    def connect(self):
+        """Подключение к базе данных с повторными попытками; при неудаче - ConnectionError"""
+        started = time.monotonic()
+        for attempt in range(self.max_retries):
+            try:
+                # Получаем DATABASE_URL из переменных окружения Railway
+                database_url = self.database_url or os.environ.get('DATABASE_URL')
+
+                if not database_url:
+                    raise ConnectionError("DATABASE_URL не найден в переменных окружения")
+
+                logger.info(f"🔄 Попытка подключения к PostgreSQL (попытка {attempt + 1}/{self.max_retries})...")
+
+                # Конвертируем postgres:// в postgresql:// если нужно
+                if database_url.startswith('postgres://'):
+                    database_url = database_url.replace('postgres://', 'postgresql://', 1)
+                self._dsn = database_url
+
+                # Парсим URL для логирования (без пароля)
+                parsed_url = database_url.split('@')[-1] if '@' in database_url else database_url
+                logger.info(f"🔗 Подключаемся к: {parsed_url}")
+
+                # Реплику открываем в режиме только чтения и на сервере без репликации
+                options = '-c default_transaction_read_only=on' if self.read_only else None
+                self.pool = ThreadedConnectionPool(
+                    1, self.pool_size,
+                    database_url,
+                    cursor_factory=tracing.TracingCursor,
+                    connect_timeout=self.connect_timeout,
+                    options=options
+                )
+
+                # Проверяем подключение
+                cur = self.conn.cursor()
+                cur.execute("SELECT 1")
+                cur.close()
+
+                logger.info("✅ Подключение к PostgreSQL установлено")
+                if self.read_only:
+                    self.trigram_search = self.has_trigram_index()
+                else:
+                    self.init_tables()
+                self.release()
+                return
+
+            except Exception as e:
+                logger.error(f"❌ Попытка {attempt + 1}/{self.max_retries}: Ошибка подключения к PostgreSQL: {e}")
+                if self.pool is not None:
+                    self.release()
+                    self.pool.closeall()
+                    self.pool = None
+                if attempt < self.max_retries - 1:
+                    if (self.connect_budget is not None and
+                            time.monotonic() - started + self.retry_delay + self.connect_timeout > self.connect_budget):
+                        logger.warning(f"⏳ Время на подключение ({self.connect_budget:g} с) исчерпано")
+                        break
+                    logger.info(f"⏳ Повторная попытка через {self.retry_delay} секунд...")
+                    time.sleep(self.retry_delay)
+
+        self.pool = None
+        raise ConnectionError("Не удалось подключиться к PostgreSQL после всех попыток")
+
+    def close(self):
+        self.release_scheduler_lock()
+        if self.pool is not None:
+            self.release()
+            self.pool.closeall()
+
+    def _rollback(self):
+        """Откатываем ошибочную транзакцию, чтобы соединение оставалось рабочим"""
+        self._local.errors = self.thread_errors + 1
+        try:
+            self.conn.rollback()
+        except Exception:
+            pass
+
+    def init_tables(self):
+        try:
+            cur = self.conn.cursor()
+            for command in SCHEMA:
+                cur.execute(command)
+            self.conn.commit()
+            cur.close()
+            logger.info("✅ Таблицы инициализированы")
+            self.insert_initial_data()
+        except Exception as e:
+            logger.error(f"❌ Ошибка инициализации таблиц: {e}")
+            self._rollback()
+        self.init_search()
+
+    def init_search(self):
+        """Триграммный индекс для поиска предметов; расширение pg_trgm может быть запрещено правами"""
+        try:
+            cur = self.conn.cursor()
+            for command in SEARCH_SCHEMA:
+                cur.execute(command)
+            self.conn.commit()
+            cur.close()
+            self.trigram_search = True
+        except Exception as e:
+            logger.warning(f"⚠️ pg_trgm недоступен, поиск предметов без нечеткого совпадения: {e}")
+            self._rollback()
+
+    def has_trigram_index(self):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            found = cur.fetchone() is not None
+            cur.close()
+            return found
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось проверить pg_trgm: {e}")
+            self._rollback()
+            return False
+
+    def replication_lag(self):
+        """Отставание реплики в секундах: 0 - все полученное применено (или сервер не реплика), None - ошибка"""
+        try:
+            cur = self.conn.cursor()
+            cur.execute("""
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                END AS lag
+            """)
+            lag = cur.fetchone()['lag']
+            cur.close()
+            return float(lag) if lag is not None else None
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка проверки отставания реплики: {e}")
+            self._rollback()
+            return None
+
+    def insert_initial_data(self):
+        try:
+            cur = self.conn.cursor()
+
+            # Проверяем, есть ли уже пользователи
+            cur.execute("SELECT COUNT(*) as count FROM users")
+            if cur.fetchone()['count'] == 0:
+                for user in DEFAULT_USERS:
+                    cur.execute(
+                        "INSERT INTO users (username, password, role, coins) VALUES (%s, %s, %s, %s)",
+                        user
+                    )
+
+            # Проверяем конфигурацию задач
+            cur.execute("SELECT COUNT(*) as count FROM tasks_config")
+            if cur.fetchone()['count'] == 0:
+                cur.execute(
+                    "INSERT INTO tasks_config (button1, button2, button3) VALUES (%s, %s, %s)",
+                    (json.dumps(DEFAULT_TASKS['button1']),
+                     json.dumps(DEFAULT_TASKS['button2']),
+                     json.dumps(DEFAULT_TASKS['button3']))
+                )
+
+            # Проверяем конфигурацию карты
+            cur.execute("SELECT COUNT(*) as count FROM map_config")
+            if cur.fetchone()['count'] == 0:
+                cur.execute(
+                    "INSERT INTO map_config (start_point, active_points, checkpoints, end_point, updated_by) VALUES (%s, %s, %s, %s, %s)",
+                    (json.dumps(DEFAULT_MAP['start_point']),
+                     json.dumps(encode_active_points(DEFAULT_MAP['active_points'])),
+                     json.dumps(DEFAULT_MAP['checkpoints']),
+                     json.dumps(DEFAULT_MAP['end_point']),
+                     'system')
+                )
+
+            self.conn.commit()
+            cur.close()
+            logger.info("✅ Начальные данные добавлены")
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка добавления начальных данных: {e}")
+            self._rollback()
+
+    # Пользователи
+    def get_user(self, username):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("SELECT * FROM users WHERE username = %s", (username,))
+            user = cur.fetchone()
+            cur.close()
+            return user
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения пользователя {username}: {e}")
+            self._rollback()
+            return None
+
+    def get_all_users(self):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("SELECT * FROM users ORDER BY username")
+            users = cur.fetchall()
+            cur.close()
+            return {user['username']: dict(user) for user in users}
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения всех пользователей: {e}")
+            self._rollback()
+            return {}
+
+    def create_user(self, username, password, role='user', coins=0):
+        try:
+            cur = self.conn.cursor()
+            cur.execute(
+                "INSERT INTO users (username, password, role, coins) VALUES (%s, %s, %s, %s)",
+                (username, password, role, coins)
+            )
+            self.conn.commit()
+            cur.close()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка создания пользователя {username}: {e}")
+            self._rollback()
+            return False
+
+    def update_user_coins(self, username, coins):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("UPDATE users SET coins = %s WHERE username = %s", (coins, username))
+            self.conn.commit()
+            cur.close()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления монет пользователя {username}: {e}")
+            self._rollback()
+            return False
+
+    def update_user_role(self, username, role):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("UPDATE users SET role = %s WHERE username = %s", (role, username))
+            updated = cur.rowcount == 1
+            self.conn.commit()
+            cur.close()
+            return updated
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления роли пользователя {username}: {e}")
+            self._rollback()
+            return False
+
+    def get_user_context(self, username, date):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("""
+                SELECT u.*,
+                       COALESCE((SELECT p.tasks_done FROM user_progress p
+                                 WHERE p.username = u.username AND p.date = %s), '[]'::jsonb) AS today_done,
+                       (SELECT COALESCE(SUM(jsonb_array_length(p.tasks_done)), 0) FROM user_progress p
+                        WHERE p.username = u.username) AS total_completed
+                FROM users u
+                WHERE u.username = %s
+            """, (date, username))
+            row = cur.fetchone()
+            cur.close()
+            if not row:
+                return None
+            context = dict(row)
+            context['total_completed'] = int(context['total_completed'])
+            return context
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения контекста пользователя {username}: {e}")
+            self._rollback()
+            return None
+
+    # Массовое начисление монет: один SQL-запрос в одной транзакции
+    def award_coins_all(self, amount):
+        try:
+            cur = self.conn.cursor()
+            cur.execute(
+                "UPDATE users SET coins = coins + %s RETURNING username",
+                (amount,)
+            )
+            awarded = [row['username'] for row in cur.fetchall()]
+            self.conn.commit()
+            cur.close()
+            return award_report(awarded)
+        except Exception as e:
+            logger.error(f"❌ Ошибка массового начисления монет: {e}")
+            self._rollback()
+            return None
+
+    def award_coins_completed(self, date, amount, task_text=None):
+        try:
+            cur = self.conn.cursor()
+            if task_text:
+                condition = "p.tasks_done ? %s"
+                params = (amount, date, task_text)
+            else:
+                condition = "jsonb_array_length(p.tasks_done) > 0"
+                params = (amount, date)
+            cur.execute(f"""
+                UPDATE users u SET coins = u.coins + %s
+                FROM user_progress p
+                WHERE p.username = u.username AND p.date = %s AND {condition}
+                RETURNING u.username
+            """, params)
+            awarded = [row['username'] for row in cur.fetchall()]
+            self.conn.commit()
+            cur.close()
+            return award_report(awarded)
+        except Exception as e:
+            logger.error(f"❌ Ошибка начисления монет за выполненные задачи: {e}")
+            self._rollback()
+            return None
+
+    def award_coins_list(self, awards):
+        totals = sum_awards(awards)
+        if not totals:
+            return award_report([])
+
+        try:
+            cur = self.conn.cursor()
+            rows = execute_values(cur, """
+                UPDATE users u SET coins = u.coins + v.amount
+                FROM (VALUES %s) AS v(username, amount)
+                WHERE u.username = v.username
+                RETURNING u.username
+            """, list(totals.items()), template="(%s, %s::integer)", page_size=len(totals), fetch=True)
+            awarded = [row['username'] for row in rows]
+            self.conn.commit()
+            cur.close()
+            return award_report(awarded, totals)
+        except Exception as e:
+            logger.error(f"❌ Ошибка начисления монет по списку: {e}")
+            self._rollback()
+            return None
+
+    # Задачи
+    def get_tasks_config(self):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("SELECT * FROM tasks_config ORDER BY id DESC LIMIT 1")
+            config = cur.fetchone()
+            cur.close()
+            if config:
+                return {
+                    "button1": config['button1'],
+                    "button2": config['button2'],
+                    "button3": config['button3']
+                }
+            return {"button1": [], "button2": [], "button3": []}
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения конфигурации задач: {e}")
+            self._rollback()
+            return {"button1": [], "button2": [], "button3": []}
+
+    def update_tasks_config(self, tasks):
+        try:
+            cur = self.conn.cursor()
+            cur.execute(
+                "INSERT INTO tasks_config (button1, button2, button3) VALUES (%s, %s, %s)",
+                (json.dumps(tasks['button1']), json.dumps(tasks['button2']), json.dumps(tasks['button3']))
+            )
+            self.conn.commit()
+            cur.close()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления конфигурации задач: {e}")
+            self._rollback()
+            return False
+
+    def get_daily_tasks(self, date):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("SELECT tasks FROM daily_tasks WHERE date = %s", (date,))
+            result = cur.fetchone()
+            cur.close()
+            return result['tasks'] if result else None
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения ежедневных задач: {e}")
+            self._rollback()
+            return None
+
+    def save_daily_tasks(self, date, tasks):
+        try:
+            cur = self.conn.cursor()
+            cur.execute(
+                "INSERT INTO daily_tasks (date, tasks) VALUES (%s, %s) ON CONFLICT (date) DO UPDATE SET tasks = %s",
+                (date, json.dumps(tasks), json.dumps(tasks))
+            )
+            self.conn.commit()
+            cur.close()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения ежедневных задач: {e}")
+            self._rollback()
+            return False
+
+    def create_daily_tasks(self, date, tasks):
+        try:
+            cur = self.conn.cursor()
+            cur.execute(
+                "INSERT INTO daily_tasks (date, tasks) VALUES (%s, %s) ON CONFLICT (date) DO NOTHING",
+                (date, json.dumps(tasks))
+            )
+            created = cur.rowcount == 1
+            self.conn.commit()
+            cur.close()
+            return created
+        except Exception as e:
+            logger.error(f"❌ Ошибка создания ежедневных задач на {date}: {e}")
+            self._rollback()
+            return False
+
+    # Доска задач
+    def get_board_tasks(self):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("SELECT * FROM board_tasks ORDER BY id")
+            tasks = cur.fetchall()
+            cur.close()
+            return [dict(task) for task in tasks]
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения задач доски: {e}")
+            self._rollback()
+            return []
+
+    def save_board_tasks(self, tasks):
+        try:
+            cur = self.conn.cursor()
+            # Очищаем старые задачи
+            cur.execute("DELETE FROM board_tasks")
+            # Добавляем новые
+            for task in tasks:
+                cur.execute(
+                    "INSERT INTO board_tasks (text, difficulty, status, user_taken, taken_at, done_at) VALUES (%s, %s, %s, %s, %s, %s)",
+                    (task['text'], task['difficulty'], task['status'], task.get('user'), task.get('taken_at'),
+                     task.get('done_at'))
+                )
+            self.conn.commit()
+            cur.close()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения задач доски: {e}")
+            self._rollback()
+            return False
+
+    def update_board_task(self, task_id, updates):
+        try:
+            cur = self.conn.cursor()
+            set_clause = ", ".join([f"{key} = %s" for key in updates.keys()])
+            values = list(updates.values())
+            values.append(task_id)
+            cur.execute(f"UPDATE board_tasks SET {set_clause} WHERE id = %s", values)
+            self.conn.commit()
+            cur.close()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления задачи доски {task_id}: {e}")
+            self._rollback()
+            return False
+
+    # Архив доски
+    def archive_done_tasks(self, older_than, limit=500):
+        """Переносит задачи одной транзакцией: DELETE ... RETURNING сразу вставляется в архив.
+
+        Задача без done_at считается выполненной тогда, когда ее взяли или создали.
+        SKIP LOCKED - чтобы воркеры, запустившие перенос одновременно, не ждали друг друга.
+        """
+        done_at = "COALESCE(done_at, taken_at, created_at)"
+        try:
+            cur = self.conn.cursor()
+            cur.execute(f"""
+                SELECT DISTINCT date_trunc('month', {done_at}) AS month FROM board_tasks
+                WHERE status = 'done' AND {done_at} < %s
+            """, (older_than,))
+            for row in cur.fetchall():
+                self._create_archive_partition(cur, row['month'])
+            cur.execute(f"""
+                WITH moved AS (
+                    DELETE FROM board_tasks WHERE id IN (
+                        SELECT id FROM board_tasks
+                        WHERE status = 'done' AND {done_at} < %s
+                        ORDER BY id LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, text, difficulty, user_taken, taken_at, {done_at} AS done_at, created_at
+                )
+                INSERT INTO board_archive (id, text, difficulty, status, user_taken, taken_at, done_at, created_at)
+                SELECT id, text, difficulty, 'done', user_taken, taken_at, done_at, created_at FROM moved
+            """, (older_than, limit))
+            moved = cur.rowcount
+            self.conn.commit()
+            cur.close()
+            return moved
+        except Exception as e:
+            logger.error(f"❌ Ошибка переноса задач в архив: {e}")
+            self._rollback()
+            return 0
+
+    @staticmethod
+    def _create_archive_partition(cur, month):
+        next_month = (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS board_archive_{month:%Y_%m} PARTITION OF board_archive
+            FOR VALUES FROM (%s) TO (%s)
+        """, (month, next_month))
+
+    def get_archive_page(self, after_id=None, limit=50):
+        where = "TRUE"
+        params = []
+        if after_id is not None:
+            where = "id < %s"
+            params.append(after_id)
+        return self._fetch_page(f"SELECT * FROM board_archive WHERE {where} ORDER BY id DESC LIMIT %s",
+                                [*params, limit], 'архив')
+
+    def count_archived_tasks(self):
+        rows = self._fetch_page("SELECT COUNT(*) AS count FROM board_archive", (), 'число задач в архиве')
+        return rows[0]['count'] if rows else 0
+
+    # Прогресс
+    def get_user_progress(self, username, date):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("SELECT tasks_done FROM user_progress WHERE username = %s AND date = %s", (username, date))
+            result = cur.fetchone()
+            cur.close()
+            return result['tasks_done'] if result else []
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения прогресса пользователя {username}: {e}")
+            self._rollback()
+            return []
+
+    def save_user_progress(self, username, date, tasks_done):
+        try:
+            cur = self.conn.cursor()
+            # Прежний список нужен, чтобы сдвинуть сводки статистики на разницу в той же транзакции
+            cur.execute("SELECT tasks_done FROM user_progress WHERE username = %s AND date = %s FOR UPDATE",
+                        (username, date))
+            previous = cur.fetchone()
+            cur.execute(
+                "INSERT INTO user_progress (username, date, tasks_done) VALUES (%s, %s, %s) ON CONFLICT (username, date) DO UPDATE SET tasks_done = %s",
+                (username, date, json.dumps(tasks_done), json.dumps(tasks_done))
+            )
+            self._bump_stats(cur, username, date, *progress_delta(previous['tasks_done'] if previous else [], tasks_done))
+            self.conn.commit()
+            cur.close()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения прогресса пользователя {username}: {e}")
+            self._rollback()
+            return False
+
+    def get_user_all_progress(self, username):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("SELECT tasks_done FROM user_progress WHERE username = %s", (username,))
+            results = cur.fetchall()
+            cur.close()
+            all_tasks = []
+            for result in results:
+                all_tasks.extend(result['tasks_done'])
+            return all_tasks
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения всего прогресса пользователя {username}: {e}")
+            self._rollback()
+            return []
+
+    # Статистика
+    @staticmethod
+    def _bump_stats(cur, username, date, user_delta, task_deltas):
+        if user_delta:
+            cur.execute("""
+                INSERT INTO stats_user_daily (date, username, completions) VALUES (%s, %s, %s)
+                ON CONFLICT (date, username) DO UPDATE SET completions = stats_user_daily.completions + EXCLUDED.completions
+            """, (date, username, user_delta))
+        if task_deltas:
+            execute_values(cur, """
+                INSERT INTO stats_task_daily (date, task, completions) VALUES %s
+                ON CONFLICT (date, task) DO UPDATE SET completions = stats_task_daily.completions + EXCLUDED.completions
+            """, [(date, task, delta) for task, delta in task_deltas.items()], template="(%s::date, %s, %s)")
+
+    @staticmethod
+    def _rebuild_stats(cur, dates=None, since=None):
+        """Пересчитывает сводки из user_progress за даты dates или начиная с since (все, если не заданы)"""
+        where = "TRUE"
+        if dates is not None:
+            where = "date = ANY(%(dates)s::date[])"
+        elif since is not None:
+            where = "date >= %(since)s"
+        params = {'dates': list(dates or ()), 'since': since}
+        cur.execute(f"DELETE FROM stats_user_daily WHERE {where}", params)
+        cur.execute(f"DELETE FROM stats_task_daily WHERE {where}", params)
+        cur.execute(f"""
+            INSERT INTO stats_user_daily (date, username, completions)
+            SELECT date, username, jsonb_array_length(tasks_done) FROM user_progress
+            WHERE {where} AND jsonb_array_length(tasks_done) > 0
+        """, params)
+        user_rows = cur.rowcount
+        cur.execute(f"""
+            INSERT INTO stats_task_daily (date, task, completions)
+            SELECT date, task, COUNT(*) FROM user_progress, jsonb_array_elements_text(tasks_done) AS task
+            WHERE {where}
+            GROUP BY date, task
+        """, params)
+        return {'user_rows': user_rows, 'task_rows': cur.rowcount}
+
+    def rebuild_stats(self, since=None):
+        try:
+            cur = self.conn.cursor()
+            report = self._rebuild_stats(cur, since=since)
+            self.conn.commit()
+            cur.close()
+            return report
+        except Exception as e:
+            logger.error(f"❌ Ошибка пересчета статистики: {e}")
+            self._rollback()
+            return None
+
+    def get_stats(self, since, top=10):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("""
+                SELECT to_char(date, 'YYYY-MM-DD') AS date, SUM(completions)::integer AS completions,
+                       COUNT(*)::integer AS players
+                FROM stats_user_daily WHERE date >= %s AND completions > 0
+                GROUP BY date ORDER BY date
+            """, (since,))
+            per_day = [dict(row) for row in cur.fetchall()]
+            cur.execute("""
+                SELECT username, SUM(completions)::integer AS completions FROM stats_user_daily
+                WHERE date >= %s GROUP BY username HAVING SUM(completions) > 0
+                ORDER BY completions DESC, username LIMIT %s
+            """, (since, top))
+            top_players = [dict(row) for row in cur.fetchall()]
+            cur.execute("""
+                SELECT task, SUM(completions)::integer AS completions FROM stats_task_daily
+                WHERE date >= %s GROUP BY task HAVING SUM(completions) > 0
+                ORDER BY completions DESC, task LIMIT %s
+            """, (since, top))
+            top_tasks = [dict(row) for row in cur.fetchall()]
+            cur.close()
+            return stats_report(per_day, top_players, top_tasks, self.count_active_players(since))
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения статистики: {e}")
+            self._rollback()
+            return None
+
+    def count_active_players(self, since):
+        rows = self._fetch_page("SELECT COUNT(DISTINCT username) AS count FROM stats_user_daily "
+                                "WHERE date >= %s AND completions > 0", (since,), 'активные игроки')
+        return rows[0]['count'] if rows else 0
+
+    # Карта
+    def get_map_config(self):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("SELECT * FROM map_config ORDER BY id DESC LIMIT 1")
+            config = cur.fetchone()
+            cur.close()
+
+            if config:
+                # Преобразуем JSONB поля в словари
+                return {
+                    'start_point': config['start_point'],
+                    'active_points': PointColumns.decode(config['active_points']),
+                    'checkpoints': config['checkpoints'],
+                    'end_point': config['end_point'],
+                    'updated_at': config['updated_at'].strftime('%Y-%m-%d %H:%M:%S') if config[
+                        'updated_at'] else 'Неизвестно',
+                    'updated_by': config['updated_by'] or 'system'
+                }
+            return None
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения конфигурации карты: {e}")
+            self._rollback()
+            return None
+
+    def save_map_config(self, config, updated_by):
+        try:
+            cur = self.conn.cursor()
+            cur.execute(
+                "INSERT INTO map_config (start_point, active_points, checkpoints, end_point, updated_by) VALUES (%s, %s, %s, %s, %s)",
+                (json.dumps(config['start_point']),
+                 json.dumps(encode_active_points(config['active_points'])),
+                 json.dumps(config['checkpoints']),
+                 json.dumps(config['end_point']),
+                 updated_by)
+            )
+            self.conn.commit()
+            cur.close()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения конфигурации карты: {e}")
+            self._rollback()
+            return False
+
+    def prune_map_history(self, keep):
+        """Удаляет старые версии конфигурации карты, кроме keep последних"""
+        try:
+            cur = self.conn.cursor()
+            cur.execute("""
+                DELETE FROM map_config
+                WHERE id <= (SELECT id FROM map_config ORDER BY id DESC OFFSET %s LIMIT 1)
+            """, (keep,))
+            deleted = cur.rowcount
+            self.conn.commit()
+            cur.close()
+            return deleted
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки истории карты: {e}")
+            self._rollback()
+            return 0
+
+    def get_user_position(self, username):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("SELECT x, y FROM user_positions WHERE username = %s", (username,))
+            result = cur.fetchone()
+            cur.close()
+
+            if result:
+                # Убедимся, что координаты в пределах карты
+                return {'x': clamp_coordinate(result['x']), 'y': clamp_coordinate(result['y'])}
+            else:
+                # Создаем дефолтную позицию если нет в базе
+                self.save_user_position(username, DEFAULT_POSITION['x'], DEFAULT_POSITION['y'])
+                return dict(DEFAULT_POSITION)
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения позиции пользователя {username}: {e}")
+            self._rollback()
+            return dict(DEFAULT_POSITION)  # Дефолтная позиция при ошибке
+
+    def save_user_position(self, username, x, y):
+        try:
+            cur = self.conn.cursor()
+            # Убедимся, что координаты в пределах карты
+            x = clamp_coordinate(x)
+            y = clamp_coordinate(y)
+
+            cur.execute(
+                "INSERT INTO user_positions (username, x, y) VALUES (%s, %s, %s) ON CONFLICT (username) DO UPDATE SET x = %s, y = %s, updated_at = CURRENT_TIMESTAMP",
+                (username, x, y, x, y)
+            )
+            self.conn.commit()
+            cur.close()
+            logger.info(f"✅ Позиция пользователя {username} сохранена: x={x}, y={y}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения позиции пользователя {username}: {e}")
+            self._rollback()
+            return False
+
+    # Инвентарь
+    def get_user_inventory(self, username):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("""
+                SELECT id, name, description, quantity, created_at, updated_at
+                FROM user_inventory
+                WHERE username = %s
+                ORDER BY created_at DESC
+            """, (username,))
+            inventory = cur.fetchall()
+            cur.close()
+            return [dict(item) for item in inventory]
+        except Exception as e:
+            logger.error(f"Ошибка получения инвентаря: {e}")
+            self._rollback()
+            return []
+
+    def add_item_to_inventory(self, username, name, description, quantity=1):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("""
+                INSERT INTO user_inventory (username, name, description, quantity)
+                VALUES (%s, %s, %s, %s)
+                RETURNING id
+            """, (username, name, description, quantity))
+            new_id = cur.fetchone()['id']
+            self.conn.commit()
+            cur.close()
+            return new_id
+        except Exception as e:
+            logger.error(f"Ошибка добавления предмета: {e}")
+            self._rollback()
+            return None
+
+    def update_inventory_item(self, username, item_id, updates):
+        try:
+            cur = self.conn.cursor()
+            set_clause = ", ".join([f"{key} = %s" for key in updates.keys()])
+            values = list(updates.values())
+            values.extend([username, item_id])
+
+            cur.execute(f"""
+                UPDATE user_inventory
+                SET {set_clause}, updated_at = CURRENT_TIMESTAMP
+                WHERE username = %s AND id = %s
+            """, values)
+            self.conn.commit()
+            cur.close()
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка обновления предмета: {e}")
+            self._rollback()
+            return False
+
+    def delete_inventory_item(self, username, item_id):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM user_inventory WHERE username = %s AND id = %s", (username, item_id))
+            self.conn.commit()
+            cur.close()
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка удаления предмета: {e}")
+            self._rollback()
+            return False
+
+    def apply_inventory_batch(self, username, operations):
+        """Выдача id (nextval), INSERT, UPDATE ... FROM VALUES и DELETE - не больше четырех запросов и один коммит"""
+        adds = [op for op in operations if op['op'] == 'add']
+        # Несколько изменений одного предмета сливаются в одно: UPDATE ... FROM не применит обе строки
+        updates = {}
+        for op in operations:
+            if op['op'] == 'update':
+                updates.setdefault(op['id'], {}).update(op['updates'])
+        delete_ids = list({op['id'] for op in operations if op['op'] == 'delete'})
+        try:
+            cur = self.conn.cursor()
+            added_ids = []
+            if adds:
+                # Порядок строк RETURNING у многострочного INSERT не гарантирован: id выдаем заранее
+                cur.execute("SELECT nextval(pg_get_serial_sequence('user_inventory', 'id')) AS id "
+                            "FROM generate_series(1, %s)", (len(adds),))
+                added_ids = [row['id'] for row in cur.fetchall()]
+                execute_values(cur, "INSERT INTO user_inventory (id, username, name, description, quantity) VALUES %s",
+                               [(item_id, username, op['name'], op['description'], op['quantity'])
+                                for item_id, op in zip(added_ids, adds)], page_size=len(adds))
+            updated = set()
+            if updates:
+                rows = execute_values(cur, """
+                    UPDATE user_inventory AS i
+                    SET name = COALESCE(v.name, i.name),
+                        description = CASE WHEN v.set_description THEN v.description ELSE i.description END,
+                        quantity = COALESCE(v.quantity, i.quantity),
+                        updated_at = CURRENT_TIMESTAMP
+                    FROM (VALUES %s) AS v(id, username, name, description, set_description, quantity)
+                    WHERE i.id = v.id AND i.username = v.username
+                    RETURNING i.id
+                """, [(item_id, username, fields.get('name'), fields.get('description'), 'description' in fields,
+                       fields.get('quantity')) for item_id, fields in updates.items()],
+                    template="(%s::integer, %s::varchar, %s::varchar, %s::text, %s::boolean, %s::integer)",
+                    page_size=len(updates), fetch=True)
+                updated = {row['id'] for row in rows}
+            deleted = set()
+            if delete_ids:
+                cur.execute("DELETE FROM user_inventory WHERE username = %s AND id = ANY(%s) RETURNING id",
+                            (username, delete_ids))
+                deleted = {row['id'] for row in cur.fetchall()}
+            self.conn.commit()
+            cur.close()
+        except Exception as e:
+            logger.error(f"❌ Ошибка пакетного изменения инвентаря {username}: {e}")
+            self._rollback()
+            return None
+
+        added_ids = iter(added_ids)
+        return [next(added_ids) if op['op'] == 'add' else op['id'] in (updated if op['op'] == 'update' else deleted)
+                for op in operations]
+
+    def search_inventory(self, query, limit=20):
+        """Подстрока (ILIKE) или сходство слов (<% из pg_trgm); оба условия используют триграммный индекс"""
+        pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        params = {'query': query, 'pattern': pattern, 'prefix': pattern[1:], 'limit': limit}
+        if self.trigram_search:
+            score = f"word_similarity(%(query)s, {SEARCH_DOCUMENT})"
+            where = f"{SEARCH_DOCUMENT} ILIKE %(pattern)s OR %(query)s <%% {SEARCH_DOCUMENT}"
+        else:
+            score = "1.0"
+            where = f"{SEARCH_DOCUMENT} ILIKE %(pattern)s"
+        return self._fetch_page(f"""
+            SELECT id, username, name, description, quantity, {score} AS score
+            FROM user_inventory
+            WHERE {where}
+            ORDER BY name ILIKE %(prefix)s DESC, score DESC, id DESC
+            LIMIT %(limit)s
+        """, params, 'поиск предметов')
+
+    # Журнал действий
+    def record_activity_events(self, events):
+        try:
+            cur = self.conn.cursor()
+            execute_values(cur, """
+                INSERT INTO activity_events (kind, username, payload, created_at) VALUES %s
+            """, [(e['kind'], e['username'], json.dumps(e['payload'], ensure_ascii=False, default=str),
+                   e['created_at']) for e in events])
+            self.conn.commit()
+            cur.close()
+            return len(events)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи журнала действий: {e}")
+            self._rollback()
+            return None
+
+    def get_activity_page(self, after_id=None, limit=50, username=None):
+        conditions = []
+        params = []
+        if username is not None:
+            conditions.append("username = %s")
+            params.append(username)
+        if after_id is not None:
+            conditions.append("id < %s")
+            params.append(after_id)
+        where = " AND ".join(conditions) or "TRUE"
+        return self._fetch_page(f"SELECT * FROM activity_events WHERE {where} ORDER BY id DESC LIMIT %s",
+                                [*params, limit], 'журнал действий')
+
+    def prune_activity_events(self, older_than, limit=10000):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("""
+                DELETE FROM activity_events WHERE id IN (
+                    SELECT id FROM activity_events WHERE created_at < %s ORDER BY id LIMIT %s
+                )
+            """, (older_than, limit))
+            deleted = cur.rowcount
+            self.conn.commit()
+            cur.close()
+            return deleted
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки журнала действий: {e}")
+            self._rollback()
+            return 0
+
+    # Планировщик
+    def try_acquire_scheduler_lock(self):
+        """Advisory lock на отдельном соединении: держится, пока соединение живо, и снимается при его обрыве"""
+        if self._leader_conn is not None:
+            try:
+                # Блокировка сессионная: проверяем, что соединение, а значит и блокировка, на месте
+                with self._leader_conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                return True
+            except Exception as e:
+                logger.warning(f"⚠️ Соединение ведущего планировщика потеряно: {e}")
+                self.release_scheduler_lock()
+        if not self._dsn:
+            return False
+        try:
+            conn = psycopg2.connect(self._dsn, connect_timeout=10, application_name='rgg-scheduler')
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (SCHEDULER_LOCK_KEY,))
+                acquired = cur.fetchone()[0]
+        except Exception as e:
+            logger.error(f"❌ Ошибка захвата блокировки планировщика: {e}")
+            return False
+        if not acquired:
+            conn.close()
+            return False
+        self._leader_conn = conn
+        return True
+
+    def release_scheduler_lock(self):
+        conn, self._leader_conn = self._leader_conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def get_job_runs(self):
+        rows = self._fetch_page("SELECT name, to_char(last_run_at, 'YYYY-MM-DD HH24:MI:SS') AS last_run_at, "
+                                "duration, error FROM scheduled_jobs", (), 'запуски задач')
+        return {row.pop('name'): row for row in rows}
+
+    def record_job_run(self, name, started_at, duration, error=None):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("""
+                INSERT INTO scheduled_jobs (name, last_run_at, duration, error) VALUES (%s, %s, %s, %s)
+                ON CONFLICT (name) DO UPDATE SET
+                    last_run_at = EXCLUDED.last_run_at, duration = EXCLUDED.duration, error = EXCLUDED.error
+            """, (name, started_at, duration, error))
+            self.conn.commit()
+            cur.close()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи запуска задачи {name}: {e}")
+            self._rollback()
+            return False
+
+    # Постраничная выборка
+    def _fetch_page(self, sql, params, what):
+        try:
+            cur = self.conn.cursor()
+            cur.execute(sql, params)
+            rows = [dict(row) for row in cur.fetchall()]
+            cur.close()
+            return rows
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения страницы ({what}): {e}")
+            self._rollback()
+            return []
+
+    def get_board_page(self, statuses, after_id=None, limit=50, newest_first=False):
+        where = "status = ANY(%s)"
+        params = [list(statuses)]
+        if after_id is not None:
+            where += " AND id < %s" if newest_first else " AND id > %s"
+            params.append(after_id)
+        order = "DESC" if newest_first else "ASC"
+        return self._fetch_page(f"SELECT * FROM board_tasks WHERE {where} ORDER BY id {order} LIMIT %s",
+                                [*params, limit], 'доска')
+
+    def count_board_tasks(self, statuses):
+        rows = self._fetch_page("SELECT COUNT(*) AS count FROM board_tasks WHERE status = ANY(%s)",
+                                (list(statuses),), 'число задач')
+        return rows[0]['count'] if rows else 0
+
+    def get_users_page(self, after=None, limit=50):
+        rows = self._fetch_page("""
+            SELECT u.username, u.role, u.coins, u.created_at, p.x, p.y
+            FROM users u LEFT JOIN user_positions p ON p.username = u.username
+            WHERE u.username > %s
+            ORDER BY u.username
+            LIMIT %s
+        """, (after or '', limit), 'пользователи')  # LIMIT NULL - без ограничения
+        return [public_user(row['username'], row,
+                            {'x': clamp_coordinate(row['x']), 'y': clamp_coordinate(row['y'])}
+                            if row['x'] is not None else None)
+                for row in rows]
+
+    def get_users_summary(self):
+        rows = self._fetch_page("""
+            SELECT COUNT(*) AS users, COUNT(*) FILTER (WHERE role = 'admin') AS admins,
+                   COALESCE(SUM(coins), 0) AS total_coins, COALESCE(MAX(coins), 0) AS max_coins
+            FROM users
+        """, (), 'сводка пользователей')
+        return rows[0] if rows else None
+
+    def get_inventory_page(self, username, after_id=None, limit=50):
+        where = "username = %s"
+        params = [username]
+        if after_id is not None:
+            where += " AND id < %s"
+            params.append(after_id)
+        return self._fetch_page(f"""
+            SELECT id, name, description, quantity, created_at, updated_at
+            FROM user_inventory
+            WHERE {where}
+            ORDER BY id DESC
+            LIMIT %s
+        """, [*params, limit], 'инвентарь')
+
+    def get_inventory_summary(self, username):
+        rows = self._fetch_page("""
+            SELECT COUNT(*) AS items, COUNT(*) FILTER (WHERE quantity > 1) AS stacks,
+                   COALESCE(SUM(quantity), 0) AS units
+            FROM user_inventory WHERE username = %s
+        """, (username,), 'сводка инвентаря')
+        return rows[0] if rows else None
+
+    def get_inventory_owners_page(self, after=None, limit=20):
+        rows = self._fetch_page("""
+            WITH owners AS (
+                SELECT DISTINCT i.username FROM user_inventory i JOIN users u ON u.username = i.username
+                WHERE i.username > %s
+                ORDER BY i.username
+                LIMIT %s
+            )
+            SELECT u.username, u.coins, i.id, i.name, i.description, i.quantity, i.created_at
+            FROM owners o
+            JOIN users u ON u.username = o.username
+            JOIN user_inventory i ON i.username = o.username
+            ORDER BY u.username, i.id DESC
+        """, (after or '', limit), 'инвентари')
+        return group_inventory_owners(rows)
+
+    def get_inventories_summary(self):
+        rows = self._fetch_page("""
+            SELECT COUNT(DISTINCT i.username) AS owners, COUNT(*) AS items,
+                   COALESCE(SUM(i.quantity), 0) AS units, COALESCE(MAX(u.coins), 0) AS max_coins
+            FROM user_inventory i JOIN users u ON u.username = i.username
+        """, (), 'сводка инвентарей')
+        return rows[0] if rows else None
+
+    # Журнал сбоя
+    def replay_journal(self, entries):
+        """Применяет записи журнала сбоя по порядку; возвращает число новых примененных записей.
+
+        Каждая пачка - одна транзакция: записи и их ключи в journal_applied
+        фиксируются вместе, поэтому повторный вызов пропускает уже примененное.
+        """
+        applied_count = 0
+        for start in range(0, len(entries), REPLAY_BATCH):
+            batch = entries[start:start + REPLAY_BATCH]
+            cur = self.conn.cursor()
+            try:
+                # Ключи записей пачки и ключи предметов, на которые они ссылаются
+                keys = {entry['key'] for entry in batch} | {entry['item_key'] for entry in batch if 'item_key' in entry}
+                cur.execute("SELECT key, result FROM journal_applied WHERE key = ANY(%s)", (list(keys),))
+                results = {row['key']: row['result'] for row in cur.fetchall()}
+                pending = [entry for entry in batch if entry['key'] not in results]
+
+                # Подряд идущие записи одного типа применяем одним запросом
+                for op, group in itertools.groupby(pending, key=lambda entry: entry['op']):
+                    getattr(self, '_replay_' + op)(cur, list(group), results)
+
+                if pending:
+                    execute_values(cur, "INSERT INTO journal_applied (key, result) VALUES %s",
+                                   [(entry['key'], results.get(entry['key'])) for entry in pending])
+                self.conn.commit()
+                applied_count += len(pending)
+            except Exception:
+                self._rollback()
+                raise
+            finally:
+                cur.close()
+        self._prune_journal_applied()
+        return applied_count
+
+    def _prune_journal_applied(self):
+        """Ключи старше JOURNAL_APPLIED_RETENTION_DAYS: журналы с ними давно применены и удалены"""
+        if JOURNAL_APPLIED_RETENTION_DAYS <= 0:
+            return
+        try:
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM journal_applied WHERE applied_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 day'",
+                        (JOURNAL_APPLIED_RETENTION_DAYS,))
+            deleted = cur.rowcount
+            self.conn.commit()
+            cur.close()
+            if deleted:
+                logger.info(f"🧹 Удалено старых ключей журнала сбоя: {deleted}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки ключей журнала сбоя: {e}")
+            self._rollback()
+
+    @staticmethod
+    def _last_by(group, *fields):
+        """Из нескольких записей об одном объекте оставляем последнюю"""
+        latest = {}
+        for entry in group:
+            latest[tuple(entry[field] for field in fields)] = entry
+        return list(latest.values())
+
+    def _replay_create_user(self, cur, group, results):
+        execute_values(cur, """
+            INSERT INTO users (username, password, role, coins) VALUES %s
+            ON CONFLICT (username) DO NOTHING
+        """, [(e['username'], e['password'], e['role'], e['coins']) for e in self._last_by(group, 'username')])
+
+    def _replay_add_coins(self, cur, group, results):
+        totals = sum_awards((username, amount) for entry in group for username, amount in entry['amounts'].items())
+        execute_values(cur, """
+            UPDATE users u SET coins = u.coins + v.amount
+            FROM (VALUES %s) AS v(username, amount)
+            WHERE u.username = v.username
+        """, list(totals.items()), template="(%s, %s::integer)")
+
+    def _replay_update_user_role(self, cur, group, results):
+        execute_values(cur, """
+            UPDATE users u SET role = v.role
+            FROM (VALUES %s) AS v(username, role)
+            WHERE u.username = v.username
+        """, [(e['username'], e['role']) for e in self._last_by(group, 'username')])
+
+    def _replay_save_user_progress(self, cur, group, results):
+        # Отметки и снятия повторяем по порядку поверх прогресса в базе: отметки до сбоя остаются,
+        # снятые во время сбоя снимаются, порядок задач сохраняется
+        days = sorted({(e['username'], e['date']) for e in group})
+        cur.execute("""
+            SELECT username, date::text AS date, tasks_done FROM user_progress
+            WHERE (username, date) IN (SELECT * FROM unnest(%s::varchar[], %s::date[]))
+            FOR UPDATE
+        """, ([username for username, _ in days], [day for _, day in days]))
+        progress = {(row['username'], row['date']): row['tasks_done'] for row in cur.fetchall()}
+        for entry in group:
+            tasks = progress.setdefault((entry['username'], entry['date']), [])
+            tasks[:] = [task for task in tasks if task not in entry.get('removed', ())]
+            # Запись старого формата - полный список из памяти: объединяем его с базой
+            for task in entry.get('added', entry.get('tasks_done', ())):
+                if task not in tasks:
+                    tasks.append(task)
+        execute_values(cur, """
+            INSERT INTO user_progress (username, date, tasks_done) VALUES %s
+            ON CONFLICT (username, date) DO UPDATE SET tasks_done = EXCLUDED.tasks_done
+        """, [(username, day, json.dumps(progress[username, day])) for username, day in days],
+            template="(%s, %s::date, %s::jsonb)")
+        # Сводки за эти дни проще пересчитать целиком
+        self._rebuild_stats(cur, {e['date'] for e in group})
+
+    def _replay_save_user_position(self, cur, group, results):
+        execute_values(cur, """
+            INSERT INTO user_positions (username, x, y) VALUES %s
+            ON CONFLICT (username) DO UPDATE SET x = EXCLUDED.x, y = EXCLUDED.y, updated_at = CURRENT_TIMESTAMP
+        """, [(e['username'], e['x'], e['y']) for e in self._last_by(group, 'username')])
+
+    def _replay_add_item(self, cur, group, results):
+        # id выделяем заранее, чтобы сопоставить их ключам записей без опоры на порядок RETURNING
+        cur.execute("SELECT nextval(pg_get_serial_sequence('user_inventory', 'id')) AS id "
+                    "FROM generate_series(1, %s)", (len(group),))
+        ids = [row['id'] for row in cur.fetchall()]
+        execute_values(cur, """
+            INSERT INTO user_inventory (id, username, name, description, quantity) VALUES %s
+        """, [(new_id, e['username'], e['name'], e['description'], e['quantity']) for new_id, e in zip(ids, group)])
+        for new_id, entry in zip(ids, group):
+            results[entry['key']] = new_id
+
+    def _replay_update_item(self, cur, group, results):
+        # Несколько изменений одного предмета сливаем в одно
+        merged = {}
+        for entry in group:
+            item_id = results.get(entry['item_key'])
+            if item_id is not None:
+                merged.setdefault((item_id, entry['username']), {}).update(entry['updates'])
+        if not merged:
+            return
+        # Описание меняем по флагу, как в apply_inventory_batch: очищенное описание (пустое или None) тоже изменение
+        execute_values(cur, """
+            UPDATE user_inventory i SET
+                name = COALESCE(v.name, i.name),
+                description = CASE WHEN v.set_description THEN v.description ELSE i.description END,
+                quantity = COALESCE(v.quantity, i.quantity),
+                updated_at = CURRENT_TIMESTAMP
+            FROM (VALUES %s) AS v(id, username, name, description, set_description, quantity)
+            WHERE i.id = v.id AND i.username = v.username
+        """, [(item_id, username, updates.get('name'), updates.get('description'), 'description' in updates,
+               updates.get('quantity')) for (item_id, username), updates in merged.items()],
+            template="(%s::integer, %s, %s::text, %s::text, %s::boolean, %s::integer)")
+
+    def _replay_delete_item(self, cur, group, results):
+        targets = [(results.get(e['item_key']), e['username']) for e in group]
+        targets = [target for target in targets if target[0] is not None]
+        if targets:
+            execute_values(cur, """
+                DELETE FROM user_inventory i USING (VALUES %s) AS v(id, username)
+                WHERE i.id = v.id AND i.username = v.username
+            """, targets, template="(%s::integer, %s)")
+
+    def _replay_activity_events(self, cur, group, results):
+        execute_values(cur, """
+            INSERT INTO activity_events (kind, username, payload, created_at) VALUES %s
+        """, [(e['kind'], e['username'], json.dumps(e['payload'], ensure_ascii=False, default=str), e['created_at'])
+              for entry in group for e in entry['events']])
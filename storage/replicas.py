@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Реплики PostgreSQL только для чтения.
+
+DATABASE_REPLICA_URL - одна или несколько (через запятую) реплик основной
+базы. Database отправляет на них методы чтения из READ_METHODS, но только в
+GET-запросах: фоновые задачи, скрипты и изменяющие запросы читают основную
+базу, чтобы не принимать решений по устаревшим данным (прочитать баланс и
+записать новый).
+
+Чтение своих записей: после любой записи запрос до конца читает основную
+базу, а app.py запоминает время записи в сессии игрока, и следующие
+REPLICA_STICKY_SECONDS секунд его запросы тоже идут на основную базу.
+
+Поток replica-monitor раз в REPLICA_CHECK_INTERVAL секунд проверяет каждую
+реплику: недоступная или отставшая больше чем на REPLICA_MAX_LAG секунд
+исключается, пока не догонит. Ошибка чтения с реплики сразу исключает ее, а
+запрос повторяется на основной базе. Если здоровых реплик нет, все чтения
+идут на основную базу.
+
+Проверить локально можно на двух серверах PostgreSQL: основном и реплике
+потоковой репликации (pg_basebackup -R), DATABASE_URL и DATABASE_REPLICA_URL
+указывают на них. Сервер без репликации тоже подойдет как «реплика» с
+нулевым отставанием - соединения с ним открываются только для чтения.
+"""
+import logging
+import os
+import random
+import threading
+
+import metrics
+
+from .postgres import PostgresBackend
+
+logger = logging.getLogger(__name__)
+
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', '5'))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', '5'))
+# Окно чтения своих записей: не меньше допустимого отставания плюс интервал проверки
+REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', str(REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL)))
+
+# Методы только для чтения, которые можно отправить на реплику
+READ_METHODS = frozenset([
+    'get_user', 'get_all_users', 'get_user_context',
+    'get_tasks_config', 'get_daily_tasks',
+    'get_board_tasks', 'get_board_page', 'count_board_tasks', 'get_archive_page', 'count_archived_tasks',
+    'get_user_progress', 'get_user_all_progress',
+    'get_map_config',
+    'get_user_inventory', 'search_inventory', 'get_inventory_page', 'get_inventory_summary',
+    'get_inventory_owners_page', 'get_inventories_summary',
+    'get_users_page', 'get_users_summary',
+    'get_activity_page', 'get_stats', 'count_active_players',
+])
+# Чтения с побочной записью (get_user_position создает позицию по умолчанию): идут на основную базу,
+# но записью игрока не считаются - иначе каждый просмотр карты отключал бы реплики для его запросов
+PRIMARY_READ_METHODS = frozenset(['get_user_position'])
+
+
+def replica_urls():
+    return [url.strip() for url in os.environ.get('DATABASE_REPLICA_URL', '').split(',') if url.strip()]
+
+
+class ReplicaSet:
+    def __init__(self, urls, max_lag=REPLICA_MAX_LAG, check_interval=REPLICA_CHECK_INTERVAL):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        # Реплику не ждем при запуске: недоступную подключит поток проверки
+        self.replicas = [PostgresBackend(url, max_retries=1, read_only=True) for url in urls]
+        self.lag = {replica: None for replica in self.replicas}
+        self._healthy = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @property
+    def healthy_count(self):
+        return len(self._healthy)
+
+    def start(self):
+        self.check()
+        threading.Thread(target=self._monitor, name='replica-monitor', daemon=True).start()
+
+    def check(self):
+        """Подключает недоступные реплики и оставляет в работе только догнавшие основную базу"""
+        healthy = []
+        for index, replica in enumerate(self.replicas, 1):
+            if not replica.is_connected:
+                try:
+                    replica.connect()
+                except Exception as e:
+                    logger.warning(f"⚠️ Реплика {index} недоступна: {e}")
+                    continue
+            try:
+                lag = replica.replication_lag()
+            finally:
+                replica.release()
+            was_healthy = replica in self._healthy
+            self.lag[replica] = lag
+            if lag is not None and lag <= self.max_lag:
+                healthy.append(replica)
+                if not was_healthy:
+                    logger.info(f"✅ Реплика {index} в работе (отставание {lag:.1f} с)")
+            elif was_healthy:
+                logger.warning(f"⚠️ Реплика {index} исключена: отставание {lag} с, допустимо {self.max_lag} с")
+        with self._lock:
+            self._healthy = healthy
+
+    def pick(self):
+        healthy = self._healthy
+        return random.choice(healthy) if healthy else None
+
+    def mark_failed(self, replica):
+        with self._lock:
+            if replica in self._healthy:
+                self._healthy = [other for other in self._healthy if other is not replica]
+                logger.warning("⚠️ Ошибка чтения с реплики - она исключена до следующей проверки")
+
+    def read(self, primary, name, args, kwargs):
+        """Чтение с реплики; при ошибке или без здоровых реплик - с основной базы"""
+        replica = self.pick()
+        if replica is not None:
+            errors = replica.thread_errors
+            try:
+                result = getattr(replica, name)(*args, **kwargs)
+                if replica.thread_errors == errors:
+                    metrics.DB_READS.inc('replica')
+                    return result
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения {name} с реплики: {e}")
+            replica.release()
+            self.mark_failed(replica)
+        metrics.DB_READS.inc('fallback')
+        return getattr(primary, name)(*args, **kwargs)
+
+    def release(self):
+        for replica in self.replicas:
+            replica.release()
+
+    def close(self):
+        self._stop.set()
+        for replica in self.replicas:
+            replica.close()
+
+    def _monitor(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"❌ Ошибка проверки реплик: {e}")
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Поиск предметов по названию и описанию для хранилища в памяти.
+
+Обратный индекс: слово -> предметы, где оно встречается. Слова лежат еще и в
+отсортированном списке, поэтому префиксный поиск - это bisect и проход по
+соседним словам. Для нечеткого поиска слова проиндексированы по триграммам
+(как pg_trgm в PostgreSQL): кандидаты - слова с общими триграммами, сходство -
+доля общих триграмм. Стоимость запроса зависит от числа разных слов, а не от
+числа предметов.
+"""
+import bisect
+import heapq
+import re
+
+_WORD = re.compile(r'\w+')
+
+# Сколько слов-продолжений берем для одного префикса
+PREFIX_EXPANSION = 200
+# Минимальное сходство по триграммам для нечеткого совпадения
+FUZZY_THRESHOLD = 0.4
+
+# Вес совпадения: слово целиком, начало слова, похожее слово (умножается на сходство)
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.8
+FUZZY_SCORE = 0.6
+
+
+def tokenize(text):
+    return _WORD.findall((text or '').lower().replace('ё', 'е'))
+
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class InvertedIndex:
+    """Индекс документов по ключу (любой hashable); search возвращает [(ключ, оценка)]"""
+
+    def __init__(self):
+        self._postings = {}
+        self._doc_words = {}
+        self._words = []
+        self._trigrams = {}
+
+    def __len__(self):
+        return len(self._doc_words)
+
+    def add(self, key, text):
+        self.remove(key)
+        words = set(tokenize(text))
+        self._doc_words[key] = words
+        for word in words:
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = set()
+                bisect.insort(self._words, word)
+                for gram in trigrams(word):
+                    self._trigrams.setdefault(gram, set()).add(word)
+            postings.add(key)
+
+    def remove(self, key):
+        for word in self._doc_words.pop(key, ()):
+            postings = self._postings[word]
+            postings.discard(key)
+            if postings:
+                continue
+            del self._postings[word]
+            del self._words[bisect.bisect_left(self._words, word)]
+            for gram in trigrams(word):
+                words = self._trigrams[gram]
+                words.discard(word)
+                if not words:
+                    del self._trigrams[gram]
+
+    def _expand(self, term, fuzzy):
+        """Слова индекса, подходящие к слову запроса: {слово: оценка}"""
+        matches = {}
+        start = bisect.bisect_left(self._words, term)
+        for word in self._words[start:start + PREFIX_EXPANSION]:
+            if not word.startswith(term):
+                break
+            matches[word] = EXACT_SCORE if word == term else PREFIX_SCORE
+        if fuzzy and len(term) >= 3:
+            term_grams = trigrams(term)
+            shared = {}
+            for gram in term_grams:
+                for word in self._trigrams.get(gram, ()):
+                    shared[word] = shared.get(word, 0) + 1
+            for word, count in shared.items():
+                similarity = count / (len(term_grams) + len(word) + 1 - count)
+                if similarity >= FUZZY_THRESHOLD:
+                    matches[word] = max(matches.get(word, 0), FUZZY_SCORE * similarity)
+        return matches
+
+    def search(self, query, limit=20, fuzzy=True):
+        """Документы, где каждое слово запроса совпало целиком, по началу или нечетко"""
+        scores = None
+        for term in set(tokenize(query)):
+            term_scores = {}
+            for word, score in self._expand(term, fuzzy).items():
+                for key in self._postings[word]:
+                    if score > term_scores.get(key, 0):
+                        term_scores[key] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {key: total + term_scores[key] for key, total in scores.items() if key in term_scores}
+            if not scores:
+                return []
+        if not scores:
+            return []
+        return heapq.nlargest(limit, scores.items(), key=lambda pair: pair[1])
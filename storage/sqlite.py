@@ -0,0 +1,675 @@
+# -*- coding: utf-8 -*-
+"""Хранилище в SQLite (WAL) для небольших инсталляций на одном сервере и локальных тестов.
+
+У каждого потока свое соединение: в режиме WAL читатели не блокируют писателя,
+а воркеры gunicorn работают с одним файлом базы.
+"""
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+import tracing
+from map_points import PointColumns, encode_active_points
+
+from .base import (StorageBackend, DEFAULT_USERS, DEFAULT_TASKS, DEFAULT_MAP, DEFAULT_POSITION, INVENTORY_BATCH_ORDER,
+                   clamp_coordinate, sum_awards, award_report, public_user, group_inventory_owners, progress_delta,
+                   stats_report)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    role TEXT NOT NULL DEFAULT 'user',
+    coins INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS tasks_config (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    button1 TEXT NOT NULL,
+    button2 TEXT NOT NULL,
+    button3 TEXT NOT NULL,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS daily_tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT UNIQUE NOT NULL,
+    tasks TEXT NOT NULL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS board_tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    text TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'free',
+    user_taken TEXT,
+    taken_at TEXT,
+    done_at TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS user_progress (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    date TEXT NOT NULL,
+    tasks_done TEXT NOT NULL,
+    UNIQUE(username, date)
+);
+CREATE TABLE IF NOT EXISTS map_config (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    start_point TEXT NOT NULL,
+    active_points TEXT NOT NULL,
+    checkpoints TEXT NOT NULL,
+    end_point TEXT NOT NULL,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_by TEXT
+);
+CREATE TABLE IF NOT EXISTS user_positions (
+    username TEXT PRIMARY KEY,
+    x REAL NOT NULL DEFAULT 15,
+    y REAL NOT NULL DEFAULT 75,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS user_inventory (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT,
+    quantity INTEGER NOT NULL DEFAULT 1,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+-- Архив выполненных задач доски (в SQLite без секций по месяцам)
+CREATE TABLE IF NOT EXISTS board_archive (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'done',
+    user_taken TEXT,
+    taken_at TEXT,
+    done_at TEXT NOT NULL,
+    created_at TEXT,
+    archived_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+-- Журнал действий игроков (activity.py): строки только добавляются
+CREATE TABLE IF NOT EXISTS activity_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    username TEXT,
+    payload TEXT NOT NULL DEFAULT '{}',
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_activity_events_username_id ON activity_events (username, id);
+-- Сводки статистики по дням: обновляются в save_user_progress, пересчитываются rebuild_stats
+CREATE TABLE IF NOT EXISTS stats_user_daily (
+    date TEXT NOT NULL,
+    username TEXT NOT NULL,
+    completions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (date, username)
+);
+CREATE TABLE IF NOT EXISTS stats_task_daily (
+    date TEXT NOT NULL,
+    task TEXT NOT NULL,
+    completions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (date, task)
+);
+-- Последние запуски периодических задач (scheduler.py)
+CREATE TABLE IF NOT EXISTS scheduled_jobs (
+    name TEXT PRIMARY KEY,
+    last_run_at TEXT NOT NULL,
+    duration REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_activity_events_created_at ON activity_events (created_at);
+CREATE INDEX IF NOT EXISTS idx_user_inventory_username ON user_inventory (username);
+CREATE INDEX IF NOT EXISTS idx_user_inventory_username_id ON user_inventory (username, id);
+CREATE INDEX IF NOT EXISTS idx_board_tasks_status ON board_tasks (status, id);
+"""
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class SQLiteBackend(StorageBackend):
+    name = 'sqlite'
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('SQLITE_PATH', 'rgg_quest.sqlite3')
+        self._local = threading.local()
+        # Файл блокировки ведущего планировщика рядом с базой: flock снимается ОС при смерти процесса
+        self._leader_lock = None
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.row_factory = _dict_row
+            # Встроенный lower() в SQLite не знает кириллицы
+            conn.create_function('py_lower', 1, lambda text: text.lower() if text else text, deterministic=True)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.set_trace_callback(tracing.record_statement)
+            self._local.conn = conn
+        return conn
+
+    def connect(self):
+        logger.info(f"🔗 SQLite: {self.path}")
+        conn = self.conn
+        conn.executescript(SCHEMA)
+        self.insert_initial_data()
+        logger.info("✅ Таблицы SQLite инициализированы")
+
+    def close(self):
+        self.release_scheduler_lock()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def insert_initial_data(self):
+        with self.conn as conn:
+            if conn.execute("SELECT COUNT(*) AS count FROM users").fetchone()['count'] == 0:
+                conn.executemany("INSERT INTO users (username, password, role, coins) VALUES (?, ?, ?, ?)",
+                                 DEFAULT_USERS)
+            if conn.execute("SELECT COUNT(*) AS count FROM tasks_config").fetchone()['count'] == 0:
+                conn.execute("INSERT INTO tasks_config (button1, button2, button3) VALUES (?, ?, ?)",
+                             (json.dumps(DEFAULT_TASKS['button1']), json.dumps(DEFAULT_TASKS['button2']),
+                              json.dumps(DEFAULT_TASKS['button3'])))
+            if conn.execute("SELECT COUNT(*) AS count FROM map_config").fetchone()['count'] == 0:
+                conn.execute(
+                    "INSERT INTO map_config (start_point, active_points, checkpoints, end_point, updated_by) VALUES (?, ?, ?, ?, ?)",
+                    (json.dumps(DEFAULT_MAP['start_point']),
+                     json.dumps(encode_active_points(DEFAULT_MAP['active_points'])),
+                     json.dumps(DEFAULT_MAP['checkpoints']), json.dumps(DEFAULT_MAP['end_point']), 'system'))
+
+    def _query(self, sql, params=(), one=False):
+        try:
+            cur = self.conn.execute(sql, params)
+            return cur.fetchone() if one else cur.fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка SQLite: {e}")
+            return None if one else []
+
+    def _write(self, sql, params=(), fetch=False):
+        """Выполняет изменение в транзакции; возвращает курсор (или строки RETURNING при fetch), None при ошибке"""
+        try:
+            with self.conn as conn:
+                cur = conn.execute(sql, params)
+                # Строки RETURNING нужно прочитать до коммита
+                return cur.fetchall() if fetch else cur
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка записи SQLite: {e}")
+            return None
+
+    # Пользователи
+    def get_user(self, username):
+        return self._query("SELECT * FROM users WHERE username = ?", (username,), one=True)
+
+    def get_all_users(self):
+        return {user['username']: user for user in self._query("SELECT * FROM users ORDER BY username")}
+
+    def create_user(self, username, password, role='user', coins=0):
+        return self._write("INSERT INTO users (username, password, role, coins) VALUES (?, ?, ?, ?)",
+                           (username, password, role, coins)) is not None
+
+    def update_user_coins(self, username, coins):
+        return self._write("UPDATE users SET coins = ? WHERE username = ?", (coins, username)) is not None
+
+    def update_user_role(self, username, role):
+        cur = self._write("UPDATE users SET role = ? WHERE username = ?", (role, username))
+        return cur is not None and cur.rowcount == 1
+
+    def get_user_context(self, username, date):
+        row = self._query("""
+            SELECT u.*,
+                   COALESCE((SELECT p.tasks_done FROM user_progress p
+                             WHERE p.username = u.username AND p.date = ?), '[]') AS today_done,
+                   (SELECT COALESCE(SUM(json_array_length(p.tasks_done)), 0) FROM user_progress p
+                    WHERE p.username = u.username) AS total_completed
+            FROM users u
+            WHERE u.username = ?
+        """, (date, username), one=True)
+        if not row:
+            return None
+        row['today_done'] = json.loads(row['today_done'])
+        row['total_completed'] = int(row['total_completed'])
+        return row
+
+    def award_coins_all(self, amount):
+        rows = self._write("UPDATE users SET coins = coins + ? RETURNING username", (amount,), fetch=True)
+        return award_report(row['username'] for row in rows) if rows is not None else None
+
+    def award_coins_completed(self, date, amount, task_text=None):
+        if task_text:
+            condition = "EXISTS (SELECT 1 FROM json_each(p.tasks_done) WHERE json_each.value = ?)"
+            params = (amount, date, task_text)
+        else:
+            condition = "json_array_length(p.tasks_done) > 0"
+            params = (amount, date)
+        rows = self._write(f"""
+            UPDATE users SET coins = coins + ?
+            WHERE username IN (SELECT p.username FROM user_progress p WHERE p.date = ? AND {condition})
+            RETURNING username
+        """, params, fetch=True)
+        return award_report(row['username'] for row in rows) if rows is not None else None
+
+    def award_coins_list(self, awards):
+        totals = sum_awards(awards)
+        if not totals:
+            return award_report([])
+        values = ', '.join('(?, ?)' for _ in totals)
+        params = [value for pair in totals.items() for value in pair]
+        rows = self._write(f"""
+            WITH v(username, amount) AS (VALUES {values})
+            UPDATE users SET coins = coins + (SELECT v.amount FROM v WHERE v.username = users.username)
+            WHERE username IN (SELECT username FROM v)
+            RETURNING username
+        """, params, fetch=True)
+        return award_report((row['username'] for row in rows), totals) if rows is not None else None
+
+    # Задачи
+    def get_tasks_config(self):
+        config = self._query("SELECT * FROM tasks_config ORDER BY id DESC LIMIT 1", one=True)
+        if config:
+            return {key: json.loads(config[key]) for key in ('button1', 'button2', 'button3')}
+        return {"button1": [], "button2": [], "button3": []}
+
+    def update_tasks_config(self, tasks):
+        return self._write("INSERT INTO tasks_config (button1, button2, button3) VALUES (?, ?, ?)",
+                           (json.dumps(tasks['button1']), json.dumps(tasks['button2']),
+                            json.dumps(tasks['button3']))) is not None
+
+    def get_daily_tasks(self, date):
+        result = self._query("SELECT tasks FROM daily_tasks WHERE date = ?", (date,), one=True)
+        return json.loads(result['tasks']) if result else None
+
+    def save_daily_tasks(self, date, tasks):
+        return self._write(
+            "INSERT INTO daily_tasks (date, tasks) VALUES (?, ?) ON CONFLICT (date) DO UPDATE SET tasks = excluded.tasks",
+            (date, json.dumps(tasks))) is not None
+
+    def create_daily_tasks(self, date, tasks):
+        cur = self._write("INSERT INTO daily_tasks (date, tasks) VALUES (?, ?) ON CONFLICT (date) DO NOTHING",
+                          (date, json.dumps(tasks)))
+        return cur is not None and cur.rowcount == 1
+
+    # Доска задач
+    def get_board_tasks(self):
+        return self._query("SELECT * FROM board_tasks ORDER BY id")
+
+    def save_board_tasks(self, tasks):
+        try:
+            with self.conn as conn:
+                conn.execute("DELETE FROM board_tasks")
+                conn.executemany(
+                    "INSERT INTO board_tasks (text, difficulty, status, user_taken, taken_at, done_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(task['text'], task['difficulty'], task['status'], task.get('user'), task.get('taken_at'),
+                      task.get('done_at')) for task in tasks])
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка сохранения задач доски: {e}")
+            return False
+
+    def update_board_task(self, task_id, updates):
+        set_clause = ", ".join([f"{key} = ?" for key in updates.keys()])
+        return self._write(f"UPDATE board_tasks SET {set_clause} WHERE id = ?",
+                           [*updates.values(), task_id]) is not None
+
+    # Архив доски
+    def archive_done_tasks(self, older_than, limit=500):
+        done_at = "COALESCE(done_at, taken_at, created_at)"
+        try:
+            with self.conn as conn:
+                ids = [row['id'] for row in conn.execute(
+                    f"SELECT id FROM board_tasks WHERE status = 'done' AND {done_at} < ? ORDER BY id LIMIT ?",
+                    (older_than, limit))]
+                if not ids:
+                    return 0
+                placeholders = ', '.join('?' * len(ids))
+                conn.execute(f"""
+                    INSERT INTO board_archive (id, text, difficulty, status, user_taken, taken_at, done_at, created_at)
+                    SELECT id, text, difficulty, 'done', user_taken, taken_at, {done_at}, created_at
+                    FROM board_tasks WHERE id IN ({placeholders})
+                """, ids)
+                conn.execute(f"DELETE FROM board_tasks WHERE id IN ({placeholders})", ids)
+            return len(ids)
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка переноса задач в архив: {e}")
+            return 0
+
+    def get_archive_page(self, after_id=None, limit=50):
+        if after_id is None:
+            return self._query("SELECT * FROM board_archive ORDER BY id DESC LIMIT ?", (limit,))
+        return self._query("SELECT * FROM board_archive WHERE id < ? ORDER BY id DESC LIMIT ?", (after_id, limit))
+
+    def count_archived_tasks(self):
+        result = self._query("SELECT COUNT(*) AS count FROM board_archive", one=True)
+        return result['count'] if result else 0
+
+    # Прогресс
+    def get_user_progress(self, username, date):
+        result = self._query("SELECT tasks_done FROM user_progress WHERE username = ? AND date = ?",
+                             (username, date), one=True)
+        return json.loads(result['tasks_done']) if result else []
+
+    def save_user_progress(self, username, date, tasks_done):
+        try:
+            with self.conn as conn:
+                previous = conn.execute("SELECT tasks_done FROM user_progress WHERE username = ? AND date = ?",
+                                        (username, date)).fetchone()
+                conn.execute(
+                    "INSERT INTO user_progress (username, date, tasks_done) VALUES (?, ?, ?) "
+                    "ON CONFLICT (username, date) DO UPDATE SET tasks_done = excluded.tasks_done",
+                    (username, date, json.dumps(tasks_done)))
+                user_delta, task_deltas = progress_delta(json.loads(previous['tasks_done']) if previous else [],
+                                                         tasks_done)
+                if user_delta:
+                    conn.execute("INSERT INTO stats_user_daily (date, username, completions) VALUES (?, ?, ?) "
+                                 "ON CONFLICT (date, username) DO UPDATE "
+                                 "SET completions = completions + excluded.completions",
+                                 (date, username, user_delta))
+                conn.executemany("INSERT INTO stats_task_daily (date, task, completions) VALUES (?, ?, ?) "
+                                 "ON CONFLICT (date, task) DO UPDATE SET completions = completions + excluded.completions",
+                                 [(date, task, delta) for task, delta in task_deltas.items()])
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка сохранения прогресса пользователя {username}: {e}")
+            return False
+
+    def get_user_all_progress(self, username):
+        all_tasks = []
+        for result in self._query("SELECT tasks_done FROM user_progress WHERE username = ?", (username,)):
+            all_tasks.extend(json.loads(result['tasks_done']))
+        return all_tasks
+
+    # Статистика
+    def rebuild_stats(self, since=None):
+        params = (since or '',)
+        try:
+            with self.conn as conn:
+                conn.execute("DELETE FROM stats_user_daily WHERE date >= ?", params)
+                conn.execute("DELETE FROM stats_task_daily WHERE date >= ?", params)
+                user_rows = conn.execute("""
+                    INSERT INTO stats_user_daily (date, username, completions)
+                    SELECT date, username, json_array_length(tasks_done) FROM user_progress
+                    WHERE date >= ? AND json_array_length(tasks_done) > 0
+                """, params).rowcount
+                task_rows = conn.execute("""
+                    INSERT INTO stats_task_daily (date, task, completions)
+                    SELECT p.date, t.value, COUNT(*) FROM user_progress p, json_each(p.tasks_done) t
+                    WHERE p.date >= ?
+                    GROUP BY p.date, t.value
+                """, params).rowcount
+            return {'user_rows': user_rows, 'task_rows': task_rows}
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка пересчета статистики: {e}")
+            return None
+
+    def get_stats(self, since, top=10):
+        per_day = self._query("""
+            SELECT date, SUM(completions) AS completions, COUNT(*) AS players
+            FROM stats_user_daily WHERE date >= ? AND completions > 0
+            GROUP BY date ORDER BY date
+        """, (since,))
+        top_players = self._query("""
+            SELECT username, SUM(completions) AS completions FROM stats_user_daily
+            WHERE date >= ? GROUP BY username HAVING SUM(completions) > 0
+            ORDER BY completions DESC, username LIMIT ?
+        """, (since, top))
+        top_tasks = self._query("""
+            SELECT task, SUM(completions) AS completions FROM stats_task_daily
+            WHERE date >= ? GROUP BY task HAVING SUM(completions) > 0
+            ORDER BY completions DESC, task LIMIT ?
+        """, (since, top))
+        return stats_report(per_day, top_players, top_tasks, self.count_active_players(since))
+
+    def count_active_players(self, since):
+        result = self._query("SELECT COUNT(DISTINCT username) AS count FROM stats_user_daily "
+                             "WHERE date >= ? AND completions > 0", (since,), one=True)
+        return result['count'] if result else 0
+
+    # Карта
+    def get_map_config(self):
+        config = self._query("SELECT * FROM map_config ORDER BY id DESC LIMIT 1", one=True)
+        if not config:
+            return None
+        return {
+            'start_point': json.loads(config['start_point']),
+            'active_points': PointColumns.decode(json.loads(config['active_points'])),
+            'checkpoints': json.loads(config['checkpoints']),
+            'end_point': json.loads(config['end_point']),
+            'updated_at': config['updated_at'] or 'Неизвестно',
+            'updated_by': config['updated_by'] or 'system'
+        }
+
+    def save_map_config(self, config, updated_by):
+        return self._write(
+            "INSERT INTO map_config (start_point, active_points, checkpoints, end_point, updated_at, updated_by) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (json.dumps(config['start_point']), json.dumps(encode_active_points(config['active_points'])),
+             json.dumps(config['checkpoints']), json.dumps(config['end_point']),
+             datetime.now().strftime('%Y-%m-%d %H:%M:%S'), updated_by)) is not None
+
+    def prune_map_history(self, keep):
+        cur = self._write("DELETE FROM map_config WHERE id <= "
+                          "(SELECT id FROM map_config ORDER BY id DESC LIMIT 1 OFFSET ?)", (keep,))
+        return cur.rowcount if cur is not None else 0
+
+    def get_user_position(self, username):
+        result = self._query("SELECT x, y FROM user_positions WHERE username = ?", (username,), one=True)
+        if result:
+            return {'x': clamp_coordinate(result['x']), 'y': clamp_coordinate(result['y'])}
+        return dict(DEFAULT_POSITION)
+
+    def save_user_position(self, username, x, y):
+        x = clamp_coordinate(x)
+        y = clamp_coordinate(y)
+        return self._write(
+            "INSERT INTO user_positions (username, x, y) VALUES (?, ?, ?) "
+            "ON CONFLICT (username) DO UPDATE SET x = excluded.x, y = excluded.y, updated_at = CURRENT_TIMESTAMP",
+            (username, x, y)) is not None
+
+    # Инвентарь
+    def get_user_inventory(self, username):
+        return self._query("""
+            SELECT id, name, description, quantity, created_at, updated_at
+            FROM user_inventory
+            WHERE username = ?
+            ORDER BY created_at DESC, id DESC
+        """, (username,))
+
+    def add_item_to_inventory(self, username, name, description, quantity=1):
+        cur = self._write("INSERT INTO user_inventory (username, name, description, quantity) VALUES (?, ?, ?, ?)",
+                          (username, name, description, quantity))
+        return cur.lastrowid if cur else None
+
+    def update_inventory_item(self, username, item_id, updates):
+        set_clause = ", ".join([f"{key} = ?" for key in updates.keys()])
+        return self._write(
+            f"UPDATE user_inventory SET {set_clause}, updated_at = CURRENT_TIMESTAMP WHERE username = ? AND id = ?",
+            [*updates.values(), username, item_id]) is not None
+
+    def delete_inventory_item(self, username, item_id):
+        return self._write("DELETE FROM user_inventory WHERE username = ? AND id = ?",
+                           (username, item_id)) is not None
+
+    def apply_inventory_batch(self, username, operations):
+        # SQLite работает в процессе: запрос на операцию ничего не стоит, важна одна транзакция
+        results = [None] * len(operations)
+        try:
+            with self.conn as conn:
+                applied = sorted(range(len(operations)), key=lambda i: INVENTORY_BATCH_ORDER[operations[i]['op']])
+                for index in applied:
+                    op = operations[index]
+                    if op['op'] == 'add':
+                        results[index] = conn.execute(
+                            "INSERT INTO user_inventory (username, name, description, quantity) VALUES (?, ?, ?, ?)",
+                            (username, op['name'], op['description'], op['quantity'])).lastrowid
+                    elif op['op'] == 'update':
+                        set_clause = ", ".join([f"{key} = ?" for key in op['updates'].keys()])
+                        results[index] = conn.execute(
+                            f"UPDATE user_inventory SET {set_clause}, updated_at = CURRENT_TIMESTAMP "
+                            f"WHERE username = ? AND id = ?",
+                            [*op['updates'].values(), username, op['id']]).rowcount > 0
+                    else:
+                        results[index] = conn.execute("DELETE FROM user_inventory WHERE username = ? AND id = ?",
+                                                      (username, op['id'])).rowcount > 0
+            return results
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка пакетного изменения инвентаря {username}: {e}")
+            return None
+
+    def search_inventory(self, query, limit=20):
+        # Без нечеткого совпадения: каждое слово запроса - подстрока названия или описания
+        words = query.lower().split()
+        if not words:
+            return []
+        document = "py_lower(name || ' ' || COALESCE(description, ''))"
+        patterns = ['%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                    for word in words]
+        where = " AND ".join(f"{document} LIKE ? ESCAPE '\\'" for _ in patterns)
+        return self._query(f"""
+            SELECT id, username, name, description, quantity, 1.0 AS score
+            FROM user_inventory
+            WHERE {where}
+            ORDER BY py_lower(name) LIKE ? ESCAPE '\\' DESC, id DESC
+            LIMIT ?
+        """, [*patterns, patterns[0][1:], limit])
+
+    # Журнал действий
+    def record_activity_events(self, events):
+        try:
+            with self.conn as conn:
+                conn.executemany(
+                    "INSERT INTO activity_events (kind, username, payload, created_at) VALUES (?, ?, ?, ?)",
+                    [(e['kind'], e['username'], json.dumps(e['payload'], ensure_ascii=False, default=str),
+                      e['created_at']) for e in events])
+            return len(events)
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка записи журнала действий: {e}")
+            return None
+
+    def get_activity_page(self, after_id=None, limit=50, username=None):
+        conditions = []
+        params = []
+        if username is not None:
+            conditions.append("username = ?")
+            params.append(username)
+        if after_id is not None:
+            conditions.append("id < ?")
+            params.append(after_id)
+        where = " AND ".join(conditions) or "1"
+        rows = self._query(f"SELECT * FROM activity_events WHERE {where} ORDER BY id DESC LIMIT ?", [*params, limit])
+        for row in rows:
+            row['payload'] = json.loads(row['payload'])
+        return rows
+
+    def prune_activity_events(self, older_than, limit=10000):
+        cur = self._write("DELETE FROM activity_events WHERE id IN "
+                          "(SELECT id FROM activity_events WHERE created_at < ? ORDER BY id LIMIT ?)",
+                          (older_than, limit))
+        return cur.rowcount if cur is not None else 0
+
+    # Планировщик
+    def try_acquire_scheduler_lock(self):
+        if self._leader_lock is not None:
+            return True
+        lock_file = open(f"{self.path}.scheduler.lock", 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._leader_lock = lock_file
+        return True
+
+    def release_scheduler_lock(self):
+        lock_file, self._leader_lock = self._leader_lock, None
+        if lock_file is not None:
+            lock_file.close()
+
+    def get_job_runs(self):
+        return {row.pop('name'): row for row in self._query("SELECT * FROM scheduled_jobs")}
+
+    def record_job_run(self, name, started_at, duration, error=None):
+        return self._write(
+            "INSERT INTO scheduled_jobs (name, last_run_at, duration, error) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET last_run_at = excluded.last_run_at, duration = excluded.duration, "
+            "error = excluded.error", (name, started_at, duration, error)) is not None
+
+    # Постраничная выборка
+    def get_board_page(self, statuses, after_id=None, limit=50, newest_first=False):
+        statuses = list(statuses)
+        where = f"status IN ({', '.join('?' * len(statuses))})"
+        params = statuses
+        if after_id is not None:
+            where += " AND id < ?" if newest_first else " AND id > ?"
+            params = [*statuses, after_id]
+        order = "DESC" if newest_first else "ASC"
+        return self._query(f"SELECT * FROM board_tasks WHERE {where} ORDER BY id {order} LIMIT ?", [*params, limit])
+
+    def count_board_tasks(self, statuses):
+        statuses = list(statuses)
+        result = self._query(f"SELECT COUNT(*) AS count FROM board_tasks WHERE status IN ({', '.join('?' * len(statuses))})",
+                             statuses, one=True)
+        return result['count'] if result else 0
+
+    def get_users_page(self, after=None, limit=50):
+        rows = self._query("""
+            SELECT u.*, p.x, p.y FROM users u LEFT JOIN user_positions p ON p.username = u.username
+            WHERE u.username > ? ORDER BY u.username LIMIT ?
+        """, (after or '', -1 if limit is None else limit))
+        return [public_user(row['username'], row,
+                            {'x': clamp_coordinate(row['x']), 'y': clamp_coordinate(row['y'])}
+                            if row['x'] is not None else None)
+                for row in rows]
+
+    def get_users_summary(self):
+        return self._query("""
+            SELECT COUNT(*) AS users, COALESCE(SUM(role = 'admin'), 0) AS admins,
+                   COALESCE(SUM(coins), 0) AS total_coins, COALESCE(MAX(coins), 0) AS max_coins
+            FROM users
+        """, one=True)
+
+    def get_inventory_page(self, username, after_id=None, limit=50):
+        return self._query("""
+            SELECT id, name, description, quantity, created_at, updated_at
+            FROM user_inventory
+            WHERE username = ? AND id < ?
+            ORDER BY id DESC
+            LIMIT ?
+        """, (username, after_id if after_id is not None else 2 ** 63 - 1, limit))
+
+    def get_inventory_summary(self, username):
+        return self._query("""
+            SELECT COUNT(*) AS items, COALESCE(SUM(quantity > 1), 0) AS stacks, COALESCE(SUM(quantity), 0) AS units
+            FROM user_inventory WHERE username = ?
+        """, (username,), one=True)
+
+    def get_inventory_owners_page(self, after=None, limit=20):
+        rows = self._query("""
+            WITH owners AS (
+                SELECT DISTINCT i.username FROM user_inventory i JOIN users u ON u.username = i.username
+                WHERE i.username > ? ORDER BY i.username LIMIT ?
+            )
+            SELECT u.username, u.coins, i.id, i.name, i.description, i.quantity, i.created_at
+            FROM owners o
+            JOIN users u ON u.username = o.username
+            JOIN user_inventory i ON i.username = o.username
+            ORDER BY u.username, i.id DESC
+        """, (after or '', limit))
+        return group_inventory_owners(rows)
+
+    def get_inventories_summary(self):
+        return self._query("""
+            SELECT COUNT(DISTINCT i.username) AS owners, COUNT(*) AS items,
+                   COALESCE(SUM(i.quantity), 0) AS units, COALESCE(MAX(u.coins), 0) AS max_coins
+            FROM user_inventory i JOIN users u ON u.username = i.username
+        """, one=True)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Выгрузка и загрузка данных (bulk_data.py): текст со спецсимволами не портится"""
+import argparse
+
+import pytest
+
+import bulk_data
+from generate_dataset import CopyStream
+from storage import SQLiteBackend
+
+TRICKY = 'табуляция\tперевод\nвозврат\rслеш\\конец\r\n'
+
+COPY_ESCAPES = {'\\': '\\', 't': '\t', 'n': '\n', 'r': '\r'}
+
+
+def parse_copy_text(data):
+    """Разбор текстового формата COPY, как это делает PostgreSQL: сырые \\n и \\r заканчивают строку"""
+    rows = []
+    for line in data.replace('\r', '\n').split('\n'):
+        if not line:
+            continue
+        row = []
+        for field in line.split('\t'):
+            if field == '\\N':
+                row.append(None)
+                continue
+            chars, index = [], 0
+            while index < len(field):
+                if field[index] == '\\':
+                    index += 1
+                    chars.append(COPY_ESCAPES[field[index]])
+                else:
+                    chars.append(field[index])
+                index += 1
+            row.append(''.join(chars))
+        rows.append(tuple(row))
+    return rows
+
+
+def test_copy_stream_escapes_control_characters():
+    rows = [('user1', TRICKY, None), ('user2', 'обычный текст', '3')]
+    assert parse_copy_text(CopyStream(iter(rows)).read()) == rows
+
+
+@pytest.fixture
+def make_backend(tmp_path):
+    backends = []
+
+    def make(name):
+        backend = SQLiteBackend(str(tmp_path / f'{name}.sqlite3'))
+        backend.connect()
+        backends.append(backend)
+        return backend
+    yield make
+    for backend in backends:
+        backend.close()
+
+
+def test_export_import_round_trip_keeps_text(make_backend, tmp_path):
+    source = make_backend('source')
+    item_id = source.add_item_to_inventory('user1', 'меч\tдвуручный', TRICKY, 2)
+    source.save_board_tasks([{'id': 1, 'text': TRICKY, 'difficulty': 'easy', 'status': 'open'}])
+    args = argparse.Namespace(dir=str(tmp_path / 'dump'), backend='sqlite', tables='users,board_tasks,user_inventory',
+                              batch=2, replace=True)
+    bulk_data.run_export(source, args)
+
+    target = make_backend('target')
+    bulk_data.run_import(target, args)
+
+    [item] = [item for item in target.get_user_inventory('user1') if item['id'] == item_id]
+    assert (item['name'], item['description'], item['quantity']) == ('меч\tдвуручный', TRICKY, 2)
+    assert [task['text'] for task in target.get_board_tasks()] == [TRICKY]
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Пакетные операции с инвентарем (/inventory/batch)"""
+import os
+
+# Хранилище в памяти без файлов и без фоновых потоков
+os.environ['STORAGE_BACKEND'] = 'memory'
+os.environ['MEMORY_STORE_DIR'] = ''
+os.environ['RGG_DEFER_STARTUP'] = '1'
+os.environ['RATE_LIMIT_ENABLED'] = '0'
+
+import pytest  # noqa: E402
+
+import app as app_module  # noqa: E402
+from database import db  # noqa: E402
+from storage import MemoryBackend, SQLiteBackend  # noqa: E402
+
+USERNAME = 'user2'
+CONFLICT = 'Предмет удаляется и изменяется в одном пакете'
+
+
+@pytest.fixture(scope='module', autouse=True)
+def storage():
+    app_module.wait_for_db()
+
+
+@pytest.fixture
+def client():
+    app_module.app.config['TESTING'] = True
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session['username'] = USERNAME
+        session['role'] = 'user'
+    return client
+
+
+def batch(client, *operations):
+    response = client.post('/inventory/batch', json=list(operations))
+    assert response.status_code == 200
+    return response.get_json()['results']
+
+
+def inventory():
+    return {item['id']: (item['name'], item['quantity']) for item in db.get_user_inventory(USERNAME)}
+
+
+def test_batch_returns_results_in_request_order(client):
+    results = batch(client, {'op': 'add', 'name': 'меч'}, {'op': 'add', 'name': 'щит', 'quantity': 2})
+    sword, shield = results[0]['id'], results[1]['id']
+    assert inventory()[sword] == ('меч', 1) and inventory()[shield] == ('щит', 2)
+
+    results = batch(client, {'op': 'delete', 'id': shield}, {'op': 'update', 'id': sword, 'quantity': 3},
+                    {'op': 'update', 'id': sword, 'name': 'меч+1'})
+    assert [result['success'] for result in results] == [True, True, True]
+    assert inventory()[sword] == ('меч+1', 3) and shield not in inventory()
+
+
+def test_delete_with_other_operations_on_same_item_is_rejected(client):
+    [added] = batch(client, {'op': 'add', 'name': 'лук'})
+    [other] = batch(client, {'op': 'add', 'name': 'стрелы', 'quantity': 10})
+
+    results = batch(client, {'op': 'update', 'id': added['id'], 'quantity': 5}, {'op': 'delete', 'id': added['id']},
+                    {'op': 'update', 'id': other['id'], 'quantity': 20})
+
+    assert [(result['success'], result['error']) for result in results] == [(False, CONFLICT), (False, CONFLICT),
+                                                                             (True, None)]
+    assert inventory()[added['id']] == ('лук', 1)
+    assert inventory()[other['id']] == ('стрелы', 20)
+
+
+def test_repeated_delete_is_rejected(client):
+    [added] = batch(client, {'op': 'add', 'name': 'зелье'})
+    results = batch(client, {'op': 'delete', 'id': added['id']}, {'op': 'delete', 'id': added['id']})
+    assert [result['error'] for result in results] == [CONFLICT, CONFLICT]
+    assert added['id'] in inventory()
+
+
+@pytest.mark.parametrize('backend_class', [MemoryBackend, SQLiteBackend])
+def test_backend_batch_ids_follow_operation_order(backend_class, tmp_path):
+    backend = backend_class(str(tmp_path / 'store'))
+    backend.connect()
+    names = [f'предмет {number}' for number in range(10)]
+    ids = backend.apply_inventory_batch(USERNAME, [{'op': 'add', 'name': name, 'description': '', 'quantity': 1}
+                                                   for name in names])
+    by_id = {item['id']: item['name'] for item in backend.get_user_inventory(USERNAME)}
+    assert [by_id[item_id] for item_id in ids] == names
+    backend.close()
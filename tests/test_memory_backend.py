@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Хранилище в памяти: операции и их повтор из журнала (oplog)"""
+import pytest
+
+from storage import MemoryBackend
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = MemoryBackend(store_dir=str(tmp_path))
+    backend.connect()
+    yield backend
+    backend.discard()
+
+
+def reopened(backend):
+    """Новый процесс на тех же файлах: снимка нет, все операции повторяются из журнала"""
+    backend._oplog.flush()
+    restored = MemoryBackend(store_dir=backend.store_dir)
+    restored.connect()
+    return restored
+
+
+def test_award_completed_task_skips_users_without_progress_on_date(backend):
+    backend.save_user_progress('user1', '2026-01-01', ['Задача'])
+    backend.save_user_progress('user2', '2026-01-02', ['Задача'])
+    coins = backend.get_user('user2')['coins']
+
+    report = backend.award_coins_completed('2026-01-01', 5, 'Задача')
+
+    assert report['users'] == ['user1']
+    assert backend.get_user('user2')['coins'] == coins
+    restored = reopened(backend)
+    assert restored.get_user('user1')['coins'] == backend.get_user('user1')['coins']
+    restored.close()
+
+
+def test_archive_replays_with_recorded_time(backend, monkeypatch):
+    backend.save_board_tasks([{'id': 1, 'text': 'Задача', 'status': 'done', 'done_at': '2026-01-01 10:00:00'}])
+    monkeypatch.setattr('storage.memory._now', lambda: '2026-01-10 12:00:00')
+    assert backend.archive_done_tasks('2026-01-05 00:00:00') == 1
+
+    monkeypatch.setattr('storage.memory._now', lambda: '2026-02-01 00:00:00')
+    restored = reopened(backend)
+    assert [task['archived_at'] for task in restored.get_archive_page()] == ['2026-01-10 12:00:00']
+    restored.close()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Журнал сбоя PostgreSQL (storage/journal.py) и его применение при запуске"""
+import os
+import uuid
+from datetime import date
+
+import pytest
+
+import database
+from storage import MemoryBackend, OutageJournal, OutageWriteRejected, PostgresBackend
+
+
+class ReplayedPrimary:
+    """Основная база, которая только принимает журнал и помнит примененные ключи, как journal_applied"""
+
+    def __init__(self):
+        self.applied = {}
+
+    def connect(self):
+        pass
+
+    def replay_journal(self, entries):
+        pending = [entry for entry in entries if entry['key'] not in self.applied]
+        self.applied.update((entry['key'], entry) for entry in pending)
+        return len(pending)
+
+    def release(self):
+        pass
+
+
+@pytest.fixture
+def outage_files(tmp_path, monkeypatch):
+    paths = {'store': str(tmp_path / 'memory_store'), 'journal': str(tmp_path / 'outage_journal.jsonl')}
+    monkeypatch.setenv('STORAGE_BACKEND', 'postgres')
+    monkeypatch.setenv('MEMORY_STORE_DIR', paths['store'])
+    monkeypatch.setenv('OUTAGE_JOURNAL', paths['journal'])
+    monkeypatch.setenv('DATABASE_REPLICA_URL', '')
+    return paths
+
+
+def test_restart_replays_pending_journal_and_drops_memory_store(outage_files, monkeypatch):
+    # Процесс упал во время сбоя: остались снимок памяти и журнал
+    memory = MemoryBackend()
+    memory.connect()
+    journal = OutageJournal()
+    journal.add_item_to_inventory(memory, 'user1', 'меч', '', 1)
+    memory.close()
+    primary = ReplayedPrimary()
+    monkeypatch.setattr(database, 'create_backend', lambda name, **options: primary)
+
+    db = database.Database()
+    db.connect()
+
+    assert db.backend is primary
+    assert [entry['op'] for entry in primary.applied.values()] == ['add_item']
+    assert not os.path.exists(outage_files['journal'])
+    assert not os.listdir(outage_files['store'])
+    # Следующий сбой начинается с пустой памяти, а не со старых id предметов
+    memory = MemoryBackend()
+    memory.connect()
+    assert memory.get_user_inventory('user1') == []
+    memory.discard()
+
+
+@pytest.fixture
+def outage(tmp_path):
+    """Сбой: записи идут в память и в журнал"""
+    memory = MemoryBackend(store_dir='')
+    memory.connect()
+    return memory, OutageJournal(str(tmp_path / 'outage_journal.jsonl'))
+
+
+def test_progress_is_journaled_as_marks_and_unmarks(outage):
+    memory, journal = outage
+    journal.save_user_progress(memory, 'user1', '2026-01-01', ['a', 'b'])
+    journal.save_user_progress(memory, 'user1', '2026-01-01', ['b'])
+
+    assert [(entry['added'], entry['removed']) for entry in journal.entries()] == [(['a', 'b'], []), ([], ['a'])]
+
+
+def test_items_from_before_outage_are_rejected(outage):
+    memory, journal = outage
+    old_id = memory.add_item_to_inventory('user1', 'старый', '', 1)
+    new_id = journal.add_item_to_inventory(memory, 'user1', 'новый', '', 1)
+
+    with pytest.raises(OutageWriteRejected):
+        journal.update_inventory_item(memory, 'user1', old_id, {'quantity': 5})
+    with pytest.raises(OutageWriteRejected):
+        journal.delete_inventory_item(memory, 'user1', old_id)
+    # Пакет - одна транзакция: из-за старого предмета не применяется и изменение нового
+    with pytest.raises(OutageWriteRejected):
+        journal.apply_inventory_batch(memory, 'user1', [{'op': 'update', 'id': new_id, 'updates': {'quantity': 3}},
+                                                        {'op': 'delete', 'id': old_id}])
+
+    assert {item['id']: item['quantity'] for item in memory.get_user_inventory('user1')} == {old_id: 1, new_id: 1}
+    assert [entry['op'] for entry in journal.entries()] == ['add_item']
+    assert journal.update_inventory_item(memory, 'user1', new_id, {'quantity': 3})
+    assert [entry['op'] for entry in journal.entries()] == ['add_item', 'update_item']
+
+
+requires_postgres = pytest.mark.skipif(not os.environ.get('TEST_DATABASE_URL'),
+                                       reason='нужен TEST_DATABASE_URL - тестовая база PostgreSQL')
+
+
+@pytest.fixture
+def postgres():
+    backend = PostgresBackend(os.environ['TEST_DATABASE_URL'], max_retries=1)
+    backend.connect()
+    username = f'journal_{uuid.uuid4().hex[:8]}'
+    yield backend, username
+    cur = backend.conn.cursor()
+    for table in ('users', 'user_progress', 'user_inventory', 'user_positions', 'stats_user_daily'):
+        cur.execute(f"DELETE FROM {table} WHERE username = %s", (username,))
+    backend.conn.commit()
+    cur.close()
+    backend.close()
+
+
+@requires_postgres
+def test_replay_applies_journal_once(postgres, outage):
+    primary, username = postgres
+    memory, journal = outage
+    today = date.today().strftime('%Y-%m-%d')
+    # Отметка, сделанная до сбоя: в памяти ее нет
+    primary.create_user(username, 'x')
+    primary.save_user_progress(username, today, ['до сбоя'])
+
+    journal.create_user(memory, username, 'x')
+    journal.update_user_coins(memory, username, 5)
+    item_id = journal.add_item_to_inventory(memory, username, 'меч', 'острый', 1)
+    journal.update_inventory_item(memory, username, item_id, {'description': ''})
+    journal.save_user_progress(memory, username, today, ['a', 'b'])
+    journal.save_user_progress(memory, username, today, ['b'])
+    entries = journal.entries()
+
+    assert primary.replay_journal(entries) == len(entries)
+    # Повтор (например, хвост журнала после сбоя посреди переключения) ничего не задваивает
+    assert primary.replay_journal(entries) == 0
+
+    assert primary.get_user(username)['coins'] == 5
+    assert [(item['name'], item['description']) for item in primary.get_user_inventory(username)] == [('меч', '')]
+    assert primary.get_user_progress(username, today) == ['до сбоя', 'b']
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Ограничение частоты запросов: token bucket в общей памяти процессов"""
+import multiprocessing
+
+import pytest
+
+from ratelimit import RateLimiter, parse_limits
+
+
+@pytest.fixture
+def limiter():
+    return RateLimiter(limits=parse_limits('', {'login': (3, 3, 'ip')}), slots=64)
+
+
+def test_bucket_limits_burst_and_refills(limiter):
+    assert [limiter.take('ip', rate=1, burst=3, now=100) for _ in range(3)] == [0, 0, 0]
+    assert limiter.take('ip', rate=1, burst=3, now=100) == pytest.approx(1)
+    # За полсекунды набралось полтокена: ждать еще половину
+    assert limiter.take('ip', rate=1, burst=3, now=100.5) == pytest.approx(0.5)
+    assert limiter.take('ip', rate=1, burst=3, now=101) == 0
+    # Долгий простой восполняет ведро только до burst
+    assert [limiter.take('ip', rate=1, burst=3, now=1000) for _ in range(4)][-1] == pytest.approx(1)
+
+
+def test_check_applies_rule_to_mutating_requests_only(limiter):
+    assert [limiter.check('login', 'POST', None, '10.0.0.1') for _ in range(3)] == [0, 0, 0]
+    assert limiter.check('login', 'POST', None, '10.0.0.1') > 0
+    assert limiter.check('login', 'GET', None, '10.0.0.1') == 0
+    assert limiter.check('login', 'POST', None, '10.0.0.2') == 0
+    assert limiter.check('index', 'POST', None, '10.0.0.1') == 0
+
+
+def test_limit_is_shared_across_forked_processes(limiter):
+    context = multiprocessing.get_context('fork')
+    allowed = context.Queue()
+
+    def worker():
+        # Ведро почти не восполняется за время теста: пропустить можно только burst запросов на всех
+        allowed.put(sum(1 for _ in range(20) if limiter.take('shared', rate=1e-6, burst=10) == 0))
+
+    processes = [context.Process(target=worker) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(10)
+    assert sum(allowed.get(timeout=5) for _ in processes) == 10
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""Маршрутизация чтений Database между основной базой и репликами"""
+import pytest
+
+from database import Database
+from storage import MemoryBackend, ReplicaSet
+
+
+class Primary(MemoryBackend):
+    name = 'postgres'
+
+
+class Replica(MemoryBackend):
+    thread_errors = 0
+
+
+@pytest.fixture
+def db():
+    primary = Primary(store_dir='')
+    primary.connect()
+    replica = Replica(store_dir='')
+    replica.connect()
+    replica.update_user_coins('user1', 777)
+    replicas = ReplicaSet([])
+    replicas.replicas = replicas._healthy = [replica]
+    db = Database()
+    db.backend, db.replicas = primary, replicas
+    db.begin_request(True)
+    yield db
+    db.release()
+
+
+def test_get_reads_from_replica(db):
+    assert db.get_user('user1')['coins'] == 777
+    assert not db.wrote_in_request
+
+
+def test_write_pins_request_to_primary(db):
+    db.save_user_position('user1', 10, 10)
+    assert db.wrote_in_request
+    assert db.get_user('user1')['coins'] != 777
+
+
+def test_position_lookup_reads_primary_without_pinning(db):
+    db.backend.save_user_position('user1', 40, 60)
+    assert db.get_user_position('user1') == {'x': 40, 'y': 60}
+    assert not db.wrote_in_request
+    assert db.get_user('user1')['coins'] == 777
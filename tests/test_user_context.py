@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Контекст текущего пользователя загружается из хранилища один раз за запрос,
+а число SQL-запросов страницы не зависит от числа игроков"""
+import os
+
+# Хранилище в памяти без файлов и без фоновых потоков
+os.environ['STORAGE_BACKEND'] = 'memory'
+os.environ['MEMORY_STORE_DIR'] = ''
+os.environ['RGG_DEFER_STARTUP'] = '1'
+os.environ['RATE_LIMIT_ENABLED'] = '0'
+
+import pytest  # noqa: E402
+
+import app as app_module  # noqa: E402
+from database import db  # noqa: E402
+from storage import SQLiteBackend  # noqa: E402
+
+USERNAME = 'user1'
+# Методы, которые читают данные текущего пользователя в обход контекста
+USER_READS = ('get_user', 'get_user_progress', 'get_user_all_progress')
+# Игроков в базе для проверки числа запросов: запрос на каждого сразу превысит бюджет
+PLAYERS = 30
+# SQL-запросов на страницу с прогретыми кэшами: контекст игрока и (для карты) игроки с позициями
+QUERY_BUDGET = {'/': 2, '/map': 2}
+
+
+@pytest.fixture(scope='module', autouse=True)
+def storage():
+    app_module.wait_for_db()
+    yield
+    db.close()
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Вызовы методов бэкенда за тест: [(имя, аргументы)]"""
+    recorded = []
+    backend = db.backend
+    for name in dir(type(backend)):
+        method = getattr(backend, name)
+        if name.startswith('_') or not callable(method):
+            continue
+
+        def counted(*args, _name=name, _method=method, **kwargs):
+            recorded.append((_name, args))
+            return _method(*args, **kwargs)
+        monkeypatch.setattr(backend, name, counted)
+    return recorded
+
+
+@pytest.fixture
+def client():
+    app_module.app.config['TESTING'] = True
+    return app_module.app.test_client()
+
+
+def logged_in(client):
+    with client.session_transaction() as session:
+        session['username'] = USERNAME
+        session['role'] = 'user'
+    return client
+
+
+def assert_context_loaded_once(calls):
+    assert [name for name, _ in calls].count('get_user_context') == 1
+    assert [(name, args) for name, args in calls if name in USER_READS and args[:1] == (USERNAME,)] == []
+
+
+@pytest.mark.parametrize('path', ['/', '/map'])
+def test_page_loads_user_context_once(client, calls, path):
+    response = logged_in(client).get(path)
+    assert response.status_code == 200
+    assert_context_loaded_once(calls)
+
+
+def test_cookie_login_reuses_user_context(client, calls):
+    client.set_cookie('remembered_user', USERNAME)
+    response = client.get('/')
+    assert response.status_code == 200
+    with client.session_transaction() as session:
+        assert session['username'] == USERNAME
+    assert_context_loaded_once(calls)
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """SQLite вместо памяти: его запросы видны трассировке (tracing.record_statement)"""
+    backend = SQLiteBackend(str(tmp_path / 'rgg.sqlite3'))
+    backend.connect()
+    for number in range(PLAYERS):
+        backend.create_user(f'player{number}', 'x')
+        backend.save_user_position(f'player{number}', number, number)
+    monkeypatch.setattr(db, 'backend', backend)
+    monkeypatch.setattr(app_module, 'QUERY_TRACE_HEADER', True)
+    app_module._data_cache.clear()
+    yield backend
+    app_module._data_cache.clear()
+    backend.close()
+
+
+def query_count(response):
+    summary = dict(part.split('=', 1) for part in response.headers['X-Query-Summary'].split('; '))
+    assert 'n+1' not in summary, summary['n+1']
+    return int(summary['queries'])
+
+
+@pytest.mark.parametrize('path', ['/', '/map'])
+def test_page_query_count_is_bounded(client, sqlite_db, path):
+    logged_in(client).get(path)  # кэши страницы (задачи, карта) прогреваются первым запросом
+    response = client.get(path)
+    assert response.status_code == 200
+    assert query_count(response) <= QUERY_BUDGET[path]
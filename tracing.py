@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Трассировка SQL-запросов.
+
+TracingCursor подключается как cursor_factory соединения PostgreSQL, поэтому
+через него проходят все запросы PostgresBackend и любые прямые db.conn.cursor().
+Соединения SQLite сообщают о запросах через set_trace_callback (record_statement).
+Для каждого запроса запоминаются нормализованный SQL, форма параметров,
+длительность и маршрут. Медленные запросы пишутся в лог, повторы одного и
+того же запроса в рамках одного HTTP-запроса помечаются как N+1.
+"""
+import logging
+import os
+import re
+import time
+
+from flask import g, has_request_context, request
+from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger('tracing')
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))
+
+_whitespace = re.compile(r'\s+')
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_value = r'(?:\?|%s)(?:::\w+)?'
+_value_groups = re.compile(rf'(\({_value}(?:, ?{_value})*\))(?:, ?\({_value}(?:, ?{_value})*\))+')
+
+
+def normalize_sql(query):
+    """SQL без литералов и лишних пробелов: одинаковые по форме запросы совпадают"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    elif not isinstance(query, str):
+        query = str(query)
+    query = _whitespace.sub(' ', query).strip()
+    query = _literals.sub('?', query)
+    return _value_groups.sub(r'\1, ...', query)
+
+
+def params_shape(params):
+    """Типы параметров без значений: ('str', 'int') или {'key': 'str'}"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        return tuple(f'list[{len(value)}]' if isinstance(value, (list, tuple)) else type(value).__name__
+                     for value in params)
+    return type(params).__name__
+
+
+def current_route():
+    if has_request_context():
+        return request.endpoint or request.path
+    return None
+
+
+def record_query(query, params, duration):
+    sql = normalize_sql(query)
+    route = current_route()
+    duration_ms = duration * 1000
+
+    if duration_ms >= SLOW_QUERY_MS:
+        logger.warning(f"🐢 Медленный запрос {duration_ms:.1f} мс [{route or 'фон'}] "
+                       f"params={params_shape(params)}: {sql[:500]}")
+
+    if route is not None:
+        trace = g.setdefault('query_trace', [])
+        trace.append((sql, params_shape(params), duration_ms))
+
+
+def record_statement(statement):
+    """Колбэк sqlite3 set_trace_callback: время выполнения SQLite не сообщает"""
+    record_query(statement, None, 0.0)
+
+
+class TracingCursor(RealDictCursor):
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, vars, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(query, None, time.perf_counter() - started)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_query(sql, None, time.perf_counter() - started)
+
+
+def request_summary():
+    """Итоги по текущему HTTP-запросу: (число запросов, общее время мс, N+1 [(sql, повторы)])"""
+    trace = g.get('query_trace') or []
+    counts = {}
+    for sql, shape, _ in trace:
+        counts[sql] = counts.get(sql, 0) + 1
+    repeated = sorted(((sql, n) for sql, n in counts.items() if n >= N_PLUS_ONE_THRESHOLD),
+                      key=lambda item: -item[1])
+    return len(trace), sum(duration for _, _, duration in trace), repeated
+
+
+def finish_request(response, with_header=False):
+    """Логирует N+1 и (в режиме отладки) добавляет заголовок X-Query-Summary"""
+    count, total_ms, repeated = request_summary()
+    for sql, n in repeated:
+        logger.warning(f"🔁 Возможный N+1 в {current_route()}: {n} одинаковых запросов: {sql[:300]}")
+
+    if with_header:
+        summary = f"queries={count}; time={total_ms:.1f}ms"
+        if repeated:
+            summary += '; n+1=' + ' | '.join(f"{n}x {sql[:80]}" for sql, n in repeated[:3])
+        response.headers['X-Query-Summary'] = summary.encode('ascii', 'replace').decode('ascii')
+    return response